@@ -0,0 +1,98 @@
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from cohmo.history import HistoryManager
+from cohmo.persister import Persister
+
+# Micro-benchmark of HistoryManager.get_corrections on a synthetic history,
+# comparing the indexed queries with a linear scan of all the corrections.
+# It also reports the memory taken by the loaded history (measured with
+# tracemalloc, which slows down the loading) and the time taken by the
+# deletions and the additions of corrections (with the deferred persistence,
+# so that the file is not rewritten at every deletion).
+# Usage: python benchmarks/history_benchmark.py [number of rows]
+
+TABLES = ['{0}{1}'.format(p, t) for p in range(1, 7) for t in 'ABCD']
+TEAMS = ['T{0:03d}'.format(i) for i in range(110)]
+REPETITIONS = 50
+DELETIONS = 1000
+
+def generate_history(rows_num):
+    with tempfile.NamedTemporaryFile('w', delete=False, newline='') as history_file:
+        for i in range(rows_num):
+            start_time = random.randint(0, 10**7)
+            history_file.write('{0},{1},{2},{3},ID{4}\n'.format(
+                random.choice(TEAMS), random.choice(TABLES), start_time,
+                start_time + random.randint(600, 1800), i))
+        return history_file.name
+
+def linear_scan(history, filters):
+    return [correction for correction in history.corrections.values()
+            if HistoryManager.satisfies_filters(correction, filters)]
+
+def measure(function):
+    start = time.perf_counter()
+    for _ in range(REPETITIONS):
+        result = function()
+    return (time.perf_counter() - start) / REPETITIONS, result
+
+def main():
+    rows_num = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    path = generate_history(rows_num)
+    try:
+        start = time.perf_counter()
+        history = HistoryManager(path)
+        print('Loaded {0} corrections in {1:.3f}s.'.format(
+            rows_num, time.perf_counter() - start))
+        del history
+        tracemalloc.start()
+        history = HistoryManager(path)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print('The history takes {0:.1f} MB ({1:.0f} bytes per correction).'.format(
+            memory / 2**20, memory / rows_num))
+        queries = [
+            {'identifier': 'ID{0}'.format(rows_num // 2)},
+            {'table': '3B'},
+            {'team': 'T042'},
+            {'table': '3B', 'team': 'T042'},
+            {'start_time': (10**6, 10**6 + 36000)},
+            {'table': '3B', 'end_time': (0, 10**5)},
+        ]
+        print('{0:<55} {1:>12} {2:>12} {3:>9}'.format(
+            'filters', 'scan (ms)', 'index (ms)', 'speedup'))
+        for filters in queries:
+            scan_time, scan_result = measure(lambda: linear_scan(history, filters))
+            index_time, index_result = measure(lambda: history.get_corrections(filters))
+            assert(sorted(c.id for c in scan_result) == sorted(c.id for c in index_result))
+            print('{0:<55} {1:>12.3f} {2:>12.3f} {3:>8.1f}x'.format(
+                str(filters), scan_time * 1000, index_time * 1000,
+                scan_time / index_time))
+        persister = Persister(3600)
+        history = HistoryManager(path, persister=persister)
+        try:
+            deleted = [history.corrections[identifier] for identifier in
+                       random.sample(list(history.corrections), DELETIONS)]
+            start = time.perf_counter()
+            for correction in deleted:
+                assert(history.delete(correction.id))
+            delete_time = (time.perf_counter() - start) / DELETIONS
+            start = time.perf_counter()
+            for correction in deleted:
+                assert(history.add(correction.team, correction.table,
+                                   correction.start_time, correction.end_time))
+            add_time = (time.perf_counter() - start) / DELETIONS
+            print('Deleted {0} corrections in {1:.1f}us each, added them back in {2:.1f}us each.'.format(
+                DELETIONS, delete_time * 10**6, add_time * 10**6))
+        finally:
+            persister.close()
+    finally:
+        os.unlink(path)
+
+if __name__ == '__main__':
+    main()
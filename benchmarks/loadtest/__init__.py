@@ -0,0 +1,2 @@
+# Load test of the coordination API on a synthetic olympiad.
+# Usage: python -m benchmarks.loadtest --help (from the root of the repository)
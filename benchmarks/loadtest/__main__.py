@@ -0,0 +1,174 @@
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.loadtest.data import generate_olympiad
+from benchmarks.loadtest.runner import run_load, measure_io
+from benchmarks.loadtest.workload import Workload, FlaskClient, HTTPClient
+
+# Load test of the coordination API on a synthetic olympiad.
+# Many clients, each in its own thread, perform a mix of polls of the tables,
+# queue modifications, calls and history queries (see workload.py), against
+# the app in the same process (through the Flask test client) and/or against
+# a gunicorn server. The results (throughput, latency percentiles and average
+# I/O of each operation) are printed as json, so that runs can be compared.
+# Usage, from the root of the repository:
+#   python -m benchmarks.loadtest --mode both --clients 16 --requests 500
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.loadtest',
+                                     description='Load test of the coordination API.')
+    parser.add_argument('--mode', choices=['flask', 'gunicorn', 'both'],
+                        default='flask')
+    parser.add_argument('--tables', type=int, default=18)
+    parser.add_argument('--teams', type=int, default=110)
+    parser.add_argument('--problems', type=int, default=6)
+    parser.add_argument('--history', type=int, default=1000,
+                        help='number of corrections in the history')
+    parser.add_argument('--clients', type=int, default=8,
+                        help='number of concurrent clients')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='number of requests of each client')
+    parser.add_argument('--io-samples', type=int, default=20,
+                        help='requests of each operation used to measure the I/O')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='number of gunicorn workers')
+    parser.add_argument('--worker-threads', type=int, default=4,
+                        help='number of threads of each gunicorn worker')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='overrides a configuration value (VALUE is json)')
+    parser.add_argument('--output', help='file where the results are written')
+    return parser.parse_args()
+
+# Returns the configuration overrides given with --set.
+def parse_overrides(assignments):
+    overrides = {}
+    for assignment in assignments:
+        if '=' not in assignment:
+            raise ValueError('The override \'{0}\' is not of the form KEY=VALUE.'.format(assignment))
+        key, value = assignment.split('=', 1)
+        try:
+            overrides[key] = json.loads(value)
+        except ValueError:
+            overrides[key] = value
+    return overrides
+
+# Generates a new synthetic olympiad in directory and returns the
+# configuration of the app, the names of the tables and the teams.
+def prepare_olympiad(directory, args):
+    os.makedirs(directory)
+    config = generate_olympiad(directory, args.tables, args.teams, args.problems,
+                               args.history, args.seed)
+    config.update(parse_overrides(args.set))
+    with open(config['TEAMS_FILE_PATH']) as teams_file:
+        teams = teams_file.read().split(',')
+    return config, list(config['TABLE_FILE_PATHS']), teams
+
+def run_flask(directory, args):
+    from cohmo import app
+    import cohmo.views
+    config, table_names, teams = prepare_olympiad(directory, args)
+    app.config.update(config)
+    cohmo.views.init_chief()
+    cohmo.views.init_authentication_manager()
+    workloads = [Workload(FlaskClient(app), table_names, teams, seed=args.seed + i)
+                 for i in range(args.clients)]
+    result = run_load(workloads, args.requests)
+    result['io'] = measure_io(
+        Workload(FlaskClient(app), table_names, teams, seed=args.seed - 1),
+        lambda: [os.getpid()], args.io_samples)
+    cohmo.views.chief.close()
+    return result
+
+def get_free_port():
+    with socket.socket() as free_socket:
+        free_socket.bind(('127.0.0.1', 0))
+        return free_socket.getsockname()[1]
+
+# Returns the pids of the children of the process (the gunicorn workers).
+def get_children(pid):
+    try:
+        with open('/proc/{0}/task/{0}/children'.format(pid)) as children_file:
+            return [int(child) for child in children_file.read().split()]
+    except OSError:
+        return []
+
+# Waits until the server answers the requests.
+def wait_for_server(server, port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('gunicorn exited with code {0}.'.format(server.returncode))
+        client = HTTPClient('127.0.0.1', port)
+        try:
+            if client.request('GET', '/tables/get_all')[0] == 200: return
+        except OSError:
+            pass
+        finally:
+            client.close()
+        time.sleep(0.1)
+    raise RuntimeError('gunicorn did not start in {0} seconds.'.format(timeout))
+
+def run_gunicorn(directory, args):
+    gunicorn = shutil.which('gunicorn')
+    if gunicorn is None:
+        raise RuntimeError('gunicorn is not installed.')
+    config, table_names, teams = prepare_olympiad(directory, args)
+    # The workers must share the state.
+    if args.workers > 1: config.setdefault('STATE_BACKEND', 'file')
+    config_path = os.path.join(directory, 'config.json')
+    with open(config_path, 'w') as config_file:
+        json.dump(config, config_file)
+    port = get_free_port()
+    server = subprocess.Popen(
+        [gunicorn, '--chdir', ROOT, '--workers', str(args.workers),
+         '--threads', str(args.worker_threads),
+         '--bind', '127.0.0.1:{0}'.format(port), '--log-level', 'warning',
+         'benchmarks.loadtest.wsgi_app:application'],
+        env=dict(os.environ, COHMO_LOADTEST_CONFIG=config_path))
+    try:
+        wait_for_server(server, port)
+        workloads = [Workload(HTTPClient('127.0.0.1', port), table_names, teams,
+                              seed=args.seed + i)
+                     for i in range(args.clients)]
+        result = run_load(workloads, args.requests)
+        for workload in workloads: workload.client.close()
+        workload = Workload(HTTPClient('127.0.0.1', port), table_names, teams,
+                            seed=args.seed - 1)
+        result['io'] = measure_io(
+            workload, lambda: [server.pid] + get_children(server.pid),
+            args.io_samples)
+        workload.client.close()
+    finally:
+        server.terminate()
+        server.wait()
+    return result
+
+def main():
+    args = parse_arguments()
+    # The app reads the default configuration with paths relative to the root.
+    os.chdir(ROOT)
+    modes = ['flask', 'gunicorn'] if args.mode == 'both' else [args.mode]
+    results = {'parameters': vars(args), 'results': {}}
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in modes:
+            run = run_flask if mode == 'flask' else run_gunicorn
+            results['results'][mode] = run(os.path.join(directory, mode), args)
+    output = json.dumps(results, indent=4)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+
+if __name__ == '__main__':
+    main()
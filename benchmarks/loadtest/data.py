@@ -0,0 +1,70 @@
+import csv
+import json
+import os
+import random
+import string
+
+# The credentials of the administrator of the synthetic olympiad.
+ADMIN_USERNAME = 'admin'
+ADMIN_PASSWORD = 'pass'
+
+# Generates the data of a synthetic olympiad in directory, in the same formats
+# used in test_data/, and returns the configuration (the paths of the files)
+# to be given to the app.
+# The tables are split among the problems (and named 1A, 1B, ..., 2A, ...) and
+# the teams are split among the tables of each problem, so that every team is
+# in the queue of exactly one table per problem. The history contains
+# history_size random corrections.
+def generate_olympiad(directory, tables_num=18, teams_num=110, problems_num=6,
+                      history_size=1000, seed=0):
+    if not 1 <= problems_num <= tables_num <= problems_num * len(string.ascii_uppercase):
+        raise ValueError('There must be between 1 and 26 tables for each problem.')
+    rng = random.Random(seed)
+    teams = ['T{0:03d}'.format(i) for i in range(teams_num)]
+    config = {
+        'TEAMS_FILE_PATH': os.path.join(directory, 'teams.txt'),
+        'TABLE_FILE_PATHS': {},
+        'HISTORY_FILE_PATH': os.path.join(directory, 'history.csv'),
+        'AUTHENTICATION_FILE_PATH': os.path.join(directory, 'auth_list.json'),
+        'JOURNAL_FILE_PATH': os.path.join(directory, 'journal.log'),
+        'STATE_FILE_PATH': os.path.join(directory, 'state.lock'),
+        'SQLITE_FILE_PATH': os.path.join(directory, 'cohmo.sqlite'),
+    }
+
+    with open(config['TEAMS_FILE_PATH'], 'w', newline='') as teams_file:
+        teams_file.write(','.join(teams))
+
+    authentications = {ADMIN_USERNAME: {'password': ADMIN_PASSWORD,
+                                        'authorizations': [], 'admin': True}}
+    for problem in range(1, problems_num + 1):
+        problem_tables_num = tables_num // problems_num
+        if problem <= tables_num % problems_num: problem_tables_num += 1
+        shuffled_teams = teams[:]
+        rng.shuffle(shuffled_teams)
+        for i in range(problem_tables_num):
+            name = '{0}{1}'.format(problem, string.ascii_uppercase[i])
+            path = os.path.join(directory, 'T{0}.json'.format(name))
+            with open(path, 'w', newline='') as table_file:
+                json.dump({'name': name,
+                           'problem': str(problem),
+                           'coordinators': ['Coordinator {0}1'.format(name),
+                                            'Coordinator {0}2'.format(name)],
+                           'queue': shuffled_teams[i::problem_tables_num],
+                           'status': 'VACANT'}, table_file, indent=4)
+            config['TABLE_FILE_PATHS'][name] = path
+            authentications[name] = {'password': name, 'authorizations': [name]}
+
+    table_names = list(config['TABLE_FILE_PATHS'])
+    with open(config['HISTORY_FILE_PATH'], 'w', newline='') as history_file:
+        history_writer = csv.writer(history_file, delimiter=',', quotechar='"',
+                                    quoting=csv.QUOTE_MINIMAL)
+        for i in range(history_size):
+            start_time = rng.randint(0, 10**6)
+            history_writer.writerow([rng.choice(teams), rng.choice(table_names),
+                                     start_time,
+                                     start_time + rng.randint(600, 1800),
+                                     'ID{0}'.format(i)])
+
+    with open(config['AUTHENTICATION_FILE_PATH'], 'w', newline='') as auth_file:
+        json.dump(authentications, auth_file, indent=4)
+    return config
@@ -0,0 +1,97 @@
+import math
+import os
+import threading
+import time
+
+# Returns the statistics, in milliseconds, of a list of latencies in seconds.
+# The percentiles are computed with the nearest-rank method.
+def latency_statistics(latencies):
+    latencies = sorted(latencies)
+    def percentile(p):
+        return latencies[max(math.ceil(p / 100 * len(latencies)) - 1, 0)] * 1000
+    return {'mean': sum(latencies) / len(latencies) * 1000,
+            'p50': percentile(50),
+            'p90': percentile(90),
+            'p99': percentile(99),
+            'max': latencies[-1] * 1000}
+
+# Runs len(workloads) workloads at the same time, each in its own thread and
+# performing requests_num operations. Returns the throughput and, for each
+# operation, the number of requests, of errors (responses whose status code
+# is not 200) and the statistics of the latencies.
+def run_load(workloads, requests_num):
+    barrier = threading.Barrier(len(workloads) + 1)
+    samples = [[] for _ in workloads]
+
+    def run(workload, workload_samples):
+        barrier.wait()
+        for _ in range(requests_num):
+            operation = workload.choose_operation()
+            start = time.perf_counter()
+            try:
+                status = workload.perform(operation)
+            except Exception:
+                status = None
+            workload_samples.append((operation, time.perf_counter() - start, status))
+
+    threads = [threading.Thread(target=run, args=(workload, workload_samples))
+               for workload, workload_samples in zip(workloads, samples)]
+    for thread in threads: thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads: thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = {}
+    errors = {}
+    for operation, latency, status in (sample for workload_samples in samples
+                                       for sample in workload_samples):
+        latencies.setdefault(operation, []).append(latency)
+        errors[operation] = errors.get(operation, 0) + (status != 200)
+    requests_total = len(workloads) * requests_num
+    return {
+        'requests': requests_total,
+        'elapsed': elapsed,
+        'throughput': requests_total / elapsed,
+        'latency_ms': latency_statistics([latency for operation in latencies
+                                          for latency in latencies[operation]]),
+        'operations': {operation: {'count': len(latencies[operation]),
+                                   'errors': errors[operation],
+                                   'latency_ms': latency_statistics(latencies[operation])}
+                       for operation in sorted(latencies)},
+    }
+
+# Returns the I/O counters of the given processes (summed), read from
+# /proc/<pid>/io, or None if they are not available (e.g. not on Linux).
+# The counters are the numbers of read and write system calls and the number
+# of bytes read and written (including the ones of pipes and sockets).
+def read_io_counters(pids):
+    counters = {'read_syscalls': 0, 'write_syscalls': 0,
+                'read_bytes': 0, 'written_bytes': 0}
+    names = {'syscr': 'read_syscalls', 'syscw': 'write_syscalls',
+             'rchar': 'read_bytes', 'wchar': 'written_bytes'}
+    try:
+        for pid in pids:
+            with open('/proc/{0}/io'.format(pid)) as io_file:
+                for line in io_file:
+                    name, value = line.split(':')
+                    if name in names: counters[names[name]] += int(value)
+    except (OSError, ValueError):
+        return None
+    return counters
+
+# Returns, for each operation of the workload, the average I/O counters
+# (see read_io_counters) of a single operation, performing samples_num
+# operations of each kind one after the other. get_pids returns the pids of
+# the processes serving the requests.
+def measure_io(workload, get_pids, samples_num):
+    io = {}
+    for operation in sorted(workload.operations):
+        before = read_io_counters(get_pids())
+        for _ in range(samples_num):
+            workload.perform(operation)
+        after = read_io_counters(get_pids())
+        if before is None or after is None: return None
+        io[operation] = {name: (after[name] - before[name]) / samples_num
+                         for name in after}
+    return io
@@ -0,0 +1,117 @@
+import http.client
+import json
+import random
+from base64 import b64encode
+from urllib.parse import urlencode
+
+from benchmarks.loadtest.data import ADMIN_USERNAME, ADMIN_PASSWORD
+
+AUTHORIZATION = 'Basic ' + b64encode(
+    '{0}:{1}'.format(ADMIN_USERNAME, ADMIN_PASSWORD).encode()).decode()
+
+# The default mix of the operations of a workload, in the form
+# operation: weight. Most of the requests come from the screens polling the
+# tables, the others from the coordinators.
+DEFAULT_MIX = {
+    'poll': 60,
+    'poll_since': 15,
+    'get_corrections': 5,
+    'add_to_queue': 5,
+    'remove_from_queue': 5,
+    'call_team': 5,
+    'switch_to_vacant': 5,
+}
+
+# Client sending the requests to the app in the same process, through the
+# Flask test client.
+class FlaskClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    # Returns the pair (status code, body) of the response.
+    def request(self, method, path, query=None, data=None):
+        response = self.client.open(path, method=method, query_string=query,
+                                    data=data,
+                                    headers={'Authorization': AUTHORIZATION})
+        return response.status_code, response.data
+
+    def close(self):
+        pass
+
+# Client sending the requests to a server over HTTP.
+class HTTPClient:
+    def __init__(self, host, port):
+        self.connection = http.client.HTTPConnection(host, port, timeout=60)
+
+    # Returns the pair (status code, body) of the response.
+    def request(self, method, path, query=None, data=None):
+        if query: path += '?' + urlencode(query)
+        self.connection.request(method, path, body=data,
+                                headers={'Authorization': AUTHORIZATION})
+        response = self.connection.getresponse()
+        return response.status, response.read()
+
+    def close(self):
+        self.connection.close()
+
+# A user of the API performing random operations, chosen according to the
+# weights of mix. Every operation is a method of the class, sending a single
+# request and returning the status code of the response.
+class Workload:
+    def __init__(self, client, table_names, teams, mix=DEFAULT_MIX, seed=None):
+        for operation in mix:
+            if operation not in DEFAULT_MIX:
+                raise ValueError('Unknown operation \'{0}\'.'.format(operation))
+        self.client = client
+        self.table_names = table_names
+        self.teams = teams
+        self.operations = list(mix)
+        self.weights = [mix[operation] for operation in self.operations]
+        self.rng = random.Random(seed)
+        # The last_update received by the polls, as a screen would remember.
+        self.last_update = -1
+
+    def choose_operation(self):
+        return self.rng.choices(self.operations, self.weights)[0]
+
+    def perform(self, operation):
+        return getattr(self, operation)()
+
+    def post(self, path, data):
+        return self.client.request('POST', path, data=json.dumps(data))[0]
+
+    def get_tables(self, argument):
+        status, body = self.client.request('GET', '/tables/get_all',
+                                           {argument: self.last_update})
+        if status == 200:
+            response = json.loads(body)
+            if response.get('changed'): self.last_update = response['last_update']
+        return status
+
+    def poll(self):
+        return self.get_tables('last_update')
+
+    def poll_since(self):
+        return self.get_tables('since')
+
+    def get_corrections(self):
+        if self.rng.random() < 0.5: filters = {'table': self.rng.choice(self.table_names)}
+        else: filters = {'team': self.rng.choice(self.teams)}
+        return self.client.request('GET', '/history/get_corrections',
+                                   data=json.dumps({'filters': filters}))[0]
+
+    def add_to_queue(self):
+        return self.post('/table/{0}/add_to_queue'.format(self.rng.choice(self.table_names)),
+                         {'team': self.rng.choice(self.teams)})
+
+    def remove_from_queue(self):
+        return self.post('/table/{0}/remove_from_queue'.format(self.rng.choice(self.table_names)),
+                         {'team': self.rng.choice(self.teams)})
+
+    def call_team(self):
+        return self.post('/table/{0}/call_team'.format(self.rng.choice(self.table_names)),
+                         {'team': self.rng.choice(self.teams)})
+
+    def switch_to_vacant(self):
+        return self.post('/table/{0}/switch_to_vacant'.format(self.rng.choice(self.table_names)),
+                         {})
@@ -0,0 +1,11 @@
+import json
+import os
+from cohmo import app as application
+from cohmo.views import init_chief, init_authentication_manager
+
+# The app served by gunicorn during the load test, configured with the json
+# file whose path is in the environment variable COHMO_LOADTEST_CONFIG.
+with open(os.environ['COHMO_LOADTEST_CONFIG']) as config_file:
+    application.config.update(json.load(config_file))
+init_chief()
+init_authentication_manager()
@@ -0,0 +1,91 @@
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from cohmo.scheduler import Scheduler
+
+# Benchmark of the scheduler on a synthetic olympiad with 100 teams, 6
+# problems and 3 tables for each problem, with random queues and durations.
+# It compares the end of the coordinations with the random queues, with the
+# greedy queues and after the local search with increasing time budgets
+# (starting both from the random and from the greedy queues), and prints a
+# lower bound of the makespan and the time needed to evaluate some queues.
+# Usage: python benchmarks/scheduler_benchmark.py [seed]
+
+TEAMS = ['T{0:03d}'.format(i) for i in range(100)]
+PROBLEMS = [str(p) for p in range(1, 7)]
+TABLES_PER_PROBLEM = 3
+START_TIME = 8 * 3600
+BREAK_TIMES = [[12 * 3600 + 40 * 60, 14 * 3600 + 20 * 60]]
+TIME_BUDGETS = [0.5, 2, 5]
+
+def generate_tables(rng):
+    tables = []
+    for problem in PROBLEMS:
+        teams = list(TEAMS)
+        rng.shuffle(teams)
+        for t in range(TABLES_PER_PROBLEM):
+            tables.append({'name': '{0}{1}'.format(problem, 'ABC'[t]),
+                           'problem': problem,
+                           'duration': rng.randint(15, 25) * 60,
+                           'queue': teams[t::TABLES_PER_PROBLEM],
+                           'available_time': START_TIME,
+                           'pinned': False})
+    return tables
+
+# The makespan is at least the time needed by the tables of a problem to
+# coordinate all the teams, and the time needed by a team to coordinate all
+# the problems, plus the breaks in the meanwhile.
+def lower_bound(tables):
+    by_problem = {}
+    for table in tables:
+        by_problem.setdefault(table['problem'], []).append(table['duration'])
+    problem_bound = max(len(TEAMS) / sum(1 / d for d in durations)
+                        for durations in by_problem.values())
+    team_bound = sum(min(durations) for durations in by_problem.values())
+    bound = START_TIME + max(problem_bound, team_bound)
+    for bt in BREAK_TIMES:
+        if bt[0] < bound: bound += bt[1] - bt[0]
+    return bound
+
+def format_time(timestamp):
+    return '{0:02d}:{1:02d}'.format(int(timestamp // 3600), int(timestamp % 3600 // 60))
+
+def main():
+    seed = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    tables = generate_tables(random.Random(seed))
+    scheduler = Scheduler(tables, BREAK_TIMES, START_TIME, seed=seed)
+    print('{0:<25} {1:>8} {2:>10} {3:>10}'.format('queues', 'end', 'conflicts', 'time (s)'))
+    def report(name, queues, elapsed):
+        makespan, conflicts, _ = scheduler.evaluate(queues)
+        print('{0:<25} {1:>8} {2:>10} {3:>10.3f}'.format(
+            name, format_time(makespan), conflicts, elapsed))
+
+    queues = scheduler.get_initial_queues()
+    report('random', queues, 0)
+    for time_budget in TIME_BUDGETS:
+        scheduler.rng.seed(seed)
+        start = time.perf_counter()
+        improved_queues = scheduler.improve(queues, time_budget)
+        report('random + search {0}s'.format(time_budget), improved_queues,
+               time.perf_counter() - start)
+    start = time.perf_counter()
+    queues = scheduler.get_greedy_queues()
+    report('greedy', queues, time.perf_counter() - start)
+    for time_budget in TIME_BUDGETS:
+        scheduler.rng.seed(seed)
+        start = time.perf_counter()
+        proposal = scheduler.schedule(time_budget)
+        report('greedy + search {0}s'.format(time_budget), proposal['queues'],
+               time.perf_counter() - start)
+    print('Lower bound of the end: {0}.'.format(format_time(lower_bound(tables))))
+    start = time.perf_counter()
+    for _ in range(100):
+        scheduler.evaluate(queues)
+    print('Evaluation of some queues: {0:.3f}ms.'.format(
+        (time.perf_counter() - start) * 10))
+
+if __name__ == '__main__':
+    main()
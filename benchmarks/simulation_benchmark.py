@@ -0,0 +1,60 @@
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from cohmo.simulation import simulate_day
+
+# Benchmark of the Monte Carlo simulation of the day on a synthetic olympiad
+# with 110 teams, 6 problems and 3 tables for each problem, each table with
+# 30 past corrections, for increasing numbers of runs.
+# Usage: python benchmarks/simulation_benchmark.py [seed]
+
+TEAMS = ['T{0:03d}'.format(i) for i in range(110)]
+PROBLEMS = [str(p) for p in range(1, 7)]
+TABLES_PER_PROBLEM = 3
+START_TIME = 8 * 3600
+BREAK_TIMES = [[12 * 3600 + 40 * 60, 14 * 3600 + 20 * 60]]
+RUNS = [100, 1000, 2000, 5000]
+REPETITIONS = 5
+
+def generate_tables(rng):
+    tables = []
+    duration_samples = {}
+    for problem in PROBLEMS:
+        teams = list(TEAMS)
+        rng.shuffle(teams)
+        for t in range(TABLES_PER_PROBLEM):
+            name = '{0}{1}'.format(problem, 'ABC'[t])
+            tables.append({'name': name,
+                           'problem': problem,
+                           'duration': 20 * 60,
+                           'queue': teams[t::TABLES_PER_PROBLEM],
+                           'available_time': START_TIME,
+                           'pinned': False,
+                           'current_team': None,
+                           'current_start_time': None})
+            duration_samples[name] = [rng.randint(10, 30) * 60 for _ in range(30)]
+    return tables, duration_samples
+
+def format_time(timestamp):
+    return '{0:02d}:{1:02d}'.format(int(timestamp // 3600), int(timestamp % 3600 // 60))
+
+def main():
+    seed = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    tables, duration_samples = generate_tables(random.Random(seed))
+    print('{0:>6} {1:>10} {2:>8} {3:>8} {4:>8}'.format('runs', 'time (ms)', 'p10', 'p50', 'p90'))
+    for runs in RUNS:
+        start = time.perf_counter()
+        for _ in range(REPETITIONS):
+            simulation = simulate_day(tables, {}, duration_samples, BREAK_TIMES,
+                                      START_TIME, runs, seed)
+        elapsed = (time.perf_counter() - start) / REPETITIONS
+        finish_time = simulation['finish_time']
+        print('{0:>6} {1:>10.1f} {2:>8} {3:>8} {4:>8}'.format(
+            runs, elapsed * 1000, format_time(finish_time['p10']),
+            format_time(finish_time['p50']), format_time(finish_time['p90'])))
+
+if __name__ == '__main__':
+    main()
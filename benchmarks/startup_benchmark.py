@@ -0,0 +1,89 @@
+import gc
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from cohmo import app
+from cohmo.chief import ChiefCoordinator
+
+# Benchmark of the construction of the chief on a synthetic olympiad with 110
+# teams and 24 tables, with a long history, loading the state from the json
+# and csv files and from the binary state snapshot (see
+# cohmo/state_snapshot.py).
+# Usage: python benchmarks/startup_benchmark.py [number of corrections]
+
+TABLES = ['{0}{1}'.format(p, t) for p in range(1, 7) for t in 'ABCD']
+TEAMS = ['T{0:03d}'.format(i) for i in range(110)]
+REPETITIONS = 5
+
+def generate_files(directory, corrections_num):
+    teams_path = os.path.join(directory, 'teams.txt')
+    with open(teams_path, 'w') as teams_file:
+        teams_file.write(','.join(TEAMS))
+    table_paths = {}
+    for name in TABLES:
+        table_paths[name] = os.path.join(directory, 'T{0}.json'.format(name))
+        with open(table_paths[name], 'w') as table_file:
+            json.dump({'name': name, 'problem': name[0],
+                       'coordinators': ['A', 'B'],
+                       'queue': random.sample(TEAMS, 30),
+                       'status': 'VACANT'}, table_file, indent=4)
+    history_path = os.path.join(directory, 'history.csv')
+    with open(history_path, 'w', newline='') as history_file:
+        for i in range(corrections_num):
+            start_time = random.randint(0, 10**7)
+            history_file.write('{0},{1},{2},{3},ID{4}\r\n'.format(
+                random.choice(TEAMS), random.choice(TABLES), start_time,
+                start_time + random.randint(600, 1800), i))
+    return teams_path, table_paths, history_path
+
+# Returns the median time of the construction of the chief, and the number of
+# corrections it loaded. The previous chief is collected before each
+# construction, so that the garbage collector does not scan two histories.
+def measure(teams_path, table_paths, history_path, config):
+    elapsed = []
+    for _ in range(REPETITIONS):
+        gc.collect()
+        start = time.perf_counter()
+        chief = ChiefCoordinator(teams_path, table_paths, history_path, config)
+        elapsed.append(time.perf_counter() - start)
+        corrections_num = len(chief.history_manager.corrections)
+        del chief
+    return statistics.median(elapsed), corrections_num
+
+def main():
+    corrections_num = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    directory = tempfile.mkdtemp()
+    try:
+        teams_path, table_paths, history_path = generate_files(directory, corrections_num)
+        config = dict(app.config, STORAGE_BACKEND='files', STATE_BACKEND='local',
+                      PERSISTENCE_MODE='snapshot', STATE_POLL_INTERVAL=0,
+                      PUBLIC_SNAPSHOT_FILE_PATH=None, STATE_SNAPSHOT_FILE_PATH=None)
+        files_time, loaded_num = measure(teams_path, table_paths, history_path, config)
+        assert(loaded_num == corrections_num)
+        config['STATE_SNAPSHOT_FILE_PATH'] = os.path.join(directory, 'state.bin')
+        chief = ChiefCoordinator(teams_path, table_paths, history_path, config)
+        start = time.perf_counter()
+        chief.write_state_snapshot()
+        write_time = time.perf_counter() - start
+        del chief
+        snapshot_time, loaded_num = measure(teams_path, table_paths, history_path, config)
+        assert(loaded_num == corrections_num)
+        print('Startup with {0} corrections and {1} tables.'.format(
+            corrections_num, len(TABLES)))
+        print('{0:<30} {1:>10.3f}s'.format('json and csv files', files_time))
+        print('{0:<30} {1:>10.3f}s ({2:.1f}x, {3:.1f} MB)'.format(
+            'state snapshot', snapshot_time, files_time / snapshot_time,
+            os.path.getsize(config['STATE_SNAPSHOT_FILE_PATH']) / 2**20))
+        print('{0:<30} {1:>10.3f}s'.format('writing the state snapshot', write_time))
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import io
+import json
+import sys
+from urllib.parse import parse_qs
+from werkzeug.datastructures import Authorization
+from werkzeug.http import parse_accept_header, parse_etags
+import cohmo.views
+from cohmo.views import JSON_HEADERS
+
+UNAUTHORIZED_HEADERS = [('Content-Type', 'text/html; charset=utf-8'),
+                        ('WWW-Authenticate', 'Basic realm="Authentication Required"')]
+STREAM_HEADERS = [('Content-Type', 'text/event-stream; charset=utf-8')] + \
+    cohmo.views.STREAM_HEADERS
+
+# ASGI application serving cohmo from an event loop (see
+# deployment/asgi_run.py), for the deployments with many long-lived
+# connections (e.g. the screens showing the queues), each of which would hold
+# a thread of a WSGI server.
+# The snapshot /tables/get_all (also when it waits for an operation, see the
+# argument wait) and the stream /tables/stream are served directly by the
+# event loop, with the functions of cohmo/views.py shared by both front-ends
+# (run in the pool of threads, since they may build the snapshot). The
+# clients waiting
+# for an operation wait on an asyncio.Event, that is set (and replaced)
+# whenever operations_num changes (see HistoryManager.add_operation_listener),
+# so that they cost no thread.
+# All the other requests, among them the operations modifying the tables, are
+# passed to the Flask application, run by a pool of ASGI_THREADS threads.
+class AsgiApplication:
+    def __init__(self, app):
+        self.app = app
+        self.executor = ThreadPoolExecutor(app.config['ASGI_THREADS'])
+        self.native_views = {'/tables/get_all': self.get_tables_if_changed,
+                             '/tables/stream': self.stream_tables}
+        self.loop = None
+        self.operation_event = None
+        # The chief whose operations are listened.
+        self.chief = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.handle_lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError('Unsupported connection type \'{0}\'.'.format(scope['type']))
+        self.set_loop()
+        # When the stream is disabled, the Flask application answers 404.
+        if scope['method'] != 'GET' or scope['path'] not in self.native_views or \
+                (scope['path'] == '/tables/stream' and not self.app.config['TABLES_STREAM']):
+            await self.call_wsgi_application(scope, receive, send)
+            return
+        args = {name: values[0] for name, values in
+                parse_qs(scope['query_string'].decode('latin-1'),
+                         keep_blank_values=True).items()}
+        if await self.authenticate(scope, args) is None:
+            await self.send_response(send, 401, UNAUTHORIZED_HEADERS, b'Unauthorized Access')
+            return
+        await self.run_in_executor(self.get_chief().synchronize)
+        await self.native_views[scope['path']](scope, args, receive, send)
+
+    async def handle_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.set_loop()
+                self.get_chief()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def set_loop(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.loop = loop
+            self.operation_event = asyncio.Event()
+
+    # Returns the chief of cohmo/views.py, listening to its operations (the
+    # chief is replaced by init_chief).
+    def get_chief(self):
+        chief = cohmo.views.chief
+        if chief is not self.chief:
+            if self.chief is not None:
+                self.chief.history_manager.remove_operation_listener(self.on_operation)
+            chief.history_manager.add_operation_listener(self.on_operation)
+            self.chief = chief
+        return chief
+
+    # Called by the thread performing an operation.
+    def on_operation(self, operations_num):
+        loop = self.loop
+        if loop is None: return
+        try:
+            loop.call_soon_threadsafe(self.set_operation_event)
+        except RuntimeError: # The event loop is closed.
+            pass
+
+    def set_operation_event(self):
+        self.operation_event.set()
+        self.operation_event = asyncio.Event()
+
+    # Waits until operations_num is different from last_operations_num, or
+    # until timeout seconds have passed, or until the future disconnected is
+    # done. Returns the current operations_num.
+    async def wait_for_operation(self, last_operations_num, timeout, disconnected):
+        event = self.operation_event
+        history_manager = self.get_chief().history_manager
+        if history_manager.operations_num == last_operations_num:
+            waiter = asyncio.ensure_future(event.wait())
+            await asyncio.wait([waiter, disconnected], timeout=timeout,
+                               return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+        return history_manager.operations_num
+
+    def run_in_executor(self, function, *args):
+        return self.loop.run_in_executor(self.executor, function, *args)
+
+    # Returns the description of the authenticated user (see authenticate of
+    # cohmo/views.py), or None if the authentication fails. It runs in the
+    # pool of threads, since hashing the passwords is expensive.
+    async def authenticate(self, scope, args):
+        authorization = Authorization.from_header(get_header(scope, 'authorization'))
+        return await self.run_in_executor(cohmo.views.authenticate, authorization,
+                                          args.get('token'), scope['method'])
+
+    # Same as get_tables_if_changed of cohmo/views.py, but waiting on the event
+    # loop.
+    async def get_tables_if_changed(self, scope, args, receive, send):
+        last_update, wait, message = cohmo.views.parse_tables_args(args)
+        if message is not None:
+            await self.send_json(send, ok=True, message=message)
+            return
+        if wait > 0:
+            disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+            try:
+                await self.wait_for_operation(last_update, wait, disconnected)
+            finally:
+                disconnected.cancel()
+        status, headers, body = await self.run_in_executor(
+            cohmo.views.get_tables_response, args, last_update,
+            parse_accept_header(get_header(scope, 'accept-encoding')),
+            parse_etags(get_header(scope, 'if-none-match')))
+        await self.send_response(send, status, headers, body)
+
+    # Same as stream_tables of cohmo/views.py, but waiting on the event loop.
+    async def stream_tables(self, scope, args, receive, send):
+        last_update = cohmo.views.parse_stream_last_update(
+            get_header(scope, 'last-event-id'), args)
+        heartbeat_interval = self.app.config['STREAM_HEARTBEAT_INTERVAL']
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': encode_headers(STREAM_HEADERS)})
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+        try:
+            await send_event(send, cohmo.views.get_stream_retry_event())
+            while not disconnected.done():
+                last_update, event = await self.run_in_executor(
+                    cohmo.views.get_stream_event, last_update)
+                await send_event(send, event)
+                await self.wait_for_operation(last_update, heartbeat_interval,
+                                              disconnected)
+        finally:
+            disconnected.cancel()
+
+    # Passes the request to the Flask application, in the pool of threads.
+    async def call_wsgi_application(self, scope, receive, send):
+        body = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect': return
+            body.append(message.get('body', b''))
+            if not message.get('more_body', False): break
+        environ = get_environ(scope, b''.join(body))
+        status, headers, body = await self.run_in_executor(self.run_wsgi_application,
+                                                           environ)
+        await self.send_response(send, status, headers, body)
+
+    # Returns the triple (status, headers, body) of the response of the Flask
+    # application to the request described by environ.
+    def run_wsgi_application(self, environ):
+        response = []
+        body = []
+        def start_response(status, headers, exc_info=None):
+            response[:] = [int(status.split(' ', 1)[0]), headers]
+            return body.append
+        result = self.app(environ, start_response)
+        try:
+            for data in result:
+                body.append(data)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response[0], response[1], b''.join(body)
+
+    async def send_response(self, send, status, headers, body=b''):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': encode_headers(headers)})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def send_json(self, send, **data):
+        await self.send_response(send, 200, JSON_HEADERS, json.dumps(data).encode())
+
+# Returns the value of the header (with lowercase name) of the request, or the
+# empty string if it is missing.
+def get_header(scope, name):
+    name = name.encode('latin-1')
+    for header_name, value in scope['headers']:
+        if header_name.lower() == name:
+            return value.decode('latin-1')
+    return ''
+
+def encode_headers(headers):
+    return [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+async def send_event(send, data):
+    await send({'type': 'http.response.body', 'body': data.encode(), 'more_body': True})
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+# Returns the WSGI environ of the request described by the ASGI scope, with
+# the given body.
+def get_environ(scope, body):
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ['CONTENT_TYPE', 'CONTENT_LENGTH']:
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    # The body has already been read whole (even if it was chunked).
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
@@ -1,16 +1,109 @@
+from base64 import b64encode, b64decode
+from collections import OrderedDict
+import hashlib
+import hmac
 import json
+import os
+import threading
+import time
+from cohmo.persister import replace_file
+
+# Parameters of the hashes produced by hash_password.
+PBKDF2_ITERATIONS = 260000
+SCRYPT_N = 2**14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_SIZE = 16
+
+# Returns the hash of password, as a string of the form
+#   pbkdf2_sha256$iterations$salt$hash
+#   scrypt$n$r$p$salt$hash
+# (depending on method), where salt and hash are base64 encoded.
+def hash_password(password, method='pbkdf2_sha256'):
+    salt = os.urandom(SALT_SIZE)
+    if method == 'pbkdf2_sha256':
+        parameters = [PBKDF2_ITERATIONS]
+    elif method == 'scrypt':
+        parameters = [SCRYPT_N, SCRYPT_R, SCRYPT_P]
+    else:
+        raise ValueError('Unknown hash method \'{0}\'.'.format(method))
+    digest = compute_hash(method, parameters, salt, password)
+    return '$'.join([method] + [str(parameter) for parameter in parameters] +
+                    [b64encode(salt).decode(), b64encode(digest).decode()])
+
+def compute_hash(method, parameters, salt, password):
+    if method == 'pbkdf2_sha256':
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, parameters[0])
+    n, r, p = parameters
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=2 * 128 * n * r * p)
+
+# Returns whether the stored password is a hash produced by hash_password
+# (and not a password in plain text).
+def is_hashed(stored):
+    fields = stored.split('$')
+    return (fields[0] == 'pbkdf2_sha256' and len(fields) == 4) or \
+        (fields[0] == 'scrypt' and len(fields) == 6)
+
+# Returns whether password matches the stored one, that is either a hash
+# produced by hash_password or a password in plain text.
+def check_password(stored, password):
+    if not is_hashed(stored):
+        return hmac.compare_digest(stored.encode(), password.encode())
+    fields = stored.split('$')
+    try:
+        parameters = [int(parameter) for parameter in fields[1:-2]]
+        salt = b64decode(fields[-2])
+        digest = b64decode(fields[-1])
+    except ValueError:
+        return False
+    return hmac.compare_digest(compute_hash(fields[0], parameters, salt, password), digest)
 
 # This class handles the authentication of users.
 # It is constructed directly from a JSON files containing users, passwords
-# and authorizations.
+# and authorizations. The passwords are hashed (see hash_password) or, for
+# old files, in plain text (see the command flask hashpasswords).
+# Since hashing is expensive on purpose and the clients authenticate at every
+# request, the outcomes of the verifications are cached for cache_ttl seconds
+# (at most cache_size of them, dropping the least recently used). The cache
+# is keyed by an HMAC, with a secret key of the process, of the credentials,
+# so that the passwords are not kept in memory.
 class AuthenticationManager:
-    def __init__(self, auth_path):
-        with open(auth_path) as auth_file:    
+    def __init__(self, auth_path, cache_ttl=300, cache_size=1000):
+        with open(auth_path) as auth_file:
             self.users = json.load(auth_file)
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.cache_key = os.urandom(32)
+        # Dictionary of the form credentials digest: (expiry time, outcome),
+        # ordered from the least recently used.
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
 
     def verify_password(self, user, password):
         if user not in self.users: return False
-        return self.users[user]['password'] == password
+        digest = hmac.new(self.cache_key, '{0}\0{1}'.format(user, password).encode(),
+                          hashlib.sha256).digest()
+        now = time.monotonic()
+        with self.cache_lock:
+            if digest in self.cache and self.cache[digest][0] > now:
+                self.cache.move_to_end(digest)
+                return self.cache[digest][1]
+        outcome = check_password(self.users[user]['password'], password)
+        with self.cache_lock:
+            self.cache[digest] = (now + self.cache_ttl, outcome)
+            self.cache.move_to_end(digest)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return outcome
+
+    # Returns the description of the user, as encoded in the tokens (see
+    # cohmo/tokens.py).
+    def get_user(self, user):
+        return {'user': user,
+                'authorizations': list(self.users[user]['authorizations']),
+                'admin': bool(self.is_admin(user)),
+                'read_only': False}
 
     def is_authorized(self, user, table):
         if user not in self.users: return False
@@ -19,3 +112,17 @@ class AuthenticationManager:
     def is_admin(self, user):
         if user not in self.users: return False
         return ('admin' in self.users[user]) and self.users[user]['admin']
+
+# Replaces the passwords in plain text of the authentication file at
+# auth_path with their hashes (see hash_password). Returns the number of
+# passwords hashed. The file is replaced atomically (see replace_file).
+def hash_authentication_file(auth_path, method='pbkdf2_sha256'):
+    with open(auth_path) as auth_file:
+        users = json.load(auth_file, object_pairs_hook=OrderedDict)
+    hashed_num = 0
+    for user in users.values():
+        if not is_hashed(user['password']):
+            user['password'] = hash_password(user['password'], method)
+            hashed_num += 1
+    replace_file(auth_path, json.dumps(users, indent=4) + '\n')
+    return hashed_num
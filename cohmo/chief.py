@@ -1,6 +1,22 @@
-from cohmo.table import Table
+from cohmo.table import Table, TableStatus
 from cohmo.history import HistoryManager
+from cohmo.journal import Journal
+from cohmo.persister import Persister, Backups
+from cohmo.state_snapshot import read_state_snapshot, write_state_snapshot
+from cohmo.schedule_plan import validate_plan, parse_json_plan
+from cohmo.scheduler import Scheduler
+from cohmo.simulation import simulate_day
+from cohmo.snapshot import TablesSnapshot
+from cohmo.timeline import Timeline
+from cohmo.state_backend import LocalStateBackend, FileStateBackend, SQLiteStateBackend
+from cohmo.sqlite_storage import SQLiteStorage
 from collections import OrderedDict
+import sys
+import threading
+import time
+
+TEAM_NOT_AVAILABLE = 'Team {0} is already in a coordination session.'
+TEAM_NOT_IN_QUEUE = 'Team {0} is not in queue at table {1}.'
 
 # This class is the global handler of both the tables and the history.
 # The name of the class is inspired from the real-world name of the person
@@ -9,6 +25,33 @@ from collections import OrderedDict
 # It is constructed directly reading information from files.
 # teams_path and history_path are paths, whereas table_paths is a dictionary
 # of the form: table_name: table_path.
+# If PERSISTENCE_MODE is 'journal', the operations on the tables are appended to
+# the journal JOURNAL_FILE_PATH and the table files are rewritten only when
+# the journal is compacted. At construction the journal is replayed on top of
+# the table files, so that the state before a crash is recovered.
+# If PERSISTENCE_MODE is 'deferred', the table files (and the history file,
+# when a correction is deleted) are rewritten by a background thread at most
+# once every PERSISTENCE_FLUSH_INTERVAL seconds (see cohmo/persister.py),
+# unless the operation is durable (see end_operation).
+# The table and history files are always replaced atomically, and the last
+# BACKUP_COUNT versions of each of them, one every BACKUP_INTERVAL seconds, are
+# kept as backups. A table file that can not be read at construction is
+# recovered from its newest valid backup.
+# If STATE_SNAPSHOT_FILE_PATH is not None (and the storage is the files), the
+# state is also written there in binary form, when it is the same as in the
+# files (after a compaction and on close), and at construction it is loaded
+# from there if the files did not change (see cohmo/state_snapshot.py).
+# If STORAGE_BACKEND is 'sqlite', the tables and the history are stored in the
+# database SQLITE_FILE_PATH instead (the table files are used only by import
+# and export), and the state is shared through the database.
+# If STATE_BACKEND is 'file', the state can be shared by many processes (see
+# cohmo/state_backend.py): the operations must be enclosed between
+# begin_operation and end_operation, and synchronize must be called before
+# reading the state.
+#
+# The chief can be used by many threads: each table has its own lock, held by
+# its operations, and the operations that may change which teams are
+# unavailable hold also availability_lock (see call_team).
 class ChiefCoordinator:
     def __init__(self, teams_path, table_paths, history_path, additional_config):
         self.teams_path = teams_path
@@ -19,16 +62,259 @@ class ChiefCoordinator:
             lines = teams_file.readlines()
             assert(len(lines) >= 1)
             self.teams = [team.strip() for team in lines[0].split(',')]
-        self.history_manager = HistoryManager(history_path)
+        # The teams, to check whether a team exists in constant time.
+        self.teams_set = set(self.teams)
 
-        self.tables = OrderedDict()
-        for name in table_paths:
-            self.tables[name] = Table(table_paths[name], self.history_manager, additional_config)
-            assert(name == self.tables[name].name)
+        # Held, before the lock of the table, by the operations that may make
+        # a team unavailable, so that a team is never called (or corrected)
+        # by two tables at the same time.
+        self.availability_lock = threading.Lock()
+        # Held while compacting, so that only one thread compacts.
+        self.compaction_lock = threading.Lock()
+        # Whether close has been called (only the first call does something).
+        self.closed = False
+        # Dictionary of the form team: {table_name: status}, containing the
+        # teams being corrected (status CORRECTING) or called (status CALLING)
+        # by some table. It is updated after every operation on a table, see
+        # update_unavailable_teams.
+        self.unavailable_teams = {}
+        # Dictionary of the form table_name: (team, status), the inverse of
+        # unavailable_teams.
+        self.unavailable_team_by_table = {}
+        # Held while updating the two dictionaries above.
+        self.unavailable_teams_lock = threading.Lock()
+
+        self.storage = None
+        if additional_config['STORAGE_BACKEND'] == 'sqlite':
+            if additional_config['PERSISTENCE_MODE'] == 'journal':
+                raise ValueError('The journal can not be used with the sqlite storage.')
+            self.storage = SQLiteStorage(additional_config['SQLITE_FILE_PATH'])
+            self.state_backend = SQLiteStateBackend(self.storage)
+        elif additional_config['STORAGE_BACKEND'] != 'files':
+            raise ValueError('Unknown storage backend \'{0}\'.'.format(additional_config['STORAGE_BACKEND']))
+        elif additional_config['STATE_BACKEND'] == 'local':
+            self.state_backend = LocalStateBackend()
+        elif additional_config['STATE_BACKEND'] == 'file':
+            self.state_backend = FileStateBackend(additional_config['STATE_FILE_PATH'])
+        else:
+            raise ValueError('Unknown state backend \'{0}\'.'.format(additional_config['STATE_BACKEND']))
+        self.persister = None
+        if additional_config['PERSISTENCE_MODE'] == 'deferred':
+            if self.storage is not None or additional_config['STATE_BACKEND'] != 'local':
+                raise ValueError('The deferred persistence can be used only with the files and the local state backend.')
+            self.persister = Persister(additional_config['PERSISTENCE_FLUSH_INTERVAL'])
+        self.backups = None
+        self.state_snapshot_path = None
+        if self.storage is None:
+            self.backups = Backups(additional_config['BACKUP_COUNT'],
+                                   additional_config['BACKUP_INTERVAL'])
+            self.state_snapshot_path = additional_config['STATE_SNAPSHOT_FILE_PATH']
+        self.state_backend.acquire()
+        try:
+            state = None
+            if self.state_snapshot_path is not None:
+                state = read_state_snapshot(self.state_snapshot_path,
+                                            table_paths, history_path)
+            self.history_manager = HistoryManager(
+                history_path, additional_config['RECENT_OPERATIONS_SIZE'],
+                self.storage, self.persister,
+                None if state is None else state['corrections'])
+            self.history_manager.backups = self.backups
+
+            self.additional_config = additional_config
+            self.journal = None
+            if additional_config['PERSISTENCE_MODE'] == 'journal':
+                self.journal = Journal(additional_config['JOURNAL_FILE_PATH'],
+                                       additional_config['JOURNAL_FSYNC'],
+                                       additional_config['JOURNAL_FSYNC_INTERVAL'],
+                                       additional_config['JOURNAL_COMPACTION_THRESHOLD'])
+                self.journal.compaction_callback = self.compact
+            elif additional_config['PERSISTENCE_MODE'] not in ['snapshot', 'deferred']:
+                raise ValueError('Unknown persistence mode \'{0}\'.'.format(additional_config['PERSISTENCE_MODE']))
+            if self.load_tables(None if state is None else state['tables']) > 0:
+                self.compact()
+
+            # Adopting the shared version, unless this is the first process or
+            # the local operations_num is larger (see HistoryManager.__init__).
+            version = self.state_backend.get_version()
+            if version is not None:
+                if version >= self.history_manager.operations_num:
+                    self.history_manager.set_operations_num(
+                        version, self.state_backend.get_modified_time())
+                else:
+                    self.state_backend.set_version(*self.history_manager.get_last_operation())
+        finally:
+            self.state_backend.release()
+
+        # The last snapshot of the tables, rebuilt only when operations_num
+        # changes (see get_snapshot).
+        self.snapshot = None
+        self.snapshot_lock = threading.Lock()
+        # The last timeline of the coordinations, rebuilt when operations_num
+        # changes or when it gets old (see get_timeline).
+        self.timeline = None
+        self.timeline_lock = threading.Lock()
+        self.timeline_refresh_interval = additional_config['TIMELINE_REFRESH_INTERVAL']
+        # If not None, the snapshot of the tables is written to this file at
+        # the end of every operation (see publish_snapshot).
+        self.public_snapshot_path = additional_config['PUBLIC_SNAPSHOT_FILE_PATH']
+        self.published_operations_num = None
+        self.publish_snapshot()
         self.skipped_positions = additional_config['SKIPPED_POSITIONS']
         self.start_time = additional_config['START_TIME']
         self.maximum_time = additional_config['MAXIMUM_TIME']
         self.break_times = additional_config['BREAK_TIMES']
+        self.scheduler_time_budget = additional_config['SCHEDULER_TIME_BUDGET']
+        # The last simulation of the day, as a pair (operations_num,
+        # simulation), see get_simulation.
+        self.simulation = None
+        self.simulation_lock = threading.Lock()
+        if additional_config['STATE_POLL_INTERVAL']:
+            self.state_backend.watch(self.synchronize,
+                                     additional_config['STATE_POLL_INTERVAL'])
+
+    # Loads the tables from their files (or from tables_data, a dictionary of
+    # the form table_name: dictionary in the format of the file) and, if the
+    # tables are journaled, replays the journal. Returns the number of
+    # replayed operations.
+    def load_tables(self, tables_data=None):
+        tables = OrderedDict()
+        for name in self.table_paths:
+            if tables_data is not None:
+                tables[name] = Table(self.table_paths[name], self.history_manager,
+                                     self.additional_config, self.journal,
+                                     persister=self.persister,
+                                     table_as_dict=tables_data[name])
+            elif self.storage is None:
+                tables[name] = self.load_table_file(self.table_paths[name])
+            else:
+                tables[name] = Table(name, self.history_manager,
+                                     self.additional_config, storage=self.storage)
+            tables[name].backups = self.backups
+            assert(name == tables[name].name)
+        records = []
+        if self.journal is not None:
+            records = Journal.read_records(self.journal.path)
+            for record in records:
+                if record['table'] not in tables:
+                    raise ValueError('The journal \'{0}\' contains the unknown table {1}.'.format(self.journal.path, record['table']))
+                table = tables[record['table']]
+                # The records written before the sequence numbers have none.
+                seq = record.get('seq')
+                if seq is not None and seq <= table.journal_seq: continue
+                table.apply_operation(record['op'], record['args'])
+                if seq is not None: table.journal_seq = seq
+            self.journal.seq = max([self.journal.seq] +
+                                   [table.journal_seq for table in tables.values()] +
+                                   [record.get('seq', 0) for record in records])
+        with self.unavailable_teams_lock:
+            self.unavailable_teams = {}
+            self.unavailable_team_by_table = {}
+        for table in tables.values():
+            table.change_callback = self.update_unavailable_teams
+            self.update_unavailable_teams(table)
+        self.tables = tables
+        return len(records)
+
+    # Constructs the table from its file or, if the file is missing or
+    # malformed (e.g. it was truncated by a crash of an older version, which
+    # rewrote the files in place), from its newest valid backup, which then
+    # replaces the file.
+    def load_table_file(self, path):
+        try:
+            return Table(path, self.history_manager, self.additional_config,
+                         self.journal, persister=self.persister)
+        except (OSError, ValueError, KeyError) as error:
+            for backup_path in Backups.list(path):
+                try:
+                    table = Table(backup_path, self.history_manager,
+                                  self.additional_config, self.journal,
+                                  persister=self.persister)
+                except (OSError, ValueError, KeyError):
+                    continue
+                table.path = path
+                table.dump_to_file()
+                print('The file \'{0}\' can not be read ({1}), it has been recovered from \'{2}\'.'.format(
+                    path, error, backup_path), file=sys.stderr)
+                return table
+            raise error
+
+    # Updates the unavailable teams after an operation on the given table.
+    def update_unavailable_teams(self, table):
+        team = table.get_unavailable_team()
+        status = table.status
+        with self.unavailable_teams_lock:
+            if table.name in self.unavailable_team_by_table:
+                old_team, _ = self.unavailable_team_by_table.pop(table.name)
+                del self.unavailable_teams[old_team][table.name]
+                if not self.unavailable_teams[old_team]:
+                    del self.unavailable_teams[old_team]
+            if team is not None:
+                self.unavailable_team_by_table[table.name] = (team, status)
+                self.unavailable_teams.setdefault(team, {})[table.name] = status
+
+    # Reloads the history and the tables if another process changed them, that
+    # is if the shared version of the state differs from operations_num.
+    def synchronize(self):
+        version = self.state_backend.get_version()
+        if version is None or version == self.history_manager.operations_num:
+            return
+        self.state_backend.acquire(exclusive=False)
+        try:
+            self.reload_if_changed()
+        finally:
+            self.state_backend.release()
+
+    # Must be called holding the lock of the state backend.
+    def reload_if_changed(self):
+        version = self.state_backend.get_version()
+        if version is None or version == self.history_manager.operations_num:
+            return
+        self.history_manager.load()
+        self.load_tables()
+        self.history_manager.set_operations_num(version,
+                                                self.state_backend.get_modified_time())
+
+    # An operation modifying the state must be enclosed between
+    # begin_operation and end_operation. In between, the state is up to date
+    # and no other process (or thread) can modify it.
+    # If end_operation is called with durable True, the state is written to
+    # the files before it returns, even if the persistence is deferred, and
+    # the journal is fsynced, whatever JOURNAL_FSYNC is.
+    def begin_operation(self):
+        self.state_backend.acquire()
+        try:
+            self.reload_if_changed()
+        except:
+            self.state_backend.release()
+            raise
+
+    def end_operation(self, durable=False):
+        try:
+            if durable and self.persister is not None:
+                self.persister.flush()
+            if durable and self.journal is not None:
+                self.journal.sync()
+            # The shared version changes only if the operation changed the
+            # state, otherwise the other processes would reload it for nothing.
+            version = self.state_backend.get_version()
+            operations_num, last_operation_time_ns = self.history_manager.get_last_operation()
+            if version is not None and version != operations_num:
+                self.state_backend.set_version(operations_num, last_operation_time_ns)
+            self.publish_snapshot()
+        finally:
+            self.state_backend.release()
+
+    # Writes the snapshot of the tables to PUBLIC_SNAPSHOT_FILE_PATH (if it is
+    # not None), unless it has already been written since the last operation.
+    # It is called holding the lock of the state backend, so that the
+    # processes sharing the state do not write the file at the same time.
+    def publish_snapshot(self):
+        if self.public_snapshot_path is None: return
+        snapshot = self.get_snapshot()
+        if snapshot.operations_num == self.published_operations_num: return
+        snapshot.write_to_file(self.public_snapshot_path)
+        self.published_operations_num = snapshot.operations_num
 
     # Saves the current states of tables and history to the given files.
     # The default files are the ones passed to the constructor.
@@ -39,9 +325,475 @@ class ChiefCoordinator:
         for name in table_paths:
             self.tables[name].dump_to_file(table_paths[name])
 
+    # Writes the current state of all tables to their files and empties the
+    # journal. It does nothing if the tables are not journaled, or if another
+    # thread is already compacting.
+    # The locks of all the tables are held until the journal is emptied, so
+    # that no operation is lost. Since the compaction may start in the middle
+    # of an operation (holding the lock of its table), it does not wait for
+    # the other locks: if a table is busy the compaction is skipped, and it is
+    # retried at the next append to the journal.
+    # The compaction is skipped also while a batch (see apply_batch) is
+    # ending: the thread of the batch holds the locks of its tables, and the
+    # tables not yet ended have changes that are not in the journal yet (they
+    # would be written to the files and then appended to the journal anyway,
+    # hence applied twice at the next startup).
+    def compact(self):
+        if self.journal is None: return
+        if not self.compaction_lock.acquire(blocking=False): return
+        locked_tables = []
+        try:
+            for table in self.tables.values():
+                if not table.lock.acquire(blocking=False): return
+                locked_tables.append(table)
+                if table.batch_operations is not None: return
+            for table in locked_tables:
+                table.dump_to_file()
+            self.journal.truncate()
+            self.write_state_snapshot()
+        finally:
+            for table in locked_tables:
+                table.lock.release()
+            self.compaction_lock.release()
+
+    # Writes the state to STATE_SNAPSHOT_FILE_PATH, if it is not None. It must
+    # be called only when the files contain the current state (thus, with the
+    # journal, only just after a compaction).
+    def write_state_snapshot(self):
+        if self.state_snapshot_path is None: return
+        tables = [self.tables[name] for name in sorted(self.tables)]
+        for table in tables:
+            table.lock.acquire()
+        try:
+            with self.history_manager.lock:
+                write_state_snapshot(
+                    self.state_snapshot_path,
+                    {table.name: table.to_file_dict() for table in tables},
+                    self.history_manager.corrections.values(),
+                    [self.history_path] + list(self.table_paths.values()))
+        finally:
+            for table in tables:
+                table.lock.release()
+
+    # To be called on shutdown: compacts and closes the journal, writes the
+    # dirty tables of the persister, writes the state snapshot and releases
+    # the state backend.
+    def close(self):
+        if self.closed: return
+        self.closed = True
+        if self.persister is not None:
+            self.persister.close()
+        if self.journal is not None or self.state_snapshot_path is not None:
+            self.begin_operation()
+            try:
+                if self.journal is not None: self.compact()
+                else: self.write_state_snapshot()
+            finally:
+                self.end_operation()
+        if self.journal is not None:
+            self.journal.close()
+        self.state_backend.close()
+
+    # Returns the snapshot of the current state of the tables. The snapshot is
+    # cached and it is rebuilt only if an operation happened since the last
+    # call.
+    # The last modification time of the snapshot is the time of the last
+    # operation, which is shared by the processes sharing the state.
+    def get_snapshot(self):
+        with self.snapshot_lock:
+            operations_num, last_operation_time_ns = self.history_manager.get_last_operation()
+            if self.snapshot is None or self.snapshot.operations_num != operations_num:
+                self.snapshot = TablesSnapshot(
+                    operations_num,
+                    [table.to_dict() for table in self.tables.values()],
+                    last_operation_time_ns // 10**9)
+            return self.snapshot
+
+    # Returns the timeline of the coordinations (see cohmo/timeline.py). The
+    # timeline is cached and it is rebuilt only if an operation happened
+    # since the last call or if it is older than TIMELINE_REFRESH_INTERVAL
+    # seconds (since the projected times depend on the current time).
+    def get_timeline(self):
+        with self.timeline_lock:
+            snapshot = self.get_snapshot()
+            now = max(self.start_time, int(time.time()))
+            if self.timeline is None or \
+                    self.timeline.operations_num != snapshot.operations_num or \
+                    now - self.timeline.now >= self.timeline_refresh_interval:
+                self.timeline = Timeline(snapshot.operations_num, now,
+                                         snapshot.tables_data, self.break_times)
+            return self.timeline
+
     # Returns a list of all teams that are currently in a coordination session are being called.
     # They are unavailable for being called by other teams.
     def get_unavailable_teams(self):
-        current_teams = [table.current_coordination_team for table in self.tables.values() if table.status == 1]
-        calling_teams = [table.queue[0] for table in self.tables.values() if table.status == 0]
-        return current_teams + calling_teams
+        with self.unavailable_teams_lock:
+            return list(self.unavailable_teams)
+
+    # Returns whether the team is neither in a coordination session nor being
+    # called. If table_name is given, the table itself does not count (e.g. it
+    # can start the coordination of the team it is calling).
+    def is_available(self, team, table_name=None):
+        if table_name is None:
+            return team not in self.unavailable_teams
+        with self.unavailable_teams_lock:
+            return all(name == table_name for name in self.unavailable_teams.get(team, {}))
+
+    # Returns whether team can become unavailable because of table during a
+    # batch on the given tables, whose unavailable teams are updated only at
+    # the end of the batch (see apply_batch).
+    def is_available_in_batch(self, team, table, tables):
+        names = {other.name for other in tables}
+        with self.unavailable_teams_lock:
+            if any(name not in names for name in self.unavailable_teams.get(team, {})):
+                return False
+        return all(other is table or other.get_unavailable_team() != team
+                   for other in tables)
+
+    # The following methods perform the operations made of many steps on a
+    # table atomically, holding the lock of the table for the whole operation
+    # (and availability_lock, if the operation may make a team unavailable).
+    # They return a pair (ok, message), where message describes the outcome
+    # of the operation, or is None if there is nothing to say.
+
+    # Starts the coordination of the table with team, removing it from the
+    # queue.
+    def start_coordination(self, table_name, team):
+        table = self.tables[table_name]
+        with self.availability_lock, table.lock:
+            if team not in table.queue_set:
+                return False, TEAM_NOT_IN_QUEUE.format(team, table_name)
+            if not self.is_available(team, table_name):
+                return False, TEAM_NOT_AVAILABLE.format(team)
+            if not table.start_coordination(team):
+                return False, 'An error occurred while deleting the team from the queue.'
+            if not table.remove_from_queue(team):
+                return False, 'An error occurred removing the team from the queue.'
+            return True, None
+
+    # Finishes the current coordination of the table, putting the team back
+    # at the end of the queue.
+    def pause_coordination(self, table_name):
+        table = self.tables[table_name]
+        with table.lock:
+            team = table.current_coordination_team
+            if team not in self.teams_set:
+                return False, 'Team {0} does not exist.'.format(team)
+            if not table.finish_coordination():
+                return False, 'There was an issue finishing the coordination.'
+            if not table.add_to_queue(team):
+                return False, 'The coordination has been paused, but there was an issue inserting the team again in the queue.'
+            return True, None
+
+    # Starts calling the first team in the queue of the table, if it is
+    # available.
+    def switch_to_calling(self, table_name):
+        table = self.tables[table_name]
+        with self.availability_lock, table.lock:
+            if len(table.queue) == 0:
+                return False, 'There are no teams to call.'
+            team = table.queue[0]
+            if not self.is_available(team):
+                return False, TEAM_NOT_AVAILABLE.format(team)
+            if not table.switch_to_calling():
+                return False, 'An error occured while switching the status to calling.'
+            return True, None
+
+    # Moves team (if available) to the first position of the queue of the
+    # table and starts calling it.
+    def call_team(self, table_name, team):
+        table = self.tables[table_name]
+        with self.availability_lock, table.lock:
+            if not self.is_available(team):
+                return False, TEAM_NOT_AVAILABLE.format(team)
+            if team in table.queue_set:
+                if not table.remove_from_queue(team):
+                    return False, 'There was an error removing the team from the queue.'
+            if not table.add_to_queue(team, 0):
+                return False, 'An error occurred placing the team first in the queue.'
+            if table.status != TableStatus.CALLING:
+                if not table.switch_to_calling():
+                    return False, 'An error occurred while switching the status to calling.'
+            return True, None
+
+    # Moves the team being called by the table back by skipped_positions
+    # positions, so that the next team (if available) is called.
+    def skip_to_next(self, table_name):
+        table = self.tables[table_name]
+        with self.availability_lock, table.lock:
+            if table.status != TableStatus.CALLING:
+                return False, 'You can not skip to call the next team if you are not calling.'
+            if len(table.queue) == 0:
+                return True, 'There are no teams to correct.'
+            if len(table.queue) == 1:
+                return True, 'There is only a team to correct yet.'
+            next_team = table.queue[1]
+            if not self.is_available(next_team):
+                return False, TEAM_NOT_AVAILABLE.format(next_team)
+            team = table.queue[0]
+            if not table.remove_from_queue(team):
+                return False, 'Problem removing the team from queue.'
+            if not table.add_to_queue(team, min(self.skipped_positions, len(table.queue))):
+                return False, 'An error occurred while adding the team in the queue.'
+            return True, None
+
+    # Applies atomically a list of operations on the queues of the tables.
+    # Each operation is a dictionary of one of the forms:
+    #   {'table': table_name, 'op': 'add_to_queue', 'team': team, 'pos': pos}
+    #   {'table': table_name, 'op': 'remove_from_queue', 'team': team}
+    #   {'table': table_name, 'op': 'swap_teams_in_queue', 'teams': [team1, team2]}
+    # where pos is optional (default is last).
+    # The operations are applied in order, and if one of them fails all of
+    # them are undone. An operation fails also if it makes a calling table
+    # call a team that is not available. The affected tables recompute their
+    # expected durations and are persisted only once, at the end.
+    # Returns the list of the results, as pairs (ok, message), of the
+    # operations applied (the ones after a failed operation are not tried).
+    # Raises a ValueError if an operation is malformed or refers to a table or
+    # a team that does not exist.
+    def apply_batch(self, operations):
+        if not isinstance(operations, list):
+            raise ValueError('The operations must be a list.')
+        for i, operation in enumerate(operations):
+            self.validate_batch_operation(i, operation)
+        tables = [self.tables[name]
+                  for name in sorted({operation['table'] for operation in operations})]
+        self.availability_lock.acquire()
+        for table in tables:
+            table.lock.acquire()
+        try:
+            rollback_states = {table.name: table.to_file_dict() for table in tables}
+            for table in tables:
+                table.begin_batch()
+            results = []
+            try:
+                for operation in operations:
+                    table = self.tables[operation['table']]
+                    unavailable_team = table.get_unavailable_team()
+                    result = self.apply_batch_operation(operation)
+                    team = table.get_unavailable_team()
+                    if result[0] and team not in [None, unavailable_team] and \
+                            not self.is_available_in_batch(team, table, tables):
+                        result = False, TEAM_NOT_AVAILABLE.format(team)
+                    results.append(result)
+                    if not results[-1][0]: break
+            except:
+                for table in tables:
+                    table.end_batch(rollback_states[table.name])
+                raise
+            failed = len(results) > 0 and not results[-1][0]
+            for table in tables:
+                table.end_batch(rollback_states[table.name] if failed else None)
+            return results
+        finally:
+            for table in tables:
+                table.lock.release()
+            self.availability_lock.release()
+
+    # Raises a ValueError if the i-th operation of a batch is malformed (see
+    # apply_batch).
+    def validate_batch_operation(self, i, operation):
+        if not isinstance(operation, dict) or 'op' not in operation:
+            raise ValueError('The operation {0} is malformed.'.format(i))
+        if operation.get('table') not in self.tables:
+            raise ValueError('Table {0} does not exist.'.format(operation.get('table')))
+        if operation['op'] in ['add_to_queue', 'remove_from_queue']:
+            if 'team' not in operation:
+                raise ValueError('The operation {0} does not specify a team.'.format(i))
+            teams = [operation['team']]
+        elif operation['op'] == 'swap_teams_in_queue':
+            if not isinstance(operation.get('teams'), list) or len(operation['teams']) != 2:
+                raise ValueError('The operation {0} does not specify exactly two teams.'.format(i))
+            teams = operation['teams']
+        else:
+            raise ValueError('Unknown operation \'{0}\'.'.format(operation['op']))
+        for team in teams:
+            if not isinstance(team, str) or team not in self.teams_set:
+                raise ValueError('Team {0} does not exist.'.format(team))
+        pos = operation.get('pos')
+        if pos is not None and (isinstance(pos, bool) or not isinstance(pos, int)):
+            raise ValueError('The position of the operation {0} must be an integer.'.format(i))
+
+    # Applies a single operation of a batch, already validated, and returns
+    # the pair (ok, message).
+    def apply_batch_operation(self, operation):
+        table = self.tables[operation['table']]
+        if operation['op'] == 'add_to_queue':
+            team = operation['team']
+            if team in table.queue_set:
+                return False, 'Team {0} is already in queue at table {1}.'.format(team, table.name)
+            pos = operation.get('pos')
+            if pos is None: pos = -1
+            elif not 0 <= pos <= len(table.queue):
+                return False, 'The position {0} is not valid.'.format(pos)
+            if not table.add_to_queue(team, pos):
+                return False, 'An error occurred while adding the team in the queue.'
+        elif operation['op'] == 'remove_from_queue':
+            team = operation['team']
+            if team not in table.queue_set:
+                return False, TEAM_NOT_IN_QUEUE.format(team, table.name)
+            if not table.remove_from_queue(team):
+                return False, 'An error occurred while deleting the team from the queue.'
+        else:
+            for team in operation['teams']:
+                if team not in table.queue_set:
+                    return False, TEAM_NOT_IN_QUEUE.format(team, table.name)
+            if not table.swap_teams_in_queue(*operation['teams']):
+                return False, 'An error occurred while swapping the teams in the queue.'
+        return True, None
+
+    # Replaces the queues of all the tables with the ones of the plan (see
+    # cohmo/schedule_plan.py), in a single pass holding the locks of all the
+    # tables. The tables not in the plan get an empty queue.
+    # A table calling a team keeps calling it: the team is moved to the first
+    # position of the planned queue of the table (thus the teams that are
+    # unavailable do not change). If the plan does not put the team in the
+    # queue of the table, no queue is changed.
+    # Returns a pair (ok, message).
+    # Raises a ValueError, without changing any queue, if the plan refers to
+    # tables or teams that do not exist, or if some team is not exactly once
+    # in the queues of each problem.
+    def import_schedule(self, plan):
+        validate_plan(plan, self.teams,
+                      {name: table.problem for name, table in self.tables.items()})
+        tables = [self.tables[name] for name in sorted(self.tables)]
+        for table in tables:
+            table.lock.acquire()
+        try:
+            queues = {}
+            for table in tables:
+                queue = list(plan.get(table.name, []))
+                if table.status == TableStatus.CALLING and table.queue:
+                    team = table.queue[0]
+                    if team not in queue:
+                        return False, 'Table {0} is calling team {1}, that the plan moves to another table.'.format(table.name, team)
+                    queue.remove(team)
+                    queue.insert(0, team)
+                queues[table.name] = queue
+            for table in tables:
+                table.set_queue(queues[table.name])
+            return True, None
+        finally:
+            for table in tables:
+                table.lock.release()
+
+    # Proposes new queues for the tables that make the coordinations end as
+    # soon as possible, starting from the current state (see
+    # cohmo/scheduler.py). The expected duration of the coordinations at a
+    # table is the current expected duration of the table, the teams being
+    # corrected are busy until the expected end of their coordinations and
+    # the teams being called stay first in their queues.
+    # If allow_table_changes is True, teams can be moved to other tables of
+    # the same problem.
+    # The search lasts time_budget seconds (SCHEDULER_TIME_BUDGET if None)
+    # and does not hold any lock, so the state may change in the meanwhile.
+    # Returns the dictionary returned by Scheduler.schedule, with the
+    # additional key base_queues, containing the queues the proposal starts
+    # from (see apply_proposed_schedule).
+    def propose_schedule(self, time_budget=None, allow_table_changes=True):
+        if time_budget is None: time_budget = self.scheduler_time_budget
+        now = int(time.time())
+        tables, team_available_times = self.get_scheduling_tables(now)
+        scheduler = Scheduler(tables, self.break_times, max(now, self.start_time),
+                              team_available_times, allow_table_changes)
+        proposal = scheduler.schedule(time_budget)
+        proposal['base_queues'] = {table['name']: table['queue'] for table in tables}
+        return proposal
+
+    # Returns the simulation of the rest of the day (see cohmo/simulation.py)
+    # with SIMULATION_RUNS runs. The durations at a table are drawn from its
+    # past corrections, padded with APRIORI_DURATION up to NUM_SIGN_CORR
+    # samples and clamped between MINIMUM_DURATION and MAXIMUM_DURATION, as
+    # for the expected duration (see Table.compute_expected_duration).
+    # The simulation is cached and it is recomputed only if an operation
+    # happened since the last call.
+    # Raises an ImportError if numpy is not installed.
+    def get_simulation(self):
+        with self.simulation_lock:
+            operations_num = self.history_manager.operations_num
+            if self.simulation is None or self.simulation[0] != operations_num:
+                now = int(time.time())
+                tables, team_available_times = self.get_scheduling_tables(now)
+                config = self.additional_config
+                duration_samples = {}
+                for table in tables:
+                    durations = self.history_manager.get_durations(table['name']).tolist()
+                    durations += [config['APRIORI_DURATION']] * \
+                        max(config['NUM_SIGN_CORR'] - len(durations), 0)
+                    duration_samples[table['name']] = [
+                        min(max(duration, config['MINIMUM_DURATION']), config['MAXIMUM_DURATION'])
+                        for duration in durations]
+                self.simulation = (operations_num, simulate_day(
+                    tables, team_available_times, duration_samples, self.break_times,
+                    max(now, self.start_time), config['SIMULATION_RUNS']))
+            return self.simulation[1]
+
+    # Returns the pair (tables, team_available_times) describing the current
+    # state of the tables to the scheduler (see cohmo/scheduler.py), assuming
+    # that the current coordinations last the expected duration.
+    # The dictionaries of the tables have the additional keys current_team
+    # and current_start_time, describing the current coordination (they are
+    # None if the table is not correcting).
+    def get_scheduling_tables(self, now):
+        tables = []
+        team_available_times = {}
+        for name, table in self.tables.items():
+            with table.lock:
+                duration = table.get_expected_duration()
+                available_time = now
+                current_team = current_start_time = None
+                if table.status == TableStatus.CORRECTING:
+                    current_team = table.current_coordination_team
+                    current_start_time = table.current_coordination_start_time
+                    available_time = max(now, current_start_time + duration)
+                    team_available_times[current_team] = available_time
+                tables.append({'name': name,
+                               'problem': table.problem,
+                               'duration': duration,
+                               'queue': list(table.queue),
+                               'available_time': available_time,
+                               'pinned': table.status == TableStatus.CALLING,
+                               'current_team': current_team,
+                               'current_start_time': current_start_time})
+        return tables, team_available_times
+
+    # Replaces the queues of the tables with the ones proposed by
+    # propose_schedule, holding the locks of all the tables. The proposal is
+    # applied only if the queues are still base_queues and the teams being
+    # called are still first in their queues.
+    # Returns a pair (ok, message).
+    # Raises a ValueError if the queues are malformed, refer to tables that do
+    # not exist or are not a rearrangement of base_queues between the tables
+    # of the same problem.
+    def apply_proposed_schedule(self, queues, base_queues):
+        queues = parse_json_plan(queues)
+        base_queues = parse_json_plan(base_queues)
+        problem_teams = {}
+        for sign, plan in [(1, queues), (-1, base_queues)]:
+            for table_name, queue in plan.items():
+                if table_name not in self.tables:
+                    raise ValueError('Table {0} does not exist.'.format(table_name))
+                counts = problem_teams.setdefault(self.tables[table_name].problem, {})
+                for team in queue:
+                    counts[team] = counts.get(team, 0) + sign
+        for problem in sorted(problem_teams):
+            for team, count in problem_teams[problem].items():
+                if count != 0:
+                    raise ValueError('The proposal changes the teams in the queues of problem {0}.'.format(problem))
+        tables = [self.tables[name] for name in sorted(self.tables)]
+        for table in tables:
+            table.lock.acquire()
+        try:
+            for table in tables:
+                if table.queue != base_queues.get(table.name, []):
+                    return False, 'The queue of table {0} changed, the proposal is outdated.'.format(table.name)
+                if table.status == TableStatus.CALLING and table.queue and \
+                        queues.get(table.name, [])[:1] != table.queue[:1]:
+                    return False, 'Table {0} is calling a team that the proposal moves.'.format(table.name)
+            for table in tables:
+                queue = queues.get(table.name, [])
+                if table.queue != queue: table.set_queue(queue)
+            return True, None
+        finally:
+            for table in tables:
+                table.lock.release()
@@ -1,16 +1,29 @@
 import sys
+from array import array
 from base64 import b32encode
+from bisect import bisect_left, bisect_right
+from collections import deque
+from operator import attrgetter
 from os import urandom
+import os
+import io
 import csv
-import shutil
+import threading
 import time
+from cohmo.persister import replace_file
 
 # Simple class to store a correction.
+# Since a long history contains hundreds of thousands of corrections, they
+# have no __dict__ (the attributes are __slots__) and the names of the teams
+# and of the tables are interned, so that the corrections of a team (or of a
+# table) share the same string.
 class Correction:
+    __slots__ = ('team', 'table', 'start_time', 'end_time', 'id')
+
     def __init__(self, team, table, start_time, end_time, identifier=None):
         assert(end_time >= start_time)
-        self.team = team
-        self.table = table
+        self.team = sys.intern(team)
+        self.table = sys.intern(table)
         self.start_time = start_time # timestamp in seconds
         self.end_time = end_time # timestamp in seconds
         if identifier: self.id = identifier
@@ -20,9 +33,91 @@ class Correction:
     def duration(self):
         return self.end_time - self.start_time
 
+# An index of corrections sorted by a key (e.g. the start time), supporting
+# insertions, deletions and range queries via binary search.
+# The corrections are split in blocks of at most 2 * BLOCK_SIZE sorted
+# corrections (with maxes the largest key of each block), so that an insertion
+# or a deletion moves the elements of a single block instead of the whole
+# history.
+class SortedIndex:
+    BLOCK_SIZE = 512
+
+    def __init__(self, key, corrections=[]):
+        self.key = key
+        corrections = sorted(corrections, key=key)
+        keys = [key(correction) for correction in corrections]
+        size = SortedIndex.BLOCK_SIZE
+        self.blocks = [corrections[i:i + size] for i in range(0, len(corrections), size)]
+        self.key_blocks = [keys[i:i + size] for i in range(0, len(keys), size)]
+        self.maxes = [block[-1] for block in self.key_blocks]
+
+    def add(self, correction):
+        key = self.key(correction)
+        if not self.blocks:
+            self.blocks.append([correction])
+            self.key_blocks.append([key])
+            self.maxes.append(key)
+            return
+        i = min(bisect_right(self.maxes, key), len(self.maxes) - 1)
+        keys = self.key_blocks[i]
+        pos = bisect_right(keys, key)
+        keys.insert(pos, key)
+        self.blocks[i].insert(pos, correction)
+        self.maxes[i] = keys[-1]
+        if len(keys) > 2 * SortedIndex.BLOCK_SIZE:
+            size = SortedIndex.BLOCK_SIZE
+            self.blocks[i:i + 1] = [self.blocks[i][:size], self.blocks[i][size:]]
+            self.key_blocks[i:i + 1] = [keys[:size], keys[size:]]
+            self.maxes[i:i + 1] = [keys[size - 1], keys[-1]]
+
+    def remove(self, correction):
+        key = self.key(correction)
+        # The corrections with the same key can span many blocks.
+        for i in range(bisect_left(self.maxes, key), len(self.maxes)):
+            keys = self.key_blocks[i]
+            if keys[0] > key: return
+            for pos in range(bisect_left(keys, key), bisect_right(keys, key)):
+                if self.blocks[i][pos] is correction:
+                    del keys[pos]
+                    del self.blocks[i][pos]
+                    if keys:
+                        self.maxes[i] = keys[-1]
+                    else:
+                        del self.blocks[i], self.key_blocks[i], self.maxes[i]
+                    return
+
+    # Returns the number of corrections whose key is smaller than key (or
+    # smaller or equal, if bisect is bisect_right).
+    def position(self, key, bisect):
+        i = bisect(self.maxes, key)
+        pos = sum(len(keys) for keys in self.key_blocks[:i])
+        if i < len(self.key_blocks): pos += bisect(self.key_blocks[i], key)
+        return pos
+
+    # Returns the number of corrections whose key is in [begin, end].
+    def count(self, begin, end):
+        return max(self.position(end, bisect_right) - self.position(begin, bisect_left), 0)
+
+    # Returns the corrections whose key is in [begin, end], sorted by key.
+    def range(self, begin, end):
+        result = []
+        for i in range(bisect_left(self.maxes, begin), len(self.maxes)):
+            keys = self.key_blocks[i]
+            if keys[0] > end: break
+            result.extend(self.blocks[i][bisect_left(keys, begin):bisect_right(keys, end)])
+        return result
+
 # The manager of the past corrections.
-# The internal state is simply a list of corrections.
+# The internal state is simply a dictionary of the corrections, keyed by id
+# and in the order they were added, so that a correction is deleted in
+# constant time.
 # It can load (and dump) the history from a csv file.
+# Moreover, for each table, it keeps updated the number of corrections and the
+# sum (and the sum of squares) of their durations, so that the expected
+# duration of a table can be computed without scanning the whole history.
+# To answer get_corrections without scanning the whole history, the
+# corrections are indexed by table and team (with dictionaries) and by start
+# and end time (with sorted indexes).
 class HistoryManager:
     # Loads the corrections from a file.
     # Can raise a ValueError if the file is malformed.
@@ -30,9 +125,23 @@ class HistoryManager:
     # form:
     #   team, table, start_time, end_time, id
     # The first line must contain the number of past operations happened.
-    def __init__(self, path):
+    # The names of the tables concerned by the last recent_operations_size
+    # operations are remembered (see get_changed_tables).
+    # If a storage is given, the corrections are read from and saved to the
+    # storage instead of the csv file (see cohmo/sqlite_storage.py).
+    # If a persister is given, the file is rewritten by the persister (see
+    # cohmo/persister.py) instead of during the operations.
+    # If corrections is given, as a list of tuples (team, table, start_time,
+    # end_time, id), they are loaded instead of reading the file (see
+    # cohmo/state_snapshot.py).
+    def __init__(self, path, recent_operations_size=1000, storage=None,
+                 persister=None, corrections=None):
         self.path = path
-        self.corrections = []
+        self.storage = storage
+        self.persister = persister
+        # If not None, the backups of the file are kept (see Backups in
+        # cohmo/persister.py). It is set by the owner of the history.
+        self.backups = None
         self.expected_durations = {}
         # An increasing variable keeping track of the number of operations
         # related to tables ever happened.
@@ -40,39 +149,222 @@ class HistoryManager:
         # initialized to a value that is reasonably larger than any value that
         # could have been realized in a previous run.
         self.operations_num = int(time.time())
+        # The time of the last operation, as a timestamp in nanoseconds (it is
+        # the construction time until an operation happens, since the time of
+        # the operations of a previous run is unknown).
+        self.last_operation_time_ns = time.time_ns()
+        # Notified whenever operations_num changes.
+        self.operations_condition = threading.Condition()
+        # Functions called with the new operations_num whenever it changes
+        # (see add_operation_listener).
+        self.operation_listeners = []
+        # Ring buffer of pairs (operations_num, table name) of the most recent
+        # operations.
+        self.recent_operations = deque(maxlen=recent_operations_size)
+        # Held while the corrections (and their indexes) are read or
+        # modified, since the tables of different threads share the history.
+        self.lock = threading.RLock()
+        self.load(corrections)
+
+    # Loads (or reloads) the corrections from the file or, if given, from a
+    # list of tuples (team, table, start_time, end_time, id).
+    def load(self, corrections=None):
+        with self.lock:
+            # Dictionary of the form table: [number of corrections, sum of the
+            # durations, sum of the squares of the durations].
+            self.duration_statistics = {}
+            if corrections is None:
+                if self.storage is not None:
+                    corrections = self.storage.load_corrections()
+                else:
+                    with open(self.path, newline='') as history_file:
+                        corrections = HistoryManager.read_rows(history_file, self.path)
+            self.corrections = {}
+            for row in corrections:
+                correction = Correction(*row)
+                self.corrections[correction.id] = correction
+            # The indexes and the statistics are built all at once, as
+            # index_correction would do for each correction (but much faster,
+            # for a long history).
+            self.index_by_table = {}
+            self.index_by_team = {}
+            for correction in self.corrections.values():
+                self.index_by_table.setdefault(correction.table, {})[correction.id] = correction
+                self.index_by_team.setdefault(correction.team, {})[correction.id] = correction
+            for table, table_corrections in self.index_by_table.items():
+                durations = [correction.duration() for correction in table_corrections.values()]
+                self.duration_statistics[table] = [
+                    len(durations), sum(durations),
+                    sum(duration * duration for duration in durations)]
+            self.start_time_index = SortedIndex(attrgetter('start_time'),
+                                                self.corrections.values())
+            self.end_time_index = SortedIndex(attrgetter('end_time'),
+                                              self.corrections.values())
+
+    # Returns the list of the corrections, as tuples (team, table, start_time,
+    # end_time, id), contained in the csv file history_file (read from path).
+    @staticmethod
+    def read_rows(history_file, path):
+        rows = []
         try:
-            with open(path, newline='') as history_file:
-                history_reader = csv.reader(
-                    history_file, delimiter=',', quotechar='"')
-                for row in history_reader:
-                    if not row: continue
-                    assert(len(row) == 5)
-                    self.corrections.append(Correction(
-                        row[0].strip(), row[1].strip(), int(row[2]),
-                        int(row[3]), row[4].strip()))
+            history_reader = csv.reader(history_file, delimiter=',', quotechar='"')
+            for row in history_reader:
+                if not row: continue
+                assert(len(row) == 5)
+                rows.append((row[0].strip(), row[1].strip(), int(row[2]),
+                             int(row[3]), row[4].strip()))
         except AssertionError:
             raise ValueError('The file \'{0}\' is malformed.'.format(path))
+        return rows
+
+    # Adds a correction to the indexes and to the duration statistics.
+    def index_correction(self, correction):
+        self.index_by_table.setdefault(correction.table, {})[correction.id] = correction
+        self.index_by_team.setdefault(correction.team, {})[correction.id] = correction
+        self.start_time_index.add(correction)
+        self.end_time_index.add(correction)
+        self.update_duration_statistics(correction, 1)
+
+    # Removes a correction from the indexes and from the duration statistics.
+    def unindex_correction(self, correction):
+        del self.index_by_table[correction.table][correction.id]
+        del self.index_by_team[correction.team][correction.id]
+        self.start_time_index.remove(correction)
+        self.end_time_index.remove(correction)
+        self.update_duration_statistics(correction, -1)
+
+    # Adds (if sign is 1) or removes (if sign is -1) a correction from the
+    # duration statistics of its table.
+    def update_duration_statistics(self, correction, sign):
+        if correction.table not in self.duration_statistics:
+            self.duration_statistics[correction.table] = [0, 0, 0]
+        statistics = self.duration_statistics[correction.table]
+        duration = correction.duration()
+        statistics[0] += sign
+        statistics[1] += sign * duration
+        statistics[2] += sign * duration * duration
+
+    # Returns the pair (number of corrections, sum of the durations) of the
+    # corrections done by the given table.
+    def get_duration_statistics(self, table):
+        with self.lock:
+            if table not in self.duration_statistics: return 0, 0
+            statistics = self.duration_statistics[table]
+            return statistics[0], statistics[1]
+
+    # Returns the durations of the corrections done by the given table, as an
+    # array('q') (that can be passed as it is to numpy.asarray).
+    def get_durations(self, table):
+        with self.lock:
+            return array('q', [correction.end_time - correction.start_time
+                               for correction in self.index_by_table.get(table, {}).values()])
+
+    # Increments operations_num, remembers that the operation concerned the
+    # given table and wakes up whoever is waiting for a new operation.
+    def register_operation(self, table_name):
+        with self.operations_condition:
+            self.operations_num += 1
+            self.last_operation_time_ns = time.time_ns()
+            self.recent_operations.append((self.operations_num, table_name))
+            self.operations_condition.notify_all()
+            operations_num = self.operations_num
+        self.notify_operation_listeners(operations_num)
+
+    # Sets operations_num (and, if given, last_operation_time_ns) to a value
+    # coming from another process (see cohmo/state_backend.py). Since the
+    # tables concerned by the operations of the other process are unknown,
+    # the recent operations are forgotten.
+    def set_operations_num(self, operations_num, last_operation_time_ns=None):
+        with self.operations_condition:
+            self.operations_num = operations_num
+            if last_operation_time_ns is not None:
+                self.last_operation_time_ns = last_operation_time_ns
+            self.recent_operations.clear()
+            self.operations_condition.notify_all()
+        self.notify_operation_listeners(operations_num)
+
+    # Returns the pair (operations_num, last_operation_time_ns), read atomically.
+    def get_last_operation(self):
+        with self.operations_condition:
+            return self.operations_num, self.last_operation_time_ns
+
+    # Registers a function to be called, with the new operations_num, whenever
+    # operations_num changes. It is called by the thread performing the
+    # operation (possibly holding the lock of a table), hence it must not
+    # block: the event loop of cohmo/asgi.py uses it to wake up its waiting
+    # clients with loop.call_soon_threadsafe.
+    def add_operation_listener(self, listener):
+        with self.operations_condition:
+            self.operation_listeners.append(listener)
+
+    def remove_operation_listener(self, listener):
+        with self.operations_condition:
+            if listener in self.operation_listeners:
+                self.operation_listeners.remove(listener)
+
+    def notify_operation_listeners(self, operations_num):
+        with self.operations_condition:
+            listeners = list(self.operation_listeners)
+        for listener in listeners:
+            listener(operations_num)
+
+    # Returns the set of names of the tables concerned by the operations
+    # happened after the operation with number last_operations_num.
+    # Returns None if these operations are not all remembered (or if
+    # last_operations_num does not come from this run).
+    def get_changed_tables(self, last_operations_num):
+        with self.operations_condition:
+            if last_operations_num > self.operations_num: return None
+            if (self.operations_num - last_operations_num
+                    > len(self.recent_operations)): return None
+            changed_tables = set()
+            for operations_num, table_name in reversed(self.recent_operations):
+                if operations_num <= last_operations_num: break
+                changed_tables.add(table_name)
+            return changed_tables
+
+    # Waits until operations_num is different from last_operations_num, or
+    # until timeout seconds have passed. Returns the current operations_num.
+    def wait_for_operation(self, last_operations_num, timeout):
+        with self.operations_condition:
+            self.operations_condition.wait_for(
+                lambda: self.operations_num != last_operations_num, timeout)
+            return self.operations_num
 
     # Dumps all the corrections to a file. The format is the same used by
     # the constructor, see the header comment of __init__ for the
     # specifications.
+    # The file is replaced atomically (see replace_file), and when it is the
+    # default file its backups are rotated. The lock is held also while
+    # writing, so that no correction is appended to the file being replaced.
     def dump_to_file(self, path=None):
-        if path is None:
-            path = self.path
-            shutil.copyfile(path, path + '.backup')
-        with open(path, 'w', newline='') as history_file:
-            history_writer = csv.writer(history_file, delimiter=',',
-                                        quotechar='"',
-                                        quoting=csv.QUOTE_MINIMAL)
-            for correction in self.corrections:
-                history_writer.writerow([correction.team, correction.table,
-                                        correction.start_time,
-                                        correction.end_time, correction.id])
+        with self.lock:
+            history_file = io.StringIO(newline='')
+            self.write_corrections(history_file)
+            replace_file(self.path if path is None else path, history_file.getvalue())
+            if path is None and self.backups is not None:
+                self.backups.rotate(self.path)
+
+    def write_corrections(self, history_file):
+        history_writer = csv.writer(history_file, delimiter=',',
+                                    quotechar='"',
+                                    quoting=csv.QUOTE_MINIMAL)
+        for correction in self.corrections.values():
+            history_writer.writerow([correction.team, correction.table,
+                                    correction.start_time,
+                                    correction.end_time, correction.id])
 
     # Appends a single correction to a csv file.
     def append_to_file(self, new_correction, path=None):
         if path is None: path = self.path
+        # The last row of a file written by hand may lack the final newline.
+        missing_newline = False
+        with open(path, 'rb') as history_file:
+            if history_file.seek(0, os.SEEK_END) > 0:
+                history_file.seek(-1, os.SEEK_END)
+                missing_newline = history_file.read(1) not in b'\r\n'
         with open(path, 'a', newline='') as history_file:
+            if missing_newline: history_file.write('\r\n')
             history_writer = csv.writer(history_file, delimiter=',',
                                         quotechar='"',
                                         quoting=csv.QUOTE_MINIMAL)
@@ -81,24 +373,34 @@ class HistoryManager:
                                      new_correction.end_time, new_correction.id])
 
     # Adds a single correction to the history (updating the expected_duration
-    # of the related table).
-    def add(self, team, table, start_time, end_time):
-        if start_time > end_time: return False # Maybe raise ValueError
-        new_correction = Correction(team, table, start_time, end_time)
-        self.corrections.append(new_correction)
-        self.append_to_file(new_correction)
-        # ~ self.compute_expected_duration(table)
-        return True
+    # of the related table). It is registered as an operation of the table
+    # (see register_operation), since the history is part of the state,
+    # unless register is False (when the caller registers it, see
+    # Table.finish_coordination).
+    def add(self, team, table, start_time, end_time, register=True):
+        with self.lock:
+            if start_time > end_time: return False # Maybe raise ValueError
+            if register: self.register_operation(table)
+            new_correction = Correction(team, table, start_time, end_time)
+            self.corrections[new_correction.id] = new_correction
+            self.index_correction(new_correction)
+            if self.storage is not None: self.storage.add_correction(new_correction)
+            else: self.append_to_file(new_correction)
+            # ~ self.compute_expected_duration(table)
+            return True
 
     # Deletes a correction (updating the expected_duration of the related table)
     # and returns True if it was succesfully deleted.
     def delete(self, correction_id):
-        for correction in self.corrections:
-            if correction.id == correction_id:
-                self.corrections.remove(correction)
-                self.dump_to_file()
-                return True
-        return False
+        with self.lock:
+            if correction_id not in self.corrections: return False
+            correction = self.corrections.pop(correction_id)
+            self.register_operation(correction.table)
+            self.unindex_correction(correction)
+            if self.storage is not None: self.storage.delete_correction(correction_id)
+            elif self.persister is not None: self.persister.mark_dirty(self.path, self.dump_to_file)
+            else: self.dump_to_file()
+            return True
 
     # Returns a (eventually empty) list of corrections that satisfies all the
     # given filters. If all corrections are desired, no property should be
@@ -112,26 +414,51 @@ class HistoryManager:
     #                     the range are returned.
     # end_time (range): Exactly as start_time, but the corrections that end
     #                   in the range are returned.
+    #
+    # The candidates are taken from the most selective index among the ones
+    # of the given filters, and then the other filters are checked on them.
+    # The corrections are returned in the order they were added to the
+    # history, unless a time range is the most selective filter (then they are
+    # sorted by that time).
     def get_corrections(self, filters):
-        result = []
-        for correction in self.corrections:
-            filtered_correction = True
+        with self.lock:
+            candidates = self.corrections.values()
             if 'identifier' in filters:
-                filtered_correction &= correction.id == filters['identifier']
-            if 'table' in filters:
-                filtered_correction &= correction.table == filters['table']
-            if 'team' in filters:
-                filtered_correction &= correction.team == filters['team']
-            if 'start_time' in filters:
-                filtered_correction &= (
-                    filters['start_time'][0]
-                    <= correction.start_time
-                    <= filters['start_time'][1])
-            if 'end_time' in filters:
-                filtered_correction &= (
-                    filters['end_time'][0]
-                    <= correction.end_time
-                    <= filters['end_time'][1])
-            
-            if filtered_correction: result.append(correction)
-        return result
+                if filters['identifier'] not in self.corrections: return []
+                candidates = [self.corrections[filters['identifier']]]
+            for key, index in [('table', self.index_by_table),
+                               ('team', self.index_by_team)]:
+                if key in filters:
+                    indexed = index.get(filters[key], {})
+                    if len(indexed) < len(candidates):
+                        candidates = indexed.values()
+            for key, index in [('start_time', self.start_time_index),
+                               ('end_time', self.end_time_index)]:
+                if key in filters:
+                    begin, end = filters[key]
+                    if index.count(begin, end) < len(candidates):
+                        candidates = index.range(begin, end)
+            return [correction for correction in candidates
+                    if HistoryManager.satisfies_filters(correction, filters)]
+
+    # Returns whether the correction satisfies all the given filters (see
+    # get_corrections for their description).
+    @staticmethod
+    def satisfies_filters(correction, filters):
+        if 'identifier' in filters and correction.id != filters['identifier']:
+            return False
+        if 'table' in filters and correction.table != filters['table']:
+            return False
+        if 'team' in filters and correction.team != filters['team']:
+            return False
+        if 'start_time' in filters and not (
+                filters['start_time'][0]
+                <= correction.start_time
+                <= filters['start_time'][1]):
+            return False
+        if 'end_time' in filters and not (
+                filters['end_time'][0]
+                <= correction.end_time
+                <= filters['end_time'][1]):
+            return False
+        return True
@@ -0,0 +1,134 @@
+import json
+import os
+import threading
+import time
+
+# The journal is an append-only log of the operations performed on the tables.
+# When the journaled persistence mode is enabled, every operation on a table
+# is appended to the journal as a single compact json line of the form:
+#   {"seq": sequence_number, "table": table_name, "op": operation_name,
+#    "args": [arguments]}
+# instead of rewriting the whole json file of the table.
+# The json files of the tables are then only rewritten when the journal is
+# compacted (see ChiefCoordinator.compact), and at startup the state of the
+# tables is recovered replaying the journal on top of the json files.
+# The sequence numbers are increasing, and the json file of a table contains
+# the sequence number of the last operation it includes (journal_seq), so
+# that the replay skips the records already in the file. Thus a crash during
+# the compaction, after some files have been rewritten but before the journal
+# is emptied, does not apply any operation twice.
+#
+# The fsync policy can be one of:
+# always: fsync after every record (safest, slowest).
+# periodic: fsync at most once every fsync_interval seconds.
+# never: the data is flushed to the OS but fsync is never called.
+class Journal:
+    FSYNC_POLICIES = ['always', 'periodic', 'never']
+
+    def __init__(self, path, fsync_policy='always', fsync_interval=1,
+                 compaction_threshold=None):
+        if fsync_policy not in Journal.FSYNC_POLICIES:
+            raise ValueError('Unknown fsync policy \'{0}\'.'.format(fsync_policy))
+        self.path = path
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.compaction_threshold = compaction_threshold
+        # Called (without arguments) when the number of records reaches
+        # compaction_threshold. It is set by the owner of the journal.
+        self.compaction_callback = None
+        self.records_num = 0
+        # The sequence number of the last record. The owner of the journal
+        # must set it, after reading the records and the tables, to the
+        # largest sequence number they contain.
+        self.seq = 0
+        self.last_fsync = time.time()
+        # The tables of different threads append to the same journal.
+        self.lock = threading.Lock()
+        self.journal_file = open(path, 'a', newline='')
+
+    # Returns the list of records contained in the journal file.
+    # A malformed last line (caused by a crash in the middle of an append) is
+    # ignored, whereas a malformed line elsewhere raises a ValueError.
+    @staticmethod
+    def read_records(path):
+        if not os.path.exists(path): return []
+        with open(path, newline='') as journal_file:
+            lines = [line for line in journal_file.read().split('\n') if line]
+        records = []
+        for i, line in enumerate(lines):
+            try:
+                record = json.loads(line)
+                assert('table' in record and 'op' in record and 'args' in record)
+            except (ValueError, AssertionError):
+                if i == len(lines) - 1: break
+                raise ValueError('The journal \'{0}\' is malformed.'.format(path))
+            records.append(record)
+        return records
+
+    # Appends an operation to the journal and returns its sequence number.
+    def append(self, table_name, operation, args):
+        return self.append_many(table_name, [(operation, args)])
+
+    # Appends many operations on the same table, given as pairs
+    # (operation, args), with a single write (and fsync). Returns the
+    # sequence number of the last one.
+    def append_many(self, table_name, operations):
+        with self.lock:
+            first_seq = self.seq + 1
+            self.seq += len(operations)
+            seq = self.seq
+            lines = ''.join(json.dumps({'seq': first_seq + i, 'table': table_name,
+                                        'op': operation, 'args': args},
+                                       separators=(',', ':')) + '\n'
+                            for i, (operation, args) in enumerate(operations))
+            self.journal_file.write(lines)
+            self.journal_file.flush()
+            if self.fsync_policy == 'always':
+                os.fsync(self.journal_file.fileno())
+            elif self.fsync_policy == 'periodic':
+                now = time.time()
+                if now - self.last_fsync >= self.fsync_interval:
+                    os.fsync(self.journal_file.fileno())
+                    self.last_fsync = now
+            self.records_num += len(operations)
+        return seq
+
+    # Calls the compaction callback if the number of records reached
+    # compaction_threshold. It is called by the table after an append, once
+    # it has updated its journal_seq (otherwise the compaction would write
+    # the table without the sequence number of the operation just appended).
+    # It must be called without the lock of the journal, since the
+    # compaction needs the locks of the tables, which may be held by threads
+    # waiting to append to the journal.
+    def compact_if_needed(self):
+        with self.lock:
+            records_num = self.records_num
+        if (self.compaction_threshold is not None
+                and records_num >= self.compaction_threshold
+                and self.compaction_callback is not None):
+            self.compaction_callback()
+
+    # Fsyncs the journal, whatever the fsync policy (e.g. for the operations
+    # that must be durable, see ChiefCoordinator.end_operation).
+    def sync(self):
+        with self.lock:
+            if self.journal_file.closed: return
+            self.journal_file.flush()
+            os.fsync(self.journal_file.fileno())
+            self.last_fsync = time.time()
+
+    # Empties the journal. It must be called only after the state of all the
+    # tables has been safely written to their json files.
+    def truncate(self):
+        with self.lock:
+            self.journal_file.flush()
+            self.journal_file.truncate(0)
+            os.fsync(self.journal_file.fileno())
+            self.records_num = 0
+
+    def close(self):
+        with self.lock:
+            if self.journal_file.closed: return
+            self.journal_file.flush()
+            os.fsync(self.journal_file.fileno())
+            self.journal_file.close()
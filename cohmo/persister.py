@@ -0,0 +1,144 @@
+from collections import OrderedDict
+from datetime import datetime
+import glob
+import os
+import shutil
+import threading
+import traceback
+
+# Replaces the content of the file at path with data (a string or bytes),
+# writing it to a temporary file that is then renamed over the file. The
+# temporary file (and then the directory) is fsynced, so that even after a
+# crash the file is either the old one or the new one, never a truncated one.
+def replace_file(path, data):
+    temporary_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    if isinstance(data, bytes):
+        temporary_file = open(temporary_path, 'wb')
+    else:
+        temporary_file = open(temporary_path, 'w', newline='')
+    with temporary_file:
+        temporary_file.write(data)
+        temporary_file.flush()
+        os.fsync(temporary_file.fileno())
+    os.replace(temporary_path, path)
+    fsync_directory(os.path.dirname(os.path.abspath(path)))
+
+def fsync_directory(path):
+    try:
+        directory = os.open(path, os.O_RDONLY)
+    except OSError: # Not supported on Windows.
+        return
+    try:
+        os.fsync(directory)
+    except OSError:
+        pass
+    finally:
+        os.close(directory)
+
+# Keeps the last count backups of the files, as copies named
+# <path>.backup.<timestamp>. A file is copied by rotate (called after each
+# write of the file) only if its last backup is older than interval seconds,
+# so that the copies do not slow down every operation.
+class Backups:
+    def __init__(self, count, interval):
+        self.count = count
+        self.interval = interval
+        # Dictionary of the form path: time of its last backup.
+        self.last_backup_times = {}
+        self.lock = threading.Lock()
+
+    def rotate(self, path):
+        if self.count <= 0: return
+        now = datetime.now()
+        with self.lock:
+            last_backup_time = self.last_backup_times.get(path)
+            if last_backup_time is not None and \
+                    (now - last_backup_time).total_seconds() < self.interval:
+                return
+            self.last_backup_times[path] = now
+            shutil.copyfile(path, '{0}.backup.{1}'.format(path, now.strftime('%Y%m%d-%H%M%S-%f')))
+            for backup_path in Backups.list(path)[self.count:]:
+                os.unlink(backup_path)
+
+    # Returns the paths of the backups of the file at path, from the newest.
+    # The backup of the older versions, <path>.backup, is the last one.
+    @staticmethod
+    def list(path):
+        backup_paths = sorted(glob.glob(glob.escape(path) + '.backup.*'), reverse=True)
+        if os.path.exists(path + '.backup'):
+            backup_paths.append(path + '.backup')
+        return backup_paths
+
+# The persister writes the tables and the history to their files in a
+# background thread, when the persistence mode is 'deferred' (see
+# ChiefCoordinator), so that the operations do not wait for the disk.
+# An operation marks as dirty the object it modified, and the thread writes
+# the dirty objects at most once every interval seconds: the many operations
+# done on an object in the meantime (e.g. the three of call_team) cost a
+# single write.
+# The objects are identified by a name, and each one is written by a
+# function, passed to mark_dirty, that reads its state holding its lock.
+# flush writes the dirty objects immediately (e.g. for the operations that
+# must be durable), and close writes them before stopping the thread.
+class Persister:
+    def __init__(self, interval):
+        self.interval = interval
+        # Dictionary of the form name: function writing the object, of the
+        # objects modified since they were last written.
+        self.dirty = OrderedDict()
+        self.closed = False
+        self.condition = threading.Condition()
+        # Held while writing, so that the objects are written by a thread at
+        # a time (and thus an older state never overwrites a newer one).
+        self.write_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def mark_dirty(self, name, write):
+        with self.condition:
+            if not self.closed:
+                self.dirty[name] = write
+                self.condition.notify_all()
+                return
+        write()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.dirty or self.closed)
+                # Waiting, so that the next operations are coalesced.
+                self.condition.wait_for(lambda: self.closed, self.interval)
+                if self.closed: return
+            try:
+                self.flush()
+            except Exception:
+                # The objects are still dirty, the write is retried after
+                # interval seconds.
+                traceback.print_exc()
+
+    # Writes all the dirty objects. If a write fails, the objects not written
+    # are marked dirty again and the exception is raised.
+    def flush(self):
+        with self.write_lock:
+            with self.condition:
+                dirty = self.dirty
+                self.dirty = OrderedDict()
+            while dirty:
+                name, write = dirty.popitem(last=False)
+                try:
+                    write()
+                except:
+                    with self.condition:
+                        dirty[name] = write
+                        dirty.update(self.dirty)
+                        self.dirty = dirty
+                    raise
+
+    # Stops the thread and writes the dirty objects. The objects marked dirty
+    # afterwards are written immediately.
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.flush()
@@ -0,0 +1,69 @@
+import csv
+import io
+import json
+
+# A plan of the coordinations of the day, that is the queue of every table.
+# It is a dictionary of the form table_name: [team1, team2, ...], where the
+# teams are in the order in which they are going to coordinate.
+#
+# A plan can be written in a json file, containing exactly such a dictionary,
+# or in a csv file where each row is of the form:
+#   team, table
+# meaning that the team coordinates the problem of the table at that table.
+# The queue of each table follows the order of the rows.
+
+# Reads a plan from a csv or json file (chosen by the extension).
+# Raises a ValueError if the file is malformed.
+def read_plan(path):
+    with open(path, newline='') as plan_file:
+        content = plan_file.read()
+    if path.lower().endswith('.json'):
+        try:
+            return parse_json_plan(json.loads(content))
+        except json.JSONDecodeError:
+            raise ValueError('The file \'{0}\' is malformed.'.format(path))
+    elif path.lower().endswith('.csv'):
+        return parse_csv_plan(content)
+    raise ValueError('The file \'{0}\' is neither a csv nor a json file.'.format(path))
+
+# Returns the plan contained in the dictionary decoded from json.
+def parse_json_plan(data):
+    if not isinstance(data, dict):
+        raise ValueError('The plan must be a dictionary of the form table: queue.')
+    for table_name, queue in data.items():
+        if not isinstance(queue, list) or not all(isinstance(team, str) for team in queue):
+            raise ValueError('The queue of the table {0} must be a list of teams.'.format(table_name))
+    return {table_name: list(queue) for table_name, queue in data.items()}
+
+# Returns the plan contained in the text of a csv file.
+def parse_csv_plan(text):
+    plan = {}
+    for row in csv.reader(io.StringIO(text), delimiter=',', quotechar='"'):
+        if not row: continue
+        if len(row) != 2:
+            raise ValueError('The row \'{0}\' of the plan is not of the form team, table.'.format(','.join(row)))
+        plan.setdefault(row[1].strip(), []).append(row[0].strip())
+    return plan
+
+# Checks that the plan refers only to existing tables and teams, and that
+# every team is exactly once in the queues of the tables of each problem.
+# tables_problems is a dictionary of the form table_name: problem.
+# Raises a ValueError describing the first violation found.
+def validate_plan(plan, teams, tables_problems):
+    teams_set = set(teams)
+    problems = {}
+    for table_name, problem in tables_problems.items():
+        problems.setdefault(problem, {team: 0 for team in teams})
+    for table_name, queue in plan.items():
+        if table_name not in tables_problems:
+            raise ValueError('Table {0} does not exist.'.format(table_name))
+        counts = problems[tables_problems[table_name]]
+        for team in queue:
+            if team not in teams_set:
+                raise ValueError('Team {0} does not exist.'.format(team))
+            counts[team] += 1
+    for problem in sorted(problems):
+        for team in teams:
+            if problems[problem][team] != 1:
+                raise ValueError('Team {0} appears {1} times in the queues of problem {2}.'.format(
+                    team, problems[problem][team], problem))
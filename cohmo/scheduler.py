@@ -0,0 +1,211 @@
+import heapq
+import random
+import time
+
+# Engine computing queues that make the coordinations end as soon as possible.
+#
+# Every table is described by a dictionary with the keys:
+# name, problem.
+# duration: the expected duration of a coordination at the table.
+# queue: the list of the teams that have to coordinate at the table.
+# available_time: when the table can start the next coordination.
+# pinned: whether the first team of the queue must stay first (e.g. because
+#         it is being called).
+# team_available_times is a dictionary of the form team: timestamp, giving
+# when the teams that are coordinating right now will be available.
+#
+# Given the queues, the schedule is obtained letting every table start its
+# next coordination as soon as both the table and the team are available
+# (and no break is in the way). The quality of the queues is the pair
+# (makespan, conflicts), compared lexicographically, where the makespan is
+# the end of the last coordination and the conflicts are the coordinations
+# for which a table had to wait for a team busy at another table.
+#
+# The queues are first built greedily (each table, when free, takes the team
+# available earliest, preferring the teams with more remaining work), then
+# improved by a local search (moving and swapping teams in the queues) until
+# the time budget is over.
+# If allow_table_changes is True, a team can be moved to another table of the
+# same problem.
+class Scheduler:
+    def __init__(self, tables, break_times, start_time, team_available_times={},
+                 allow_table_changes=True, seed=0):
+        self.tables = {table['name']: table for table in tables}
+        self.break_times = sorted(break_times)
+        self.start_time = start_time
+        self.team_available_times = team_available_times
+        self.allow_table_changes = allow_table_changes
+        self.rng = random.Random(seed)
+        # Dictionary of the form problem: [names of its tables].
+        self.problem_tables = {}
+        for table in tables:
+            self.problem_tables.setdefault(table['problem'], []).append(table['name'])
+
+    # Returns the time at which a coordination of the given duration, that
+    # could start at start, starts without overlapping the breaks.
+    def postpone_for_breaks(self, start, duration):
+        for bt in self.break_times:
+            if start < bt[1] and start + duration > bt[0]:
+                start = bt[1]
+        return start
+
+    def get_initial_queues(self):
+        return {name: list(table['queue']) for name, table in self.tables.items()}
+
+    # Returns the triple (makespan, conflicts, end times) of the schedule
+    # given by the queues, where end times is a dictionary of the form
+    # table_name: end of its last coordination.
+    # If events is a list, the coordinations are appended to it as pairs
+    # (table_name, team), in order of start time.
+    def evaluate(self, queues, events=None):
+        table_ready = {name: max(table['available_time'], self.start_time)
+                       for name, table in self.tables.items()}
+        team_ready = dict(self.team_available_times)
+        positions = {name: 0 for name in queues}
+        conflicts = 0
+        heap = [(table_ready[name], name) for name in queues if queues[name]]
+        heapq.heapify(heap)
+        # Since the availability of the teams only increases, the start time
+        # in the heap is a lower bound of the actual one: if it is not exact
+        # the table is pushed back with the actual start time.
+        while heap:
+            start, name = heapq.heappop(heap)
+            team = queues[name][positions[name]]
+            duration = self.tables[name]['duration']
+            team_time = team_ready.get(team, self.start_time)
+            actual_start = self.postpone_for_breaks(max(table_ready[name], team_time),
+                                                    duration)
+            if actual_start > start:
+                heapq.heappush(heap, (actual_start, name))
+                continue
+            if team_time > table_ready[name]: conflicts += 1
+            if events is not None: events.append((name, team))
+            table_ready[name] = team_ready[team] = actual_start + duration
+            positions[name] += 1
+            if positions[name] < len(queues[name]):
+                heapq.heappush(heap, (table_ready[name], name))
+        return max(table_ready.values()), conflicts, table_ready
+
+    # Returns the queues built greedily: every time a table is free it takes,
+    # among the teams it can coordinate, the one that can start earliest
+    # (preferring the teams with more remaining work).
+    def get_greedy_queues(self):
+        pools = {}
+        remaining_work = {}
+        queues = {name: [] for name in self.tables}
+        table_ready = {name: max(table['available_time'], self.start_time)
+                       for name, table in self.tables.items()}
+        team_ready = dict(self.team_available_times)
+        for name, table in self.tables.items():
+            teams = table['queue']
+            if table['pinned'] and teams:
+                team = teams[0]
+                teams = teams[1:]
+                start = self.postpone_for_breaks(
+                    max(table_ready[name], team_ready.get(team, self.start_time)),
+                    table['duration'])
+                table_ready[name] = team_ready[team] = start + table['duration']
+                queues[name].append(team)
+            pools.setdefault(self.get_pool_key(name), set()).update(teams)
+            for team in teams:
+                remaining_work[team] = remaining_work.get(team, 0) + table['duration']
+        heap = [(table_ready[name], name) for name in self.tables]
+        heapq.heapify(heap)
+        while heap:
+            ready, name = heapq.heappop(heap)
+            pool = pools[self.get_pool_key(name)]
+            if not pool: continue
+            duration = self.tables[name]['duration']
+            def start_time(team):
+                return self.postpone_for_breaks(
+                    max(ready, team_ready.get(team, self.start_time)), duration)
+            team = min(pool, key=lambda team: (start_time(team), -remaining_work[team], team))
+            pool.remove(team)
+            table_ready[name] = team_ready[team] = start_time(team) + duration
+            remaining_work[team] -= duration
+            queues[name].append(team)
+            heapq.heappush(heap, (table_ready[name], name))
+        return queues
+
+    # The teams of the tables with the same pool key can be exchanged.
+    def get_pool_key(self, table_name):
+        if self.allow_table_changes: return self.tables[table_name]['problem']
+        return table_name
+
+    # Returns the first position of the queue that can be changed.
+    def get_first_free_position(self, table_name):
+        return 1 if self.tables[table_name]['pinned'] else 0
+
+    # Returns a copy of the queues modified by a random move, or None if the
+    # chosen move is not possible. Half of the times the move involves the
+    # table finishing last.
+    def get_neighbour(self, queues, end_times):
+        if self.rng.random() < 0.5:
+            name = max(end_times, key=lambda name: end_times[name])
+        else:
+            name = self.rng.choice(list(queues))
+        first = self.get_first_free_position(name)
+        queue = queues[name]
+        move = self.rng.random()
+        if move < 0.3 and self.allow_table_changes:
+            # Moving a team to another table of the same problem.
+            others = [other for other in self.problem_tables[self.tables[name]['problem']]
+                      if other != name]
+            if not others or len(queue) <= first: return None
+            other = self.rng.choice(others)
+            team = queue[self.rng.randrange(first, len(queue))]
+            neighbour = dict(queues)
+            neighbour[name] = [t for t in queue if t != team]
+            other_queue = list(queues[other])
+            other_queue.insert(self.rng.randint(self.get_first_free_position(other),
+                                                len(other_queue)), team)
+            neighbour[other] = other_queue
+            return neighbour
+        if len(queue) - first < 2: return None
+        i, j = self.rng.sample(range(first, len(queue)), 2)
+        queue = list(queue)
+        if move < 0.65:
+            queue[i], queue[j] = queue[j], queue[i]
+        else:
+            queue.insert(j, queue.pop(i))
+        neighbour = dict(queues)
+        neighbour[name] = queue
+        return neighbour
+
+    # Improves the queues with a local search, accepting the moves that do not
+    # make the schedule worse, until time_budget seconds have passed or
+    # max_iterations moves have been tried. Returns the best queues found.
+    def improve(self, queues, time_budget, max_iterations=None):
+        deadline = time.perf_counter() + time_budget
+        makespan, conflicts, end_times = self.evaluate(queues)
+        iterations = 0
+        while time.perf_counter() < deadline:
+            if max_iterations is not None and iterations >= max_iterations: break
+            iterations += 1
+            neighbour = self.get_neighbour(queues, end_times)
+            if neighbour is None: continue
+            neighbour_makespan, neighbour_conflicts, neighbour_end_times = \
+                self.evaluate(neighbour)
+            if (neighbour_makespan, neighbour_conflicts) <= (makespan, conflicts):
+                queues, makespan, conflicts, end_times = \
+                    neighbour, neighbour_makespan, neighbour_conflicts, neighbour_end_times
+        return queues
+
+    # Returns the proposed queues, as a dictionary with keys:
+    # queues: dictionary of the form table_name: queue.
+    # makespan, conflicts: the evaluation of the proposed queues.
+    # initial_makespan, initial_conflicts: the evaluation of the given queues.
+    # The proposed queues are never worse than the given ones.
+    def schedule(self, time_budget, max_iterations=None):
+        initial_queues = self.get_initial_queues()
+        initial_makespan, initial_conflicts, _ = self.evaluate(initial_queues)
+        greedy_queues = self.get_greedy_queues()
+        queues = min([initial_queues, greedy_queues],
+                     key=lambda queues: self.evaluate(queues)[:2])
+        queues = self.improve(queues, time_budget, max_iterations)
+        makespan, conflicts, _ = self.evaluate(queues)
+        return {'queues': queues,
+                'makespan': makespan,
+                'conflicts': conflicts,
+                'initial_makespan': initial_makespan,
+                'initial_conflicts': initial_conflicts}
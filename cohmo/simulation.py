@@ -0,0 +1,98 @@
+from cohmo.scheduler import Scheduler
+
+# numpy is needed only by the simulation, which is not available without it.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PERCENTILES = [10, 50, 90]
+
+# Monte Carlo simulation of the rest of the coordination day.
+#
+# tables and team_available_times describe the current state as for the
+# scheduler (see ChiefCoordinator.get_scheduling_tables and
+# cohmo/scheduler.py). duration_samples is a dictionary of the form
+# table_name: [durations], whose elements are equally likely durations of a
+# coordination at the table (e.g. the past ones).
+# Each of the runs draws the durations of all the coordinations independently
+# from duration_samples and lets the tables process their queues, never
+# starting a coordination during a break or while the team is at another
+# table. The coordinations are processed in the order they start when every
+# coordination lasts the expected duration, so that all the runs are
+# simulated together, one coordination at a time, with numpy arrays indexed by
+# the run.
+# The current coordinations last a drawn duration too, but at least until now.
+#
+# Returns a dictionary with keys:
+# runs: the number of runs.
+# finish_time: the percentiles (see PERCENTILES) of the end of the day.
+# tables: dictionary of the form table_name: {'finish_time': percentiles}.
+# teams: dictionary of the form team: [coordinations], where each coordination
+#        is a dictionary {'table': table_name, 'start_time': percentiles,
+#        'end_time': percentiles}, in order of start time.
+# The percentiles are dictionaries of the form {'p10': timestamp, ...}.
+# Raises an ImportError if numpy is not installed.
+def simulate_day(tables, team_available_times, duration_samples, break_times,
+                 start_time, runs, seed=None):
+    if numpy is None:
+        raise ImportError('The simulation of the day requires numpy.')
+    rng = numpy.random.default_rng(seed)
+    events = []
+    Scheduler(tables, break_times, start_time, team_available_times,
+              allow_table_changes=False).evaluate(
+                  {table['name']: table['queue'] for table in tables}, events)
+
+    samples = {name: numpy.asarray(duration_samples[name], dtype=float)
+               for name in duration_samples}
+    table_ready = {}
+    team_ready = {}
+    for table in tables:
+        name = table['name']
+        table_ready[name] = numpy.full(runs, float(max(table['available_time'], start_time)))
+        if table['current_team'] is not None:
+            end = table['current_start_time'] + rng.choice(samples[name], runs)
+            table_ready[name] = numpy.maximum(end, start_time)
+            team_ready[table['current_team']] = table_ready[name]
+    # Drawing at once the durations of all the coordinations of each table.
+    durations = {}
+    events_num = {}
+    for name, _ in events:
+        events_num[name] = events_num.get(name, 0) + 1
+    for name, num in events_num.items():
+        durations[name] = iter(rng.choice(samples[name], (num, runs)))
+    break_times = sorted(break_times)
+
+    starts = numpy.empty((len(events), runs))
+    ends = numpy.empty((len(events), runs))
+    for i, (name, team) in enumerate(events):
+        duration = next(durations[name])
+        start = table_ready[name]
+        if team in team_ready: start = numpy.maximum(start, team_ready[team])
+        for bt in break_times:
+            start = numpy.where((start < bt[1]) & (start + duration > bt[0]), bt[1], start)
+        starts[i] = start
+        ends[i] = table_ready[name] = team_ready[team] = start + duration
+
+    def percentiles(values, axis=None):
+        return numpy.percentile(values, PERCENTILES, axis=axis)
+    def to_dict(values):
+        return {'p{0}'.format(p): int(round(value)) for p, value in zip(PERCENTILES, values)}
+
+    table_names = [table['name'] for table in tables]
+    table_finish = percentiles(numpy.stack([table_ready[name] for name in table_names]), 1)
+    finish = percentiles(numpy.max([table_ready[name] for name in table_names], axis=0))
+    result = {'runs': runs,
+              'finish_time': to_dict(finish),
+              'tables': {name: {'finish_time': to_dict(table_finish[:, j])}
+                         for j, name in enumerate(table_names)},
+              'teams': {}}
+    if events:
+        start_percentiles = percentiles(starts, 1)
+        end_percentiles = percentiles(ends, 1)
+        for i, (name, team) in enumerate(events):
+            result['teams'].setdefault(team, []).append(
+                {'table': name,
+                 'start_time': to_dict(start_percentiles[:, i]),
+                 'end_time': to_dict(end_percentiles[:, i])})
+    return result
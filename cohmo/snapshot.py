@@ -0,0 +1,75 @@
+import gzip
+import json
+import time
+from cohmo.persister import replace_file
+
+# An immutable, already serialized snapshot of the state of all the tables,
+# corresponding to a given value of operations_num.
+# The snapshot is serialized only once, and the different encodings needed by
+# the views are computed lazily and then cached, so that many clients asking
+# for the same state cost a single serialization.
+# last_modified is the time (a timestamp in seconds) of the last operation
+# included in the snapshot. Since it has the resolution of a second, whereas
+# many operations can happen in a second, it is sent as Last-Modified only
+# once that second has passed (see has_final_last_modified), otherwise a
+# client revalidating with If-Modified-Since could keep an old state.
+class TablesSnapshot:
+    def __init__(self, operations_num, tables_data, last_modified):
+        self.operations_num = operations_num
+        self.tables_data = tables_data
+        self.tables_json = json.dumps(tables_data)
+        # Strong etag, different for each state of the tables.
+        self.etag = str(operations_num)
+        self.last_modified = last_modified
+        self.response_body = None
+        self.gzipped_response_body = None
+        # Dictionary of the form frozenset of table names: response body.
+        self.partial_response_bodies = {}
+
+    # Returns whether no other operation can happen in the second of
+    # last_modified, that is whether it can be sent as Last-Modified.
+    def has_final_last_modified(self):
+        return int(time.time()) > self.last_modified
+
+    # Returns the body of the response of /tables/get_all, with the tables
+    # encoded as a json string inside the json response (as the clients
+    # expect).
+    def get_response_body(self):
+        if self.response_body is None:
+            self.response_body = json.dumps({
+                'ok': True,
+                'changed': True,
+                'last_update': self.operations_num,
+                'tables': self.tables_json}).encode()
+        return self.response_body
+
+    # Returns the body of the response of /tables/get_all containing only the
+    # tables whose name is in table_names.
+    def get_partial_response_body(self, table_names):
+        table_names = frozenset(table_names)
+        if table_names not in self.partial_response_bodies:
+            self.partial_response_bodies[table_names] = json.dumps({
+                'ok': True,
+                'changed': True,
+                'partial': True,
+                'last_update': self.operations_num,
+                'tables': json.dumps([table for table in self.tables_data
+                                      if table['name'] in table_names])}).encode()
+        return self.partial_response_bodies[table_names]
+
+    def get_gzipped_response_body(self):
+        if self.gzipped_response_body is None:
+            self.gzipped_response_body = gzip.compress(self.get_response_body())
+        return self.gzipped_response_body
+
+    # Returns the data of the event sent by /tables/stream.
+    def get_event_data(self):
+        return '{{"last_update": {0}, "tables": {1}}}'.format(
+            self.operations_num, self.tables_json)
+
+    # Writes the body of the response of /tables/get_all to the file at path,
+    # so that a web server can serve it as a static file. The file is
+    # replaced atomically (see replace_file), so that it is never read half
+    # written.
+    def write_to_file(self, path):
+        replace_file(path, self.get_response_body())
@@ -0,0 +1,184 @@
+import csv
+import io
+import json
+import sqlite3
+from cohmo.persister import replace_file
+
+# Storage of the tables and of the history in a SQLite database, alternative to
+# the json files of the tables and the csv file of the history.
+# The database is in WAL mode, so that many processes can read it while one
+# of them is writing.
+# Every table is a row of coordination_tables, and its fields are the ones of
+# the json file of the table (coordinators and queue are json encoded).
+# Every correction is a row of corrections, the position keeps the order in
+# which the corrections were added to the history.
+#
+# The connection is in autocommit mode: each statement is a transaction on
+# its own, unless it is executed between begin and commit.
+# The connection can be used by many threads, but not concurrently: the users
+# of the storage must serialize the accesses (see SQLiteStateBackend).
+class SQLiteStorage:
+    SCHEMA = '''
+CREATE TABLE IF NOT EXISTS coordination_tables (
+    name TEXT PRIMARY KEY,
+    problem TEXT NOT NULL,
+    coordinators TEXT NOT NULL,
+    queue TEXT NOT NULL,
+    status TEXT NOT NULL,
+    current_coordination_team TEXT,
+    current_coordination_start_time INTEGER
+);
+CREATE TABLE IF NOT EXISTS corrections (
+    position INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    team TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    start_time INTEGER NOT NULL,
+    end_time INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS corrections_table ON corrections (table_name);
+CREATE INDEX IF NOT EXISTS corrections_team ON corrections (team);
+CREATE INDEX IF NOT EXISTS corrections_start_time ON corrections (start_time);
+CREATE INDEX IF NOT EXISTS corrections_end_time ON corrections (end_time);
+CREATE TABLE IF NOT EXISTS metadata (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+'''
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=30,
+                                          isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SQLiteStorage.SCHEMA)
+
+    # Starts a transaction. If immediate is True, the database is locked for
+    # writing until commit, otherwise the transaction only sees a consistent
+    # snapshot of the database.
+    def begin(self, immediate=True):
+        self.connection.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+
+    def commit(self):
+        if self.connection.in_transaction:
+            self.connection.execute('COMMIT')
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+    # Returns the dictionary describing the table, in the same format as the
+    # json file of the table. Raises a KeyError if the table does not exist.
+    def load_table(self, name):
+        row = self.connection.execute(
+            'SELECT name, problem, coordinators, queue, status, '
+            'current_coordination_team, current_coordination_start_time '
+            'FROM coordination_tables WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            raise KeyError('The table {0} is not in the database \'{1}\'.'.format(name, self.path))
+        return {'name': row[0],
+                'problem': row[1],
+                'coordinators': json.loads(row[2]),
+                'queue': json.loads(row[3]),
+                'status': row[4],
+                'current_coordination_team': row[5],
+                'current_coordination_start_time': row[6]}
+
+    # Saves a table given as a dictionary, in the same format as the json file
+    # of the table.
+    def save_table(self, table_as_dict):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO coordination_tables VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (table_as_dict['name'], table_as_dict['problem'],
+             json.dumps(table_as_dict['coordinators']),
+             json.dumps(table_as_dict['queue']), table_as_dict['status'],
+             table_as_dict.get('current_coordination_team'),
+             table_as_dict.get('current_coordination_start_time')))
+
+    # Returns the list of all the corrections, as tuples
+    # (team, table, start_time, end_time, id) in the order they were added.
+    def load_corrections(self):
+        return self.connection.execute(
+            'SELECT team, table_name, start_time, end_time, id '
+            'FROM corrections ORDER BY position').fetchall()
+
+    def add_correction(self, correction):
+        self.connection.execute(
+            'INSERT INTO corrections (id, team, table_name, start_time, end_time) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (SQLiteStorage.correction_id(correction.id), correction.team,
+             correction.table, correction.start_time, correction.end_time))
+
+    def delete_correction(self, correction_id):
+        self.connection.execute('DELETE FROM corrections WHERE id = ?',
+                                (SQLiteStorage.correction_id(correction_id),))
+
+    # The ids generated by Correction are bytes, whereas the ones read from the
+    # database are strings.
+    @staticmethod
+    def correction_id(identifier):
+        if isinstance(identifier, bytes): return identifier.decode()
+        return identifier
+
+    # Returns the integer value stored with the given key, or None.
+    def get_metadata(self, key):
+        row = self.connection.execute(
+            'SELECT value FROM metadata WHERE key = ?', (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def set_metadata(self, key, value):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO metadata VALUES (?, ?)', (key, value))
+
+    # Imports the tables and the history from the json files of the tables
+    # (table_paths is a dictionary of the form table_name: table_path) and
+    # the csv file of the history, replacing the content of the database.
+    def import_from_files(self, table_paths, history_path):
+        self.begin()
+        try:
+            self.connection.execute('DELETE FROM coordination_tables')
+            self.connection.execute('DELETE FROM corrections')
+            for name in table_paths:
+                with open(table_paths[name], newline='') as table_file:
+                    table_as_dict = json.load(table_file)
+                if table_as_dict['name'] != name:
+                    raise ValueError('The file \'{0}\' does not contain the table {1}.'.format(table_paths[name], name))
+                self.save_table(table_as_dict)
+            with open(history_path, newline='') as history_file:
+                history_reader = csv.reader(history_file, delimiter=',',
+                                            quotechar='"')
+                for row in history_reader:
+                    if not row: continue
+                    if len(row) != 5:
+                        raise ValueError('The file \'{0}\' is malformed.'.format(history_path))
+                    self.connection.execute(
+                        'INSERT INTO corrections (id, team, table_name, start_time, end_time) '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        (row[4].strip(), row[0].strip(), row[1].strip(),
+                         int(row[2]), int(row[3])))
+        except:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.commit()
+
+    # Exports the tables and the history to files in the same formats used by
+    # Table and HistoryManager. Every file is replaced atomically (see
+    # replace_file), hence an interrupted export leaves no truncated file.
+    def export_to_files(self, table_paths, history_path):
+        self.begin(immediate=False)
+        try:
+            tables_data = {name: json.dumps(self.load_table(name), indent=4)
+                           for name in table_paths}
+            history_file = io.StringIO(newline='')
+            history_writer = csv.writer(history_file, delimiter=',',
+                                        quotechar='"',
+                                        quoting=csv.QUOTE_MINIMAL)
+            for row in self.load_corrections():
+                history_writer.writerow(row)
+        finally:
+            self.commit()
+        for name in table_paths:
+            replace_file(table_paths[name], tables_data[name])
+        replace_file(history_path, history_file.getvalue())
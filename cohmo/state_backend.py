@@ -0,0 +1,162 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+
+# The state backends let many processes (e.g. the workers of gunicorn) share
+# the state of the chief coordinator.
+# The authoritative state is the one stored in the files (tables, history and
+# journal), and the backend provides:
+# - a lock, held while an operation modifies the state and its files;
+# - a shared version of the state, equal to the operations_num of the last
+#   process that modified it. A process whose operations_num differs from the
+#   shared version has to reload the state from the files;
+# - the time of the last modification of the state (see
+#   HistoryManager.last_operation_time_ns), so that all the processes report
+#   the same Last-Modified for the same state.
+# get_version and get_modified_time return None if the state is not shared.
+
+# Starts (and returns) a thread that, every interval seconds until the event
+# closed is set, calls callback if the value returned by get_version changed.
+# The initial version is read before starting the thread, so that no change
+# happening meanwhile is missed.
+def start_version_watcher(get_version, callback, interval, closed):
+    last_version = get_version()
+    def watch_version():
+        nonlocal last_version
+        while not closed.wait(interval):
+            version = get_version()
+            if version != last_version:
+                last_version = version
+                callback()
+    watcher = threading.Thread(target=watch_version, daemon=True)
+    watcher.start()
+    return watcher
+
+# The state is owned by a single process, hence nothing has to be shared.
+class LocalStateBackend:
+    def get_version(self):
+        return None
+
+    def get_modified_time(self):
+        return None
+
+    def set_version(self, version, modified_time):
+        pass
+
+    def acquire(self, exclusive=True):
+        pass
+
+    def release(self):
+        pass
+
+    def watch(self, callback, interval):
+        pass
+
+    def close(self):
+        pass
+
+# The lock is a flock on the file path and the version (a 64 bit integer)
+# and the modification time (in nanoseconds) are stored in the same file, mapped in
+# memory so that reading them costs no system call.
+# Since flock does not exclude the threads of the same process, they are
+# excluded by a threading lock.
+class FileStateBackend:
+    VERSION_FORMAT = 'qq'
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = struct.calcsize(FileStateBackend.VERSION_FORMAT)
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.shared_memory = mmap.mmap(self.fd, size)
+        self.thread_lock = threading.Lock()
+        self.watcher = None
+        self.closed = threading.Event()
+
+    def get_version(self):
+        return struct.unpack_from(FileStateBackend.VERSION_FORMAT,
+                                  self.shared_memory, 0)[0]
+
+    def get_modified_time(self):
+        return struct.unpack_from(FileStateBackend.VERSION_FORMAT,
+                                  self.shared_memory, 0)[1]
+
+    # The version must be set only while holding the exclusive lock.
+    def set_version(self, version, modified_time):
+        struct.pack_into(FileStateBackend.VERSION_FORMAT, self.shared_memory,
+                         0, version, modified_time)
+
+    def acquire(self, exclusive=True):
+        self.thread_lock.acquire()
+        fcntl.flock(self.fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+    def release(self):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.thread_lock.release()
+
+    # Starts a thread calling callback every interval seconds, if the shared
+    # version changed since the previous call. This is how a process gets
+    # notified of the operations done by the other processes.
+    def watch(self, callback, interval):
+        self.watcher = start_version_watcher(self.get_version, callback,
+                                             interval, self.closed)
+
+    def close(self):
+        if self.closed.is_set(): return
+        self.closed.set()
+        if self.watcher is not None: self.watcher.join()
+        self.shared_memory.close()
+        os.close(self.fd)
+
+# The state is stored in a SQLite database (see cohmo/sqlite_storage.py), which
+# is also the shared state: the version is stored in the database and the
+# lock is a transaction, hence the modifications done while holding the lock
+# are committed atomically on release.
+# The threads of the same process share the connection, thus they are
+# serialized by a reentrant threading lock.
+class SQLiteStateBackend:
+    def __init__(self, storage):
+        self.storage = storage
+        self.thread_lock = threading.RLock()
+        self.watcher = None
+        self.closed = threading.Event()
+
+    def get_version(self):
+        with self.thread_lock:
+            return self.storage.get_metadata('version') or 0
+
+    def get_modified_time(self):
+        with self.thread_lock:
+            return self.storage.get_metadata('modified_time') or 0
+
+    def set_version(self, version, modified_time):
+        with self.thread_lock:
+            self.storage.set_metadata('version', version)
+            self.storage.set_metadata('modified_time', modified_time)
+
+    def acquire(self, exclusive=True):
+        self.thread_lock.acquire()
+        try:
+            self.storage.begin(immediate=exclusive)
+        except:
+            self.thread_lock.release()
+            raise
+
+    def release(self):
+        try:
+            self.storage.commit()
+        finally:
+            self.thread_lock.release()
+
+    def watch(self, callback, interval):
+        self.watcher = start_version_watcher(self.get_version, callback,
+                                             interval, self.closed)
+
+    def close(self):
+        if self.closed.is_set(): return
+        self.closed.set()
+        if self.watcher is not None: self.watcher.join()
+        self.storage.close()
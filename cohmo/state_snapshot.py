@@ -0,0 +1,102 @@
+import hashlib
+import io
+import marshal
+import os
+from cohmo.history import HistoryManager
+from cohmo.persister import replace_file
+
+# The state snapshot is a single binary file containing the whole state of the
+# chief (the tables and the corrections), so that at startup it is loaded with
+# a single read instead of parsing the json file of each table and the csv
+# file of the history (see STATE_SNAPSHOT_FILE_PATH).
+# These files remain the ones to edit by hand and to exchange the data: the
+# snapshot contains the size, the modification time and the sha256 digest of
+# each of them, and it is used only if they did not change since it was
+# written. A file is read and hashed only if its size or its modification
+# time changed (or if it was modified too close to the snapshot to tell, see
+# has_same_metadata). Only the history file can have grown in the meantime,
+# since the corrections are appended to it: then only the appended rows are
+# parsed.
+#
+# The file is MAGIC followed by the marshal dump of a dictionary with keys:
+#   tables: a dictionary of the form table_name: dictionary in the format of
+#           the json file of the table,
+#   corrections: the five lists of teams, tables, start times, end times and
+#                ids of the corrections,
+#   files: a dictionary of the form path: [size, mtime_ns, digest].
+# Since the marshal format may change between versions of Python, MAGIC
+# contains the version of the format.
+MAGIC = 'COHMO-STATE-SNAPSHOT-2-{0}\n'.format(marshal.version).encode()
+
+def write_state_snapshot(path, tables_data, corrections, file_paths):
+    files = {}
+    for file_path in file_paths:
+        with open(file_path, 'rb') as source_file:
+            mtime_ns = os.fstat(source_file.fileno()).st_mtime_ns
+            content = source_file.read()
+        files[file_path] = [len(content), mtime_ns, hashlib.sha256(content).digest()]
+    replace_file(path, MAGIC + marshal.dumps({
+        'tables': tables_data,
+        'corrections': [[correction.team for correction in corrections],
+                        [correction.table for correction in corrections],
+                        [correction.start_time for correction in corrections],
+                        [correction.end_time for correction in corrections],
+                        [file_correction_id(correction.id) for correction in corrections]],
+        'files': files}))
+
+# The ids generated by Correction are bytes, which the csv writer writes (and
+# thus the history reads back) as their representation.
+def file_correction_id(identifier):
+    if isinstance(identifier, bytes): return str(identifier)
+    return identifier
+
+# Returns whether the file with the given stat has the size and the
+# modification time recorded in the snapshot. As git does for its index, a
+# file modified not strictly before the snapshot (whose modification time is
+# snapshot_mtime_ns) could have been modified again in the same tick of the
+# clock of the file system, hence it is not trusted.
+def has_same_metadata(stat, size, mtime_ns, snapshot_mtime_ns):
+    return stat.st_size == size and stat.st_mtime_ns == mtime_ns and \
+        mtime_ns < snapshot_mtime_ns
+
+# Returns the state contained in the state snapshot at path, as a dictionary
+# with keys tables and corrections (a list of tuples as the ones
+# returned by HistoryManager.read_rows), or None if the snapshot is missing or
+# malformed, or if the given files changed since it was written.
+def read_state_snapshot(path, table_paths, history_path):
+    try:
+        with open(path, 'rb') as snapshot_file:
+            snapshot_mtime_ns = os.fstat(snapshot_file.fileno()).st_mtime_ns
+            data = snapshot_file.read()
+        if not data.startswith(MAGIC): return None
+        state = marshal.loads(memoryview(data)[len(MAGIC):])
+        files = state['files']
+        if set(state['tables']) != set(table_paths) or \
+                set(files) != {history_path} | set(table_paths.values()):
+            return None
+        for file_path in table_paths.values():
+            size, mtime_ns, digest = files[file_path]
+            if has_same_metadata(os.stat(file_path), size, mtime_ns, snapshot_mtime_ns):
+                continue
+            with open(file_path, 'rb') as source_file:
+                content = source_file.read()
+            if len(content) != size or hashlib.sha256(content).digest() != digest:
+                return None
+        size, mtime_ns, digest = files[history_path]
+        with open(history_path, 'rb') as history_file:
+            stat = os.fstat(history_file.fileno())
+            if stat.st_size < size: return None
+            if not has_same_metadata(stat, size, mtime_ns, snapshot_mtime_ns):
+                prefix = history_file.read(size)
+                if len(prefix) != size or hashlib.sha256(prefix).digest() != digest:
+                    return None
+            history_file.seek(size)
+            appended = history_file.read()
+        corrections = list(zip(*state['corrections']))
+        if appended:
+            appended = io.StringIO(appended.decode(), newline='')
+            corrections += HistoryManager.read_rows(appended, history_path)
+        return {'tables': state['tables'],
+                'corrections': corrections}
+    except (OSError, EOFError, ValueError, TypeError, KeyError):
+        return None
@@ -1,2 +1,10 @@
 // The root of application to be used in ajax calls.
 const APPLICATION_ROOT = '/';
+// The token given to the page (e.g. /?token=...), if any. It is passed on to
+// the ajax calls, since the screens using it have no password.
+const TOKEN = new URLSearchParams(window.location.search).get('token');
+// Returns the parameters of an ajax call, adding the token if there is one.
+function with_token(params) {
+    if (TOKEN) params.token = TOKEN;
+    return params;
+}
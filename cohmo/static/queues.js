@@ -10,16 +10,47 @@ let queues_model = {
     country: country,
     problem: problem,
     last_update: -1,
+    apply(last_update, tables) {
+        this.last_update = last_update;
+        Object.assign(this.tables, tables);
+    },
+    // Replaces in place the tables that changed, leaving the others untouched.
+    apply_changes(last_update, changed_tables) {
+        this.last_update = last_update;
+        for (let changed_table of changed_tables) {
+            for (let name in this.tables) {
+                if (this.tables[name].name == changed_table.name) {
+                    Vue.set(this.tables, name, changed_table);
+                }
+            }
+        }
+    },
+    // Polls the public snapshot (see PUBLIC_SNAPSHOT_URL in config.py), that
+    // is served with caching headers and contains always all the tables.
+    update_from_public_snapshot() {
+        return axios.get(PUBLIC_SNAPSHOT_URL)
+            .then(response => {
+                if (response.data.last_update == this.last_update) return;
+                this.apply(response.data.last_update, JSON.parse(response.data.tables));
+            })
+            .catch(error => {
+                console.log(error);
+            });
+    },
     update() {
-        return axios.get(APPLICATION_ROOT + 'tables/get_all', {params: {last_update: this.last_update}})
+        if (PUBLIC_SNAPSHOT_URL) return this.update_from_public_snapshot();
+        return axios.get(APPLICATION_ROOT + 'tables/get_all', {params: with_token({since: this.last_update})})
             .then(response => {
                 if (!response.data.ok) {
                     console.log('TODO');
                     return;
                 }
                 if (!response.data.changed) return;
-                this.last_update = response.data.last_update;
-                Object.assign(this.tables, JSON.parse(response.data.tables));
+                if (response.data.partial) {
+                    this.apply_changes(response.data.last_update, JSON.parse(response.data.tables));
+                    return;
+                }
+                this.apply(response.data.last_update, JSON.parse(response.data.tables));
             })
             .catch(error => {
                 console.log(error);
@@ -27,19 +58,33 @@ let queues_model = {
     }
 };
 
+function refresh_queues() {
+    let now = Math.max(START_TIME, new Date().getTime() / 1000);
+    now += Math.floor(Math.random() * 10);
+    queues_component.now = now;
+    schedule_times_component.now = now;
+    queues_component.$forceUpdate();
+    schedule_times_component.$forceUpdate();
+}
+
 function update_queues() {
-    queues_model.update().then(() => {
-        let now = Math.max(START_TIME, new Date().getTime() / 1000);
-        now += Math.floor(Math.random() * 10);
-        queues_component.now = now;
-        schedule_times_component.now = now;
-        queues_component.$forceUpdate();
-        schedule_times_component.$forceUpdate();
-    });
+    queues_model.update().then(refresh_queues);
 }
 
+// With the public snapshot the stream is not used, so that the screens do not
+// reach the application.
+const tables_stream = PUBLIC_SNAPSHOT_URL ? {connected: false} :
+    subscribe_to_tables((last_update, tables) => {
+        queues_model.apply(last_update, tables);
+        refresh_queues();
+    });
 update_queues();
-setInterval(update_queues, UPDATE_INTERVAL * 1000);
+// The tables are polled only when the stream is not available, but the
+// queues are refreshed anyway since the estimated times depend on the time.
+setInterval(() => {
+    if (tables_stream.connected) refresh_queues();
+    else update_queues();
+}, UPDATE_INTERVAL * 1000);
 
 const SCHEDULE_TIMES_INTERVAL = 20*60;
 const TIMEZONE_OFFSET = 2;
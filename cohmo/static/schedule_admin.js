@@ -6,23 +6,47 @@ const TableStatusName = ['Calling', 'Coordination', 'Busy', 'Vacant'];
 let schedule_model = {
     tables: {},
     last_update: -1,
+    apply(last_update, tables) {
+        this.last_update = last_update;
+        Object.assign(this.tables, tables);
+        content_comp.$forceUpdate();
+    },
+    // Replaces in place the tables that changed, leaving the others untouched.
+    apply_changes(last_update, changed_tables) {
+        this.last_update = last_update;
+        for (let changed_table of changed_tables) {
+            for (let name in this.tables) {
+                if (this.tables[name].name == changed_table.name) {
+                    Vue.set(this.tables, name, changed_table);
+                }
+            }
+        }
+        content_comp.$forceUpdate();
+    },
     update() {
-        axios.get(APPLICATION_ROOT + 'tables/get_all', {params: {last_update: this.last_update}})
+        axios.get(APPLICATION_ROOT + 'tables/get_all', {params: {since: this.last_update}})
             .then(response => {
                 if (!response.data.ok) {
                     console.log('TODO');
                     return;
                 }
                 if (!response.data.changed) return;
-                this.last_update = response.data.last_update;
-                Object.assign(this.tables, JSON.parse(response.data.tables));
-                content_comp.$forceUpdate();
+                if (response.data.partial) {
+                    this.apply_changes(response.data.last_update, JSON.parse(response.data.tables));
+                    return;
+                }
+                this.apply(response.data.last_update, JSON.parse(response.data.tables));
             })
             .catch(error => {
                 console.log(error);
             });
     }
 };
+// When the stream is available the tables are pushed by the server, otherwise
+// they are fetched after every operation.
+const tables_stream = subscribe_to_tables((last_update, tables) => {
+    schedule_model.apply(last_update, tables);
+});
 schedule_model.update();
 
 const content_comp = new Vue({
@@ -39,6 +63,8 @@ const content_comp = new Vue({
         swap_selected_table: '',
         swap_selected_team1: '',
         swap_selected_team2: '',
+        // Operations collected to be sent together to tables/batch.
+        batch: [],
     },
     methods: {
         add_to_queue: function(event) {
@@ -49,7 +75,7 @@ const content_comp = new Vue({
                         alert(response.data.message);
                         return;
                     }
-                    schedule_model.update();
+                    if (!tables_stream.connected) schedule_model.update();
                 })
         },
         remove_from_queue: function(event) {
@@ -60,7 +86,7 @@ const content_comp = new Vue({
                         alert(response.data.message);
                         return;
                     }
-                    schedule_model.update();
+                    if (!tables_stream.connected) schedule_model.update();
                 })
         },
         swap_teams_in_queue: function(event) {
@@ -71,8 +97,46 @@ const content_comp = new Vue({
                         alert(response.data.message);
                         return;
                     }
-                    schedule_model.update();
+                    if (!tables_stream.connected) schedule_model.update();
+                })
+        },
+        batch_add_to_queue: function(event) {
+            let operation = {'table': this.add_selected_table, 'op': 'add_to_queue',
+                             'team': this.add_selected_team};
+            if (this.add_position !== '') operation.pos = parseInt(this.add_position);
+            this.batch.push(operation);
+        },
+        batch_remove_from_queue: function(event) {
+            this.batch.push({'table': this.remove_selected_table, 'op': 'remove_from_queue',
+                             'team': this.remove_selected_team});
+        },
+        batch_swap_teams_in_queue: function(event) {
+            this.batch.push({'table': this.swap_selected_table, 'op': 'swap_teams_in_queue',
+                             'teams': [this.swap_selected_team1, this.swap_selected_team2]});
+        },
+        describe_operation: function(operation) {
+            if (operation.op == 'swap_teams_in_queue')
+                return operation.table + ': swap ' + operation.teams.join(' and ');
+            if (operation.op == 'remove_from_queue')
+                return operation.table + ': remove ' + operation.team;
+            let description = operation.table + ': add ' + operation.team;
+            if (operation.pos !== undefined) description += ' in position ' + operation.pos;
+            return description;
+        },
+        // All the operations are applied or none of them is.
+        apply_batch: function(event) {
+            axios.post(APPLICATION_ROOT + 'tables/batch', {'operations': this.batch})
+                .then(response => {
+                    if (!response.data.ok) {
+                        alert(response.data.message);
+                        return;
+                    }
+                    this.batch = [];
+                    if (!tables_stream.connected) schedule_model.update();
                 })
         },
+        clear_batch: function(event) {
+            this.batch = [];
+        },
     }
 });
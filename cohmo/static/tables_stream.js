@@ -0,0 +1,24 @@
+// Subscribes to the stream of server-sent events /tables/stream.
+// on_tables(last_update, tables) is called whenever a new snapshot of the
+// tables is received.
+// The returned object has the property connected, telling whether the stream
+// is currently open. When it is not (or if the stream is disabled, see
+// TABLES_STREAM, or if the browser does not support EventSource), the caller
+// should fall back to polling tables/get_all.
+function subscribe_to_tables(on_tables) {
+    let subscription = {connected: false};
+    if (!TABLES_STREAM || !window.EventSource) return subscription;
+    const query = new URLSearchParams(with_token({})).toString();
+    const source = new EventSource(APPLICATION_ROOT + 'tables/stream' + (query ? '?' + query : ''));
+    source.onopen = () => {
+        subscription.connected = true;
+    };
+    source.onerror = () => {
+        subscription.connected = false;
+    };
+    source.addEventListener('tables', event => {
+        const data = JSON.parse(event.data);
+        on_tables(data.last_update, data.tables);
+    });
+    return subscription;
+}
@@ -1,7 +1,8 @@
 from cohmo.history import Correction, HistoryManager
+from cohmo.persister import replace_file
 import enum
+import threading
 import time
-import shutil
 import json
 
 class TableStatus(enum.IntEnum):
@@ -35,169 +36,325 @@ class Table:
     # status (calling, correcting, nothing)
     # current_team (needed only if status == CORRECTING)
     # start_time (needed only if status == CORRECTING) # Timestamp in seconds
-    def __init__(self, path, history_manager, additional_config):
+    # journal_seq (only if the table is journaled, see cohmo/journal.py)
+    #
+    # If a journal is given, the operations are appended to it instead of
+    # rewriting the json file (see cohmo/journal.py).
+    # If a storage is given, the table is read from and saved to the storage
+    # instead of the json file (see cohmo/sqlite_storage.py), and path is the
+    # name of the table.
+    # If a persister is given, the json file is rewritten by the persister
+    # (see cohmo/persister.py) instead of during the operations.
+    # If table_as_dict (in the format of the json file) is given, the table is
+    # constructed from it instead of reading the file (see
+    # cohmo/state_snapshot.py).
+    def __init__(self, path, history_manager, additional_config, journal=None,
+                 storage=None, persister=None, table_as_dict=None):
         self.path = path
-        with open(path, newline='') as table_file:
-            table_as_dict = json.load(table_file)
-            self.name = table_as_dict['name']
-            self.problem = table_as_dict['problem']
-            self.coordinators = table_as_dict['coordinators']
-            self.history_manager = history_manager
-            self.queue = table_as_dict['queue']
-            status_name = table_as_dict['status']
-            self.status = TableStatus[status_name]
-            if self.status == TableStatus.CORRECTING:
-                self.current_coordination_team = \
-                    table_as_dict['current_coordination_team']
-                self.current_coordination_start_time = \
-                    table_as_dict['current_coordination_start_time']
-            else:
-                self.current_coordination_start_time = None
-                self.current_coordination_team = None
-            self.expected_duration = None
-            self.num_sign_corr = additional_config['NUM_SIGN_CORR']
-            self.apriori_duration = additional_config['APRIORI_DURATION']
-            self.minimum_duration = additional_config['MINIMUM_DURATION']
-            self.maximum_duration = additional_config['MAXIMUM_DURATION']
-            assert(self.minimum_duration < self.maximum_duration)
-            self.start_time = additional_config['START_TIME']
-            self.maximum_time = additional_config['MAXIMUM_TIME']
-            assert(self.start_time < self.maximum_time)
-            self.break_times = additional_config['BREAK_TIMES']
-            for bt in self.break_times:
-                assert(bt[0] <= bt[1])
+        self.journal = journal
+        self.persister = persister
+        # Held while the table is read or modified, so that each operation is
+        # atomic with respect to the other threads. It is reentrant, thus an
+        # operation made of many steps can hold it across all of them (see
+        # ChiefCoordinator).
+        self.lock = threading.RLock()
+        self.storage = storage
+        if table_as_dict is None and storage is None:
+            with open(path, newline='') as table_file:
+                table_as_dict = json.load(table_file)
+        elif table_as_dict is None:
+            table_as_dict = storage.load_table(path)
+        self.name = table_as_dict['name']
+        self.problem = table_as_dict['problem']
+        self.coordinators = table_as_dict['coordinators']
+        self.history_manager = history_manager
+        self.load_state(table_as_dict)
+        # The operations done since begin_batch, or None if no batch is in
+        # progress (see begin_batch).
+        self.batch_operations = None
+        self.num_sign_corr = additional_config['NUM_SIGN_CORR']
+        self.apriori_duration = additional_config['APRIORI_DURATION']
+        self.minimum_duration = additional_config['MINIMUM_DURATION']
+        self.maximum_duration = additional_config['MAXIMUM_DURATION']
+        assert(self.minimum_duration < self.maximum_duration)
+        self.start_time = additional_config['START_TIME']
+        self.maximum_time = additional_config['MAXIMUM_TIME']
+        assert(self.start_time < self.maximum_time)
+        self.break_times = additional_config['BREAK_TIMES']
+        for bt in self.break_times:
+            assert(bt[0] <= bt[1])
+        # Called with the table as argument after every operation that
+        # modified it. It is set by the owner of the table.
+        self.change_callback = None
+        # If not None, the backups of the json file are kept (see Backups in
+        # cohmo/persister.py). It is set by the owner of the table.
+        self.backups = None
+
+    # Sets the internal state of the table (queue and status) from a
+    # dictionary in the format of the json file.
+    def load_state(self, table_as_dict):
+        self.queue = list(table_as_dict['queue'])
+        # The teams in the queue, to check the membership in constant time.
+        self.queue_set = set(self.queue)
+        status_name = table_as_dict['status']
+        self.status = TableStatus[status_name]
+        if self.status == TableStatus.CORRECTING:
+            self.current_coordination_team = \
+                table_as_dict['current_coordination_team']
+            self.current_coordination_start_time = \
+                table_as_dict['current_coordination_start_time']
+        else:
+            self.current_coordination_start_time = None
+            self.current_coordination_team = None
+        # The sequence number of the last journaled operation included in
+        # the state (see cohmo/journal.py).
+        self.journal_seq = table_as_dict.get('journal_seq', 0)
+        self.expected_duration = None
 
     # Dumps the table to file. The format is the same as create_table_from_file.
     # It should be remarked that the current status of the table (whether it is
     # currently correcting) is lost when doing this operation.
+    # The file is replaced atomically (see replace_file), and when it is the
+    # default file its backups are rotated. It can be called by any thread
+    # (the persister calls it without holding the lock of the table).
     def dump_to_file(self, path=None):
-        if path is None:
-            path = self.path
-            # Before modifying the default file a backup is done.
-            shutil.copyfile(path, path + '.backup')
-        with open(path, 'w', newline='') as table_file:
-            table_as_dict = self.to_dict()
-            del table_as_dict['expected_duration']
-            table_as_dict['status'] = self.status.name
+        with self.lock:
+            data = json.dumps(self.to_file_dict(), indent=4)
+        replace_file(self.path if path is None else path, data)
+        if path is None and self.backups is not None:
+            self.backups.rotate(self.path)
+
+    # Returns the dictionary that is written to the json file of the table.
+    def to_file_dict(self):
+        table_as_dict = self.to_dict()
+        del table_as_dict['expected_duration']
+        table_as_dict['status'] = self.status.name
+        if self.journal is not None:
+            table_as_dict['journal_seq'] = self.journal_seq
+        return table_as_dict
+
+    # Registers (see HistoryManager.register_operation) and persists an
+    # operation just performed on the table, unless a batch is in progress.
+    # It is called only by the operations that succeeded, so that a failed
+    # operation neither changes operations_num nor makes the other processes
+    # reload the state. The arguments must be enough to replay the operation
+    # deterministically with apply_operation.
+    def save(self, operation, args):
+        self.history_manager.register_operation(self.name)
+        if self.batch_operations is not None:
+            self.batch_operations.append((operation, args))
+        else:
+            self.persist([(operation, args)])
+
+    # Persists the given operations, as pairs (operation, args), just
+    # performed on the table. If the table is in a storage it is saved there,
+    # if it is journaled the operations are appended to the journal, if it has
+    # a persister it is marked dirty, otherwise the whole table is dumped to
+    # its file.
+    # Then change_callback is called.
+    def persist(self, operations):
+        if self.storage is not None: self.storage.save_table(self.to_file_dict())
+        elif self.journal is not None:
+            self.journal_seq = self.journal.append_many(self.name, operations)
+            self.journal.compact_if_needed()
+        elif self.persister is not None: self.persister.mark_dirty(self.path, self.dump_to_file)
+        else: self.dump_to_file()
+        if self.change_callback is not None: self.change_callback(self)
 
-            json.dump(table_as_dict, table_file, indent=4)
+    # Between begin_batch and end_batch the operations on the table are
+    # neither persisted nor do they recompute the expected duration, which
+    # is done only once by end_batch.
+    # The lock of the table must be held for the whole batch.
+    def begin_batch(self):
+        self.batch_operations = []
+
+    # If rollback_state (a dictionary returned by to_file_dict before
+    # begin_batch) is given, the operations of the batch are undone instead of
+    # being persisted.
+    def end_batch(self, rollback_state=None):
+        operations = self.batch_operations
+        self.batch_operations = None
+        if rollback_state is not None:
+            self.load_state(rollback_state)
+        elif operations:
+            self.compute_expected_duration()
+            self.persist(operations)
+
+    # Applies to the table an operation read from the journal, without
+    # persisting it again. The accepted operations are the ones passed to save.
+    # The caller must skip the records already included in the table (see
+    # journal_seq).
+    def apply_operation(self, operation, args):
+        if operation == 'add_to_queue':
+            self.queue.insert(args[1], args[0])
+            self.queue_set.add(args[0])
+        elif operation == 'remove_from_queue':
+            self.queue.remove(args[0])
+            self.queue_set.remove(args[0])
+        elif operation == 'set_queue':
+            self.queue = list(args[0])
+            self.queue_set = set(self.queue)
+        elif operation == 'swap_teams_in_queue':
+            pos1 = self.queue.index(args[0])
+            pos2 = self.queue.index(args[1])
+            self.queue[pos1], self.queue[pos2] = args[1], args[0]
+        elif operation == 'start_coordination':
+            self.status = TableStatus.CORRECTING
+            self.current_coordination_team = args[0]
+            self.current_coordination_start_time = args[1]
+        elif operation == 'finish_coordination':
+            self.status = TableStatus.VACANT
+        elif operation == 'switch_to_calling':
+            self.status = TableStatus.CALLING
+        elif operation == 'switch_to_busy':
+            self.status = TableStatus.BUSY
+        elif operation == 'switch_to_vacant':
+            self.status = TableStatus.VACANT
+        else:
+            raise ValueError('Unknown operation \'{0}\'.'.format(operation))
+        self.expected_duration = None
 
     def to_dict(self):
-        return {
-            'name': self.name,
-            'problem': self.problem,
-            'coordinators': self.coordinators,
-            'queue': self.queue,
-            'status': self.status,
-            'current_coordination_team': self.current_coordination_team,
-            'current_coordination_start_time': self.current_coordination_start_time,
-            'expected_duration': self.get_expected_duration(),
-        }
+        with self.lock:
+            return {
+                'name': self.name,
+                'problem': self.problem,
+                'coordinators': self.coordinators,
+                'queue': list(self.queue),
+                'status': self.status,
+                'current_coordination_team': self.current_coordination_team,
+                'current_coordination_start_time': self.current_coordination_start_time,
+                'expected_duration': self.get_expected_duration(),
+            }
+
+    # Returns the team that can not be called by the other tables because of
+    # this table, that is the team being corrected or being called, and None
+    # if there is no such team.
+    def get_unavailable_team(self):
+        with self.lock:
+            if self.status == TableStatus.CORRECTING:
+                return self.current_coordination_team
+            if self.status == TableStatus.CALLING and self.queue:
+                return self.queue[0]
+            return None
 
 
     # Adds a team to the queue in the given position (default is last).
     # If the team is already in the queue nothing is done and False is returned.
     # Otherwise True is returned.
     def add_to_queue(self, team, pos=-1):
-        self.history_manager.operations_num += 1
-        if team not in self.queue:
-            if pos == -1: pos = len(self.queue)
-            self.queue.insert(pos, team)
-            self.compute_expected_duration()
-            self.dump_to_file()
-            return True
-        else: return False
+        with self.lock:
+            if team not in self.queue_set:
+                if pos == -1: pos = len(self.queue)
+                self.queue.insert(pos, team)
+                self.queue_set.add(team)
+                self.compute_expected_duration()
+                self.save('add_to_queue', [team, pos])
+                return True
+            else: return False
 
     # Removes the team from the queue.
     # Returns whether the team was in the queue.
     def remove_from_queue(self, team):
-        self.history_manager.operations_num += 1
-        if team in self.queue:
-            self.queue.remove(team)
+        with self.lock:
+            if team in self.queue_set:
+                self.queue.remove(team)
+                self.queue_set.remove(team)
+                self.compute_expected_duration()
+                self.save('remove_from_queue', [team])
+                return True
+            else: return False
+
+    def swap_teams_in_queue(self, team1, team2):
+        with self.lock:
+            if team1 not in self.queue_set or team2 not in self.queue_set or team1 == team2:
+                return False
+            pos1 = self.queue.index(team1)
+            pos2 = self.queue.index(team2)
+            self.queue[pos1], self.queue[pos2] = team2, team1
             self.compute_expected_duration()
-            self.dump_to_file()
+            self.save('swap_teams_in_queue', [team1, team2])
             return True
-        else: return False
 
-    def swap_teams_in_queue(self, team1, team2):
-        self.history_manager.operations_num += 1
-        if team1 not in self.queue or team2 not in self.queue or team1 == team2:
-            return False
-        pos1 = self.queue.index(team1)
-        pos2 = self.queue.index(team2)
-        self.queue[pos1], self.queue[pos2] = team2, team1
-        self.compute_expected_duration()
-        self.dump_to_file()
-        return True
+    # Replaces the whole queue with the given list of teams.
+    # Returns False if the table is calling a team that would not be the
+    # first of the new queue.
+    def set_queue(self, queue):
+        with self.lock:
+            if self.status == TableStatus.CALLING and self.queue and \
+                    list(queue)[:1] != self.queue[:1]: return False
+            self.queue = list(queue)
+            self.queue_set = set(self.queue)
+            self.compute_expected_duration()
+            self.save('set_queue', [self.queue])
+            return True
 
     # Starts a coordination with team.
     # Returns whether the coordination started successfully.
     def start_coordination(self, team):
-        self.history_manager.operations_num += 1
-        if self.status == TableStatus.CORRECTING: return False
-        self.status = TableStatus.CORRECTING
-        self.current_coordination_team = team
-        self.current_coordination_start_time = int(time.time())
-        self.compute_expected_duration()
-        self.dump_to_file()
-        return True
+        with self.lock:
+            if self.status == TableStatus.CORRECTING: return False
+            self.status = TableStatus.CORRECTING
+            self.current_coordination_team = team
+            self.current_coordination_start_time = int(time.time())
+            self.compute_expected_duration()
+            self.save('start_coordination', [team, self.current_coordination_start_time])
+            return True
 
     # Finish the current coordination and saves it in the history_manager.
     # Moreover it recomputes the expected_duration of the table.
     # Returns whether the coordination was successfully finished.
     def finish_coordination(self):
-        self.history_manager.operations_num += 1
-        if self.status != TableStatus.CORRECTING: return False
-        if not self.history_manager.add(self.current_coordination_team, self.name,
-                                        self.current_coordination_start_time,
-                                        int(time.time())): return False
-        self.status = TableStatus.VACANT
-        self.compute_expected_duration()
-        self.dump_to_file()
-        return True
+        with self.lock:
+            if self.status != TableStatus.CORRECTING: return False
+            if not self.history_manager.add(self.current_coordination_team, self.name,
+                                            self.current_coordination_start_time,
+                                            int(time.time()), register=False): return False
+            self.status = TableStatus.VACANT
+            self.compute_expected_duration()
+            self.save('finish_coordination', [])
+            return True
 
     # Switch the status to calling.
     # Returns whether the status was succesfully changed.
     def switch_to_calling(self):
-        self.history_manager.operations_num += 1
-        if len(self.queue) == 0: return False
-        if self.status != TableStatus.BUSY and self.status != TableStatus.VACANT: return False
-        self.status = TableStatus.CALLING
-        self.dump_to_file()
-        return True
+        with self.lock:
+            if len(self.queue) == 0: return False
+            if self.status != TableStatus.BUSY and self.status != TableStatus.VACANT: return False
+            self.status = TableStatus.CALLING
+            self.save('switch_to_calling', [])
+            return True
 
     # Switch the status to BUSY.
     # Returns whether the status was succesfully changed.
     def switch_to_busy(self):
-        self.history_manager.operations_num += 1
-        if self.status != TableStatus.VACANT: return False
-        self.status = TableStatus.BUSY
-        self.dump_to_file()
-        return True
+        with self.lock:
+            if self.status != TableStatus.VACANT: return False
+            self.status = TableStatus.BUSY
+            self.save('switch_to_busy', [])
+            return True
 
     # Switch the status to VACANT.
     # Returns whether the status was succesfully changed.
     def switch_to_vacant(self):
-        self.history_manager.operations_num += 1
-        if self.status != TableStatus.CALLING and self.status != TableStatus.BUSY: return False
-        self.status = TableStatus.VACANT
-        self.dump_to_file()
-        return True
+        with self.lock:
+            if self.status != TableStatus.CALLING and self.status != TableStatus.BUSY: return False
+            self.status = TableStatus.VACANT
+            self.save('switch_to_vacant', [])
+            return True
 
     # Computes the expected duration of the next correction of the table
     # and stores it in the dictionary expected_durations.
     # It is computed taking the arithmetic mean of the durations of the past
-    # corrections.
+    # corrections (read from the statistics kept by the history manager).
     # If less than NUM_SIGN_CORR corrections have been done in the table,
     # it pretends there exist additional corrections with duration APRIORI_DURATION.
     def compute_expected_duration(self):
-        table_corrections = self.history_manager.get_corrections({'table': self.name})
-        expected_duration = 0
-        for corr in table_corrections:
-            expected_duration += corr.duration()
-        expected_duration += max(self.num_sign_corr - len(table_corrections), 0) * self.apriori_duration
-        expected_duration /= max(self.num_sign_corr,
-                                 len(table_corrections))
+        if self.batch_operations is not None: return
+        corrections_num, expected_duration = \
+            self.history_manager.get_duration_statistics(self.name)
+        expected_duration += max(self.num_sign_corr - corrections_num, 0) * self.apriori_duration
+        expected_duration /= max(self.num_sign_corr, corrections_num)
         now = int(time.time())
         time_left = max(self.maximum_time, now) - max(self.start_time, now)
         for bt in self.break_times:
@@ -0,0 +1,94 @@
+import json
+from cohmo.table import TableStatus
+
+# Seconds between now and the first coordination of a table that is not
+# calling, and before a break within which no coordination starts (as in
+# cohmo/static/queues.js).
+START_MARGIN = 300
+
+# The projected start and end times of all the coordinations, computed from
+# the state of the tables at a given value of operations_num and at time now,
+# exactly as the pages of the queues compute them in the browser (see
+# start_time in cohmo/static/queues.js): the teams in the queue of a table
+# coordinate one after the other, each lasting the expected duration of the
+# table, skipping the breaks.
+# The responses of the views are serialized only once per team and problem,
+# so that many clients asking for the same timeline cost a single
+# serialization.
+class Timeline:
+    def __init__(self, operations_num, now, tables_data, break_times):
+        self.operations_num = operations_num
+        self.now = now
+        # Dictionary of the form team: [coordinations], where each
+        # coordination is a dictionary with keys table, problem, status
+        # ('correcting', 'calling' or 'queued'), start_time and end_time.
+        self.teams = {}
+        # Dictionary of the form problem: [tables], where each table is a
+        # dictionary with keys name, status, current_coordination_team,
+        # expected_duration and queue, a list of dictionaries with keys team,
+        # start_time and end_time.
+        self.problems = {}
+        # Dictionary of the form (kind, name): response body.
+        self.response_bodies = {}
+        for table in tables_data:
+            self.add_table(table, break_times)
+        for coordinations in self.teams.values():
+            coordinations.sort(key=lambda coordination: coordination['start_time'])
+
+    def add_table(self, table, break_times):
+        expected_duration = table['expected_duration']
+        if table['status'] == TableStatus.CALLING:
+            curr = self.now
+        elif table['status'] == TableStatus.CORRECTING:
+            curr = max(self.now + START_MARGIN,
+                       table['current_coordination_start_time'] + expected_duration)
+            self.add_coordination(table['current_coordination_team'], table, 'correcting',
+                                  table['current_coordination_start_time'], curr)
+        else:
+            curr = self.now + START_MARGIN
+        queue = []
+        for i, team in enumerate(table['queue']):
+            for bt in break_times:
+                if bt[0] - START_MARGIN <= curr <= bt[1]:
+                    curr = bt[1]
+            status = 'calling' if table['status'] == TableStatus.CALLING and i == 0 else 'queued'
+            self.add_coordination(team, table, status, curr, curr + expected_duration)
+            queue.append({'team': team, 'start_time': int(curr),
+                          'end_time': int(curr + expected_duration)})
+            curr += expected_duration
+        self.problems.setdefault(table['problem'], []).append({
+            'name': table['name'],
+            'status': table['status'],
+            'current_coordination_team': table['current_coordination_team'],
+            'expected_duration': expected_duration,
+            'queue': queue})
+
+    def add_coordination(self, team, table, status, start_time, end_time):
+        self.teams.setdefault(team, []).append({
+            'table': table['name'],
+            'problem': table['problem'],
+            'status': status,
+            'start_time': int(start_time),
+            'end_time': int(end_time)})
+
+    # Returns the body of the response of /country/<team>/timeline.
+    def get_team_response_body(self, team):
+        key = ('team', team)
+        if key not in self.response_bodies:
+            self.response_bodies[key] = json.dumps({
+                'ok': True,
+                'last_update': self.operations_num,
+                'now': self.now,
+                'coordinations': self.teams.get(team, [])}).encode()
+        return self.response_bodies[key]
+
+    # Returns the body of the response of /problem/<problem>/timeline.
+    def get_problem_response_body(self, problem):
+        key = ('problem', problem)
+        if key not in self.response_bodies:
+            self.response_bodies[key] = json.dumps({
+                'ok': True,
+                'last_update': self.operations_num,
+                'now': self.now,
+                'tables': self.problems.get(problem, [])}).encode()
+        return self.response_bodies[key]
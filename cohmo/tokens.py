@@ -0,0 +1,36 @@
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+# This class issues and verifies signed, expiring tokens, so that the clients
+# do not have to send (and the server does not have to verify) the password
+# at every request.
+# A token encodes the description of a user, that is a dictionary with keys
+# user, authorizations, admin and read_only (see
+# AuthenticationManager.get_user), and it is verified only checking its
+# signature, without looking into the authentication file.
+# The public tokens are read-only tokens, not bound to any user, for the
+# screens showing the queues to everybody. They have their own (longer)
+# lifetime.
+class TokenManager:
+    def __init__(self, secret_key, max_age, public_max_age):
+        self.max_age = max_age
+        self.public_max_age = public_max_age
+        self.serializer = URLSafeTimedSerializer(secret_key, salt='cohmo-token')
+        self.public_serializer = URLSafeTimedSerializer(secret_key, salt='cohmo-public-token')
+
+    def issue_token(self, user):
+        return self.serializer.dumps(user)
+
+    def issue_public_token(self):
+        return self.public_serializer.dumps(
+            {'user': None, 'authorizations': [], 'admin': False, 'read_only': True})
+
+    # Returns the description of the user encoded in the token, or None if the
+    # token is not valid or it is expired.
+    def verify_token(self, token):
+        for serializer, max_age in [(self.serializer, self.max_age),
+                                    (self.public_serializer, self.public_max_age)]:
+            try:
+                return serializer.loads(token, max_age=max_age)
+            except BadSignature:
+                pass
+        return None
@@ -1,33 +1,199 @@
 from cohmo import app, get_chief
-from cohmo.authentication_manager import AuthenticationManager
-from flask import Flask, request, json, jsonify, render_template, abort, redirect, url_for
+from cohmo.authentication_manager import AuthenticationManager, hash_authentication_file
+from cohmo.sqlite_storage import SQLiteStorage
+from cohmo.tokens import TokenManager
+from cohmo.schedule_plan import read_plan, parse_csv_plan, parse_json_plan
+from flask import Flask, request, json, jsonify, render_template, abort, redirect, url_for, Response, stream_with_context, g
 from flask_httpauth import HTTPBasicAuth
+from werkzeug.http import http_date, quote_etag
+import atexit
+import click
+import functools
+import math
+import sys
 
 auth = HTTPBasicAuth()
 authentication_manager = None
+# None if the tokens are disabled, see init_authentication_manager.
+token_manager = None
+# The SECRET_KEY that the committed instance/config.py used to contain, that
+# anybody can read.
+PLACEHOLDER_SECRET_KEY = 'change this secret key'
+TOKENS_DISABLED = 'The tokens are disabled, since SECRET_KEY is not set.'
+
+# Since anybody knowing SECRET_KEY can forge the tokens of any user (also of
+# the administrators), the tokens are disabled if it is not set or if it is
+# still the placeholder, and only HTTP Basic authentication is accepted.
 def init_authentication_manager():
-    global authentication_manager
-    authentication_manager = AuthenticationManager(app.config['AUTHENTICATION_FILE_PATH'])
-
+    global authentication_manager, token_manager
+    authentication_manager = AuthenticationManager(app.config['AUTHENTICATION_FILE_PATH'],
+                                                   app.config['AUTHENTICATION_CACHE_TTL'],
+                                                   app.config['AUTHENTICATION_CACHE_SIZE'])
+    secret_key = app.config.get('SECRET_KEY')
+    if not secret_key or secret_key == PLACEHOLDER_SECRET_KEY:
+        print(TOKENS_DISABLED, file=sys.stderr)
+        token_manager = None
+        return
+    token_manager = TokenManager(secret_key, app.config['TOKEN_MAX_AGE'],
+                                 app.config['PUBLIC_TOKEN_MAX_AGE'])
+
+# A client authenticates either with its username and password (HTTP Basic)
+# or with a token issued by /login (see cohmo/tokens.py), sent in the header
+# Authorization: Bearer <token> or, only for the GET requests, in the argument
+# token (e.g. for the pages and the stream, that can not set headers), so
+# that the tokens modifying the state do not end up in the access logs.
+# Returns the description of the user (see AuthenticationManager.get_user),
+# that the views get with auth.current_user(), or None if the authentication
+# fails. The read-only tokens are valid only for GET requests.
 @auth.verify_password
 def verify_password(username, password):
-    return authentication_manager.verify_password(username, password)
+    return authenticate(request.authorization, request.args.get('token'), request.method)
+
+# The authentication of verify_password, given the header Authorization (a
+# werkzeug Authorization, or None), the argument token and the method of the
+# request. It is shared with the ASGI application (see cohmo/asgi.py).
+def authenticate(authorization, token, method):
+    if authorization is not None and authorization.type == 'basic':
+        if not authentication_manager.verify_password(authorization.username,
+                                                      authorization.password): return None
+        return authentication_manager.get_user(authorization.username)
+    if method != 'GET': token = None
+    if authorization is not None and authorization.type == 'bearer':
+        token = authorization.token
+    if not token or token_manager is None: return None
+    user = token_manager.verify_token(token)
+    if user is None or (user['read_only'] and method != 'GET'): return None
+    return user
+
+# Returns whether the authenticated user can operate on the table.
+def is_authorized(table_name):
+    user = auth.current_user()
+    return user['admin'] or table_name in user['authorizations']
+
+# Returns whether the authenticated user is an administrator.
+def is_admin():
+    return auth.current_user()['admin']
 
 chief = None
 def init_chief():
     global chief
+    if chief is not None:
+        atexit.unregister(chief.close)
+        chief.close()
     chief = get_chief()
+    atexit.register(chief.close)
+
+# Every request sees an up-to-date state, even if the state is shared with
+# other processes, and the views that may modify the state (see
+# chief_operation) hold the lock of the state for their whole duration.
+# The POST requests with the argument durable return only after the state has
+# been written to disk, even if the persistence is deferred.
+@app.before_request
+def synchronize_chief():
+    if request.method != 'POST':
+        chief.synchronize()
+
+# Decorator of the views modifying the state, to be applied after
+# auth.login_required: the lock of the state is taken only once the request
+# is authenticated, so that the other requests (e.g. /login) do not wait for
+# the operations.
+def chief_operation(view):
+    @functools.wraps(view)
+    def locked_view(*args, **kwargs):
+        chief.begin_operation()
+        g.chief_operation = True
+        return view(*args, **kwargs)
+    return locked_view
+
+@app.teardown_request
+def end_chief_operation(exception):
+    if g.pop('chief_operation', False):
+        chief.end_operation(durable='durable' in request.args)
+
+# The pages subscribe to the stream /tables/stream only if it is enabled.
+@app.context_processor
+def inject_tables_stream():
+    return {'TABLES_STREAM': app.config['TABLES_STREAM']}
 
 @app.cli.command('initchief')
 def init_chief_command():
     init_chief()
     print('Initialized the chief coordinator object.')
 
+@app.cli.command('importsqlite')
+def import_sqlite_command():
+    storage = SQLiteStorage(app.config['SQLITE_FILE_PATH'])
+    storage.import_from_files(app.config['TABLE_FILE_PATHS'],
+                              app.config['HISTORY_FILE_PATH'])
+    storage.close()
+    print('Imported the tables and the history into the database.')
+
+@app.cli.command('exportsqlite')
+def export_sqlite_command():
+    storage = SQLiteStorage(app.config['SQLITE_FILE_PATH'])
+    storage.export_to_files(app.config['TABLE_FILE_PATHS'],
+                            app.config['HISTORY_FILE_PATH'])
+    storage.close()
+    print('Exported the tables and the history from the database.')
+
+# Replaces the passwords in plain text of the authentication file with their
+# hashes (see cohmo/authentication_manager.py).
+@app.cli.command('hashpasswords')
+@click.option('--method', type=click.Choice(['pbkdf2_sha256', 'scrypt']),
+              default='pbkdf2_sha256')
+def hash_passwords_command(method):
+    hashed_num = hash_authentication_file(app.config['AUTHENTICATION_FILE_PATH'], method)
+    print('Hashed {0} passwords.'.format(hashed_num))
+
+# Replaces the queues of all the tables with the ones of the plan in the given
+# csv or json file (see cohmo/schedule_plan.py).
+@app.cli.command('importschedule')
+@click.argument('path')
+def import_schedule_command(path):
+    chief.begin_operation()
+    try:
+        ok, message = chief.import_schedule(read_plan(path))
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    finally:
+        chief.end_operation(durable=True)
+    if not ok: raise click.ClickException(message)
+    print('Imported the schedule into the queues of the tables.')
+
 
 TABLE_NOT_EXIST = 'Table {0} does not exist.'
 TEAM_NOT_EXIST = 'Team {0} does not exist.'
 SPECIFY_TEAM = 'You have to specify a team.'
-TEAM_NOT_AVAILABLE = 'Team {0} is already in a coordination session.'
+
+# Returns the response of an operation of the chief, given the pair (ok,
+# message) it returned.
+def make_operation_response(result):
+    ok, message = result
+    if message is None: return jsonify(ok=ok)
+    return jsonify(ok=ok, message=message)
+
+
+# Authentication
+
+# Returns a token for the authenticated user, valid for TOKEN_MAX_AGE seconds,
+# to be used instead of the password in the following requests.
+@app.route('/login', methods=['POST'])
+@auth.login_required
+def login():
+    if token_manager is None: return jsonify(ok=False, message=TOKENS_DISABLED)
+    return jsonify(ok=True, token=token_manager.issue_token(auth.current_user()),
+                   expires_in=app.config['TOKEN_MAX_AGE'])
+
+# Returns a read-only token, not bound to any user and valid for
+# PUBLIC_TOKEN_MAX_AGE seconds, for the screens showing the queues (e.g.
+# opening /?token=<token>).
+@app.route('/login/public_token', methods=['POST'])
+@auth.login_required
+def public_token():
+    if not is_admin(): abort(401)
+    if token_manager is None: return jsonify(ok=False, message=TOKENS_DISABLED)
+    return jsonify(ok=True, token=token_manager.issue_public_token(),
+                   expires_in=app.config['PUBLIC_TOKEN_MAX_AGE'])
 
 
 # Available pages
@@ -38,7 +204,7 @@ def table_admin(table_name):
     table_name = table_name.upper()
     if table_name not in chief.tables:
         abort(404)
-    if not authentication_manager.is_authorized(auth.username(), table_name):
+    if not is_authorized(table_name):
         abort(401)
     return render_template('table_admin.html', table_name=table_name)
 
@@ -46,41 +212,127 @@ def table_admin(table_name):
 @auth.login_required
 def queues():
     return render_template('queues.html', START_TIME=chief.start_time,
-                                          BREAK_TIMES=json.dumps(chief.break_times))
+                                          BREAK_TIMES=json.dumps(chief.break_times),
+                                          PUBLIC_SNAPSHOT_URL=app.config['PUBLIC_SNAPSHOT_URL'])
 
 @app.route('/country/<string:country>')
 @auth.login_required
 def country_queues(country):
     return render_template('country_queues.html', country=country.upper(),
-                           START_TIME=chief.start_time, BREAK_TIMES=json.dumps(chief.break_times))
+                           START_TIME=chief.start_time, BREAK_TIMES=json.dumps(chief.break_times),
+                           PUBLIC_SNAPSHOT_URL=app.config['PUBLIC_SNAPSHOT_URL'])
 
 @app.route('/problem/<string:problem>')
 @auth.login_required
 def problem_queues(problem):
     return render_template('problem_queues.html', problem=problem,
-                           START_TIME=chief.start_time, BREAK_TIMES=json.dumps(chief.break_times))
+                           START_TIME=chief.start_time, BREAK_TIMES=json.dumps(chief.break_times),
+                           PUBLIC_SNAPSHOT_URL=app.config['PUBLIC_SNAPSHOT_URL'])
+
+# Returns the projected start and end times of the coordinations of a team
+# (see cohmo/timeline.py), so that the clients need neither the state of all
+# the tables nor to compute the times.
+@app.route('/country/<string:country>/timeline')
+@auth.login_required
+def country_timeline(country):
+    country = country.upper()
+    if country not in chief.teams_set:
+        return jsonify(ok=False, message=TEAM_NOT_EXIST.format(country))
+    return Response(chief.get_timeline().get_team_response_body(country),
+                    mimetype='application/json')
+
+# Returns the projected start and end times of the coordinations at the
+# tables of a problem (see cohmo/timeline.py).
+@app.route('/problem/<string:problem>/timeline')
+@auth.login_required
+def problem_timeline(problem):
+    timeline = chief.get_timeline()
+    if problem not in timeline.problems:
+        return jsonify(ok=False, message='Problem {0} does not exist.'.format(problem))
+    return Response(timeline.get_problem_response_body(problem),
+                    mimetype='application/json')
 
 @app.route('/schedule')
 @auth.login_required
 def schedule_admin():
-    if not authentication_manager.is_admin(auth.username()): abort(401)
+    if not is_admin(): abort(401)
     return render_template('schedule_admin.html')
 
+# Replaces the queues of all the tables with the ones of a plan (see
+# cohmo/schedule_plan.py), given either as a dictionary of the form
+# table: queue or as the text of a csv file.
+@app.route('/schedule/import', methods=['POST'])
+@auth.login_required
+@chief_operation
+def import_schedule():
+    if not is_admin(): abort(401)
+    req_data = json.loads(request.data)
+    if 'plan' not in req_data:
+        return jsonify(ok=False, message='You have to specify a plan.')
+    try:
+        if isinstance(req_data['plan'], str): plan = parse_csv_plan(req_data['plan'])
+        else: plan = parse_json_plan(req_data['plan'])
+        ok, message = chief.import_schedule(plan)
+    except ValueError as error:
+        return jsonify(ok=False, message=str(error))
+    if not ok: return jsonify(ok=False, message=message)
+    return jsonify(ok=True)
+
+# Proposes new queues that make the coordinations end as soon as possible (see
+# ChiefCoordinator.propose_schedule), without applying them.
+# The optional arguments are time_budget (in seconds, at most
+# SCHEDULER_MAX_TIME_BUDGET) and allow_table_changes (0 or 1, default 1).
+@app.route('/schedule/propose')
+@auth.login_required
+def propose_schedule():
+    if not is_admin(): abort(401)
+    time_budget = None
+    if 'time_budget' in request.args:
+        try:
+            time_budget = float(request.args['time_budget'])
+            if math.isnan(time_budget): raise ValueError
+        except ValueError:
+            return jsonify(ok=False, message='The time_budget variable must represent a number.')
+        if time_budget < 0:
+            return jsonify(ok=False, message='The time_budget variable must not be negative.')
+        time_budget = min(time_budget, app.config['SCHEDULER_MAX_TIME_BUDGET'])
+    allow_table_changes = request.args.get('allow_table_changes', '1') != '0'
+    proposal = chief.propose_schedule(time_budget, allow_table_changes)
+    return jsonify(ok=True, **proposal)
+
+# Applies the queues proposed by /schedule/propose, given together with the
+# base_queues of the proposal. It fails if the queues changed in the
+# meanwhile.
+@app.route('/schedule/apply_proposal', methods=['POST'])
+@auth.login_required
+@chief_operation
+def apply_proposed_schedule():
+    if not is_admin(): abort(401)
+    req_data = json.loads(request.data)
+    if 'queues' not in req_data or 'base_queues' not in req_data:
+        return jsonify(ok=False, message='You have to specify the queues and the base queues.')
+    try:
+        result = chief.apply_proposed_schedule(req_data['queues'], req_data['base_queues'])
+    except ValueError as error:
+        return jsonify(ok=False, message=str(error))
+    return make_operation_response(result)
+
 # API relative to a table
 
 @app.route('/table/<string:table_name>/add_to_queue', methods=['POST'])
 @auth.login_required
+@chief_operation
 def add_to_queue(table_name):
-    if not authentication_manager.is_authorized(auth.username(), table_name): abort(401)
+    if not is_authorized(table_name): abort(401)
     if table_name not in chief.tables:
         return jsonify(ok=False, message=TABLE_NOT_EXIST.format(table_name))
     req_data = json.loads(request.data)
     if 'team' not in req_data:
         return jsonify(ok=False, message=SPECIFY_TEAM)
     team = req_data['team']
-    if team not in chief.teams:
+    if team not in chief.teams_set:
         return jsonify(ok=False, message=TEAM_NOT_EXIST.format(team))
-    if team in chief.tables[table_name].queue:
+    if team in chief.tables[table_name].queue_set:
         return jsonify(ok=False,
                        message='Team {0} is already in queue at table {1}.'.format(team, table_name))
     if 'pos' in req_data and req_data['pos']:
@@ -97,17 +349,18 @@ def add_to_queue(table_name):
 
 @app.route('/table/<string:table_name>/remove_from_queue', methods=['POST'])
 @auth.login_required
+@chief_operation
 def remove_from_queue(table_name):
-    if not authentication_manager.is_authorized(auth.username(), table_name): abort(401)
+    if not is_authorized(table_name): abort(401)
     if table_name not in chief.tables:
         return jsonify(ok=False, message=TABLE_NOT_EXIST.format(table_name))
     req_data = json.loads(request.data)
     if 'team' not in req_data:
         return jsonify(ok=False, message=SPECIFY_TEAM)
     team = req_data['team']
-    if team not in chief.teams:
+    if team not in chief.teams_set:
         return jsonify(ok=False, message=TEAM_NOT_EXIST.format(team))
-    if team not in chief.tables[table_name].queue:
+    if team not in chief.tables[table_name].queue_set:
         return jsonify(ok=False,
                        message='Team {0} is not in queue at table {1}.'.format(team, table_name))
     if chief.tables[table_name].remove_from_queue(team):
@@ -116,8 +369,9 @@ def remove_from_queue(table_name):
 
 @app.route('/table/<string:table_name>/swap_teams_in_queue', methods=['POST'])
 @auth.login_required
+@chief_operation
 def swap_teams_in_queue(table_name):
-    if not authentication_manager.is_authorized(auth.username(), table_name): abort(401)
+    if not is_authorized(table_name): abort(401)
     if table_name not in chief.tables:
         return jsonify(ok=False, message=TABLE_NOT_EXIST.format(table_name))
     req_data = json.loads(request.data)
@@ -129,9 +383,9 @@ def swap_teams_in_queue(table_name):
         return jsonify(ok=False,
                        message='You have to give exactly two teams to be swapped.')
     for team in teams:
-        if team not in chief.teams:
+        if team not in chief.teams_set:
             return jsonify(ok=False, message=TEAM_NOT_EXIST.format(team))
-        if team not in chief.tables[table_name].queue:
+        if team not in chief.tables[table_name].queue_set:
             return jsonify(ok=False,
                            message='Team {0} is not in queue at table {1}.'.format(team, table_name))
     if chief.tables[table_name].swap_teams_in_queue(teams[0], teams[1]):
@@ -140,29 +394,24 @@ def swap_teams_in_queue(table_name):
 
 @app.route('/table/<string:table_name>/start_coordination', methods=['POST'])
 @auth.login_required
+@chief_operation
 def start_coordination(table_name):
-    if not authentication_manager.is_authorized(auth.username(), table_name): abort(401)
+    if not is_authorized(table_name): abort(401)
     if table_name not in chief.tables:
         return jsonify(ok=False, message=TABLE_NOT_EXIST.format(table_name))
     req_data = json.loads(request.data)
     if 'team' not in req_data:
         return jsonify(ok=False, message=SPECIFY_TEAM)
     team = req_data['team']
-    if team not in chief.teams:
+    if team not in chief.teams_set:
         return jsonify(ok=False, message=TEAM_NOT_EXIST.format(team))
-    if team not in chief.tables[table_name].queue:
-        return jsonify(ok=False,
-                       message='Team {0} is not in queue at table {1}.'.format(team, table_name))
-    if chief.tables[table_name].start_coordination(team):
-        if chief.tables[table_name].remove_from_queue(team):
-            return jsonify(ok=True)
-        return jsonify(ok=False, message='An error occurred removing the team from the queue.')
-    return jsonify(ok=False, message='An error occurred while deleting the team from the queue.')
+    return make_operation_response(chief.start_coordination(table_name, team))
 
 @app.route('/table/<string:table_name>/finish_coordination', methods=['POST'])
 @auth.login_required
+@chief_operation
 def finish_coordination(table_name):
-    if not authentication_manager.is_authorized(auth.username(), table_name): abort(401)
+    if not is_authorized(table_name): abort(401)
     if table_name not in chief.tables:
         return jsonify(ok=False, message=TABLE_NOT_EXIST.format(table_name))
     if chief.tables[table_name].finish_coordination():
@@ -171,89 +420,51 @@ def finish_coordination(table_name):
 
 @app.route('/table/<string:table_name>/pause_coordination', methods=['POST'])
 @auth.login_required
+@chief_operation
 def pause_coordination(table_name):
-    if not authentication_manager.is_authorized(auth.username(), table_name): abort(401)
+    if not is_authorized(table_name): abort(401)
     if table_name not in chief.tables:
         return jsonify(ok=False, message=TABLE_NOT_EXIST.format(table_name))
-    table = chief.tables[table_name]
-    team = table.current_coordination_team
-    if team not in chief.teams:
-        return jsonify(ok=False, message=TEAM_NOT_EXIST.format(team))
-    if table.finish_coordination(): # If only this is true there is a problem.
-        if table.add_to_queue(team):
-            return jsonify(ok=True);
-        return jsonify(ok=False, message='The coordination has been paused, but there was an issue inserting the team again in the queue.')
-    return jsonify(ok=False, message='There was an issue finishing the coordination.')
+    return make_operation_response(chief.pause_coordination(table_name))
 
 @app.route('/table/<string:table_name>/switch_to_calling', methods=['POST'])
 @auth.login_required
+@chief_operation
 def switch_to_calling(table_name):
-    if not authentication_manager.is_authorized(auth.username(), table_name): abort(401)
+    if not is_authorized(table_name): abort(401)
     if table_name not in chief.tables:
         return jsonify(ok=False, message=TABLE_NOT_EXIST.format(table_name))
-    queue = chief.tables[table_name].queue
-    if len(queue) == 0:
-        return jsonify(ok=FALSE, message='There are no teams to call.')
-    team = queue[0]
-    if team in chief.get_unavailable_teams():
-        return jsonify(ok=False, message=TEAM_NOT_AVAILABLE.format(team))
-    if chief.tables[table_name].switch_to_calling():
-        return jsonify(ok=True)
-    return jsonify(ok=False, message='An error occured while switching the status to calling.')
+    return make_operation_response(chief.switch_to_calling(table_name))
 
 @app.route('/table/<string:table_name>/call_team', methods=['POST'])
 @auth.login_required
+@chief_operation
 def call_team(table_name):
-    if not authentication_manager.is_authorized(auth.username(), table_name): abort(401)
+    if not is_authorized(table_name): abort(401)
     if table_name not in chief.tables:
         return jsonify(ok=False, message=TABLE_NOT_EXIST.format(table_name))
-    table = chief.tables[table_name]
     req_data = json.loads(request.data)
     if 'team' not in req_data:
         return jsonify(ok=False, message=SPECIFY_TEAM)
     team = req_data['team']
-    if team not in chief.teams:
+    if team not in chief.teams_set:
         return jsonify(ok=False, message=TEAM_NOT_EXIST.format(team))
-    if team in chief.get_unavailable_teams():
-        return jsonify(ok=False, message=TEAM_NOT_AVAILABLE.format(team))
-    if team in table.queue:
-        if not table.remove_from_queue(team):
-            return jsonify(ok=False, message='There was an error removing the team from the queue.')
-    if not table.add_to_queue(team, 0):
-        return jsonify(ok=False, message='An error occurred placing the team first in the queue.')
-    if table.status != 0:
-        if not table.switch_to_calling():
-            return jsonify(ok=False, message='An error occurred while switching the status to calling.')
-    return jsonify(ok=True)
+    return make_operation_response(chief.call_team(table_name, team))
 
 @app.route('/table/<string:table_name>/skip_to_next', methods=['POST'])
 @auth.login_required
+@chief_operation
 def skip_to_next(table_name):
-    if not authentication_manager.is_authorized(auth.username(), table_name): abort(401)
+    if not is_authorized(table_name): abort(401)
     if table_name not in chief.tables:
         return jsonify(ok=False, message=TABLE_NOT_EXIST.format(table_name))
-    table = chief.tables[table_name]
-    if table.status != 0:
-        return jsonify(ok=False,
-                       message='You can not skip to call the next team if you are not calling.')
-    if len(table.queue) == 0:
-        return jsonify(ok=True, message='There are no teams to correct.')
-    if len(table.queue) == 1:
-        return jsonify(ok=True, message='There is only a team to correct yet.')
-    next_team = table.queue[1]
-    if next_team in chief.get_unavailable_teams():
-        return jsonify(ok=False, message=TEAM_NOT_AVAILABLE.format(next_team))
-    team = table.queue[0]
-    if not table.remove_from_queue(team):
-        return jsonify(ok=False, message='Problem removing the team from queue.')
-    if table.add_to_queue(team, min(chief.skipped_positions, len(table.queue))):
-        return jsonify(ok=True);
-    return jsonify(ok=False, message='An error occurred while adding the team in the queue.')
+    return make_operation_response(chief.skip_to_next(table_name))
 
 @app.route('/table/<string:table_name>/switch_to_busy', methods=['POST'])
 @auth.login_required
+@chief_operation
 def switch_to_busy(table_name):
-    if not authentication_manager.is_authorized(auth.username(), table_name): abort(401)
+    if not is_authorized(table_name): abort(401)
     if table_name not in chief.tables:
         return jsonify(ok=False, message=TABLE_NOT_EXIST.format(table_name))
     if chief.tables[table_name].switch_to_busy():
@@ -262,8 +473,9 @@ def switch_to_busy(table_name):
 
 @app.route('/table/<string:table_name>/switch_to_vacant', methods=['POST'])
 @auth.login_required
+@chief_operation
 def switch_to_vacant(table_name):
-    if not authentication_manager.is_authorized(auth.username(), table_name): abort(401)
+    if not is_authorized(table_name): abort(401)
     if table_name not in chief.tables:
         return jsonify(ok=False, message=TABLE_NOT_EXIST.format(table_name))
     if chief.tables[table_name].switch_to_vacant():
@@ -288,29 +500,219 @@ def get_all(table_name):
     table_data = json.dumps(table.to_dict())
     return jsonify(ok=True, table_data=table_data)
 
+# Applies a list of operations on the queues of many tables (see
+# ChiefCoordinator.apply_batch) atomically: either all of them succeed or none
+# of them is applied. The response contains the result of each operation
+# tried.
+@app.route('/tables/batch', methods=['POST'])
+@auth.login_required
+@chief_operation
+def tables_batch():
+    req_data = json.loads(request.data)
+    if 'operations' not in req_data:
+        return jsonify(ok=False, message='You have to specify the operations.')
+    operations = req_data['operations']
+    if isinstance(operations, list):
+        for operation in operations:
+            if (isinstance(operation, dict) and
+                    not is_authorized(operation.get('table'))):
+                abort(401)
+    try:
+        results = chief.apply_batch(operations)
+    except ValueError as error:
+        return jsonify(ok=False, message=str(error))
+    results = [{'ok': ok, 'message': message} if message is not None else {'ok': ok}
+               for ok, message in results]
+    if len(results) > 0 and not results[-1]['ok']:
+        return jsonify(ok=False, results=results,
+                       message='The operation {0} failed, no operation has been applied: {1}'.format(
+                           len(results) - 1, results[-1]['message']))
+    return jsonify(ok=True, results=results)
+
 # Return the tables data if and only if a new operation happened since last
 # update.
+# If since is given instead of last_update, only the tables changed after the
+# operation since are returned (and partial is True in the response), unless
+# the server does not remember all the operations happened after since. In
+# that case all the tables are returned.
+# If wait is given, and nothing happened since last update, the request waits
+# up to wait seconds (at most LONG_POLL_MAX_WAIT) for an operation, returning
+# the tables as soon as it happens, so that the clients polling in a loop get
+# the changes immediately. Each waiting request holds a thread of the WSGI
+# server (but not of the ASGI application, see cohmo/asgi.py).
 @app.route('/tables/get_all', methods=['GET'])
 @auth.login_required
 def get_tables_if_changed():
+    last_update, wait, message = parse_tables_args(request.args)
+    if message is not None: return jsonify(ok=True, message=message)
+    if wait > 0:
+        chief.history_manager.wait_for_operation(last_update, wait)
+    status, headers, body = get_tables_response(request.args, last_update,
+                                                request.accept_encodings,
+                                                request.if_none_match)
+    return Response(body, status=status, headers=headers)
+
+# The functions below, up to get_stream_event, implement /tables/get_all and
+# /tables/stream independently of the framework, so that they are shared with
+# the ASGI application (see cohmo/asgi.py), which waits for the operations on
+# its event loop.
+
+JSON_HEADERS = [('Content-Type', 'application/json')]
+
+# Returns the triple (last_update, wait, message) of the arguments of
+# /tables/get_all (see get_tables_if_changed), where message is the error to
+# return if an argument is malformed, and None otherwise.
+def parse_tables_args(args):
     last_update = -1
-    if 'last_update' in request.args:
+    for name in ['last_update', 'since']:
+        if name in args:
+            try:
+                last_update = int(args[name])
+            except ValueError:
+                return None, None, 'The {0} variable must represent an integer.'.format(name)
+    wait = 0
+    if 'wait' in args:
         try:
-            last_update = int(request.args['last_update'])
+            wait = min(max(float(args['wait']), 0), app.config['LONG_POLL_MAX_WAIT'])
         except ValueError:
-            return jsonify(ok=True, message='The last_update variable must represent an integer.')
+            return None, None, 'The wait variable must represent a number.'
+    return last_update, wait, None
+
+# Returns the triple (status, headers, body) of the response of
+# /tables/get_all, once the wait (if any) is over. accept_encodings and
+# if_none_match are the parsed headers Accept-Encoding and If-None-Match.
+def get_tables_response(args, last_update, accept_encodings, if_none_match):
+    if chief.history_manager.operations_num == last_update:
+        return 200, JSON_HEADERS, json.dumps({'ok': True, 'changed': False}).encode()
+    snapshot = chief.get_snapshot()
+    if 'since' in args:
+        changed_tables = chief.history_manager.get_changed_tables(last_update)
+        if changed_tables is not None:
+            return 200, JSON_HEADERS, snapshot.get_partial_response_body(changed_tables)
+    return get_snapshot_response(snapshot, accept_encodings, if_none_match)
+
+# Returns the triple (status, headers, body) of the response containing the
+# given snapshot, honoring the header If-None-Match and, if SNAPSHOT_GZIP is
+# True, gzipping the body when the client accepts it.
+# If public is True, the response can be cached by any proxy for
+# PUBLIC_SNAPSHOT_MAX_AGE seconds, and If-Modified-Since (a datetime, or None)
+# is honored too.
+# Last-Modified is sent only once it is final (see TablesSnapshot).
+def get_snapshot_response(snapshot, accept_encodings, if_none_match,
+                          if_modified_since=None, public=False):
+    gzipped = app.config['SNAPSHOT_GZIP'] and 'gzip' in accept_encodings
+    etag = snapshot.etag + ('-gzip' if gzipped else '')
+    final_last_modified = snapshot.has_final_last_modified()
+    not_modified = if_none_match.contains(etag)
+    if public and final_last_modified and not if_none_match \
+            and if_modified_since is not None:
+        not_modified = if_modified_since.timestamp() >= snapshot.last_modified
+    headers = [('ETag', quote_etag(etag)), ('Vary', 'Accept-Encoding')]
+    if final_last_modified:
+        headers.append(('Last-Modified', http_date(snapshot.last_modified)))
+    if public:
+        headers.append(('Cache-Control', 'public, max-age={0}'.format(
+            app.config['PUBLIC_SNAPSHOT_MAX_AGE'])))
+    if not_modified:
+        return 304, headers, b''
+    if gzipped:
+        return (200, JSON_HEADERS + headers + [('Content-Encoding', 'gzip')],
+                snapshot.get_gzipped_response_body())
+    return 200, JSON_HEADERS + headers, snapshot.get_response_body()
+
+# Returns the operations_num of the last snapshot received by a client of
+# /tables/stream, from the header Last-Event-ID or the argument last_update
+# (-1 if it is unknown).
+def parse_stream_last_update(last_event_id, args):
+    try:
+        return int(last_event_id or args.get('last_update', -1))
+    except ValueError:
+        return -1
+
+STREAM_HEADERS = [('Cache-Control', 'no-cache'), ('X-Accel-Buffering', 'no')]
+
+# Returns the first event of /tables/stream, telling the client how long to
+# wait before reconnecting.
+def get_stream_retry_event():
+    return 'retry: {0}\n\n'.format(int(app.config['STREAM_HEARTBEAT_INTERVAL'] * 1000))
+
+# Returns the pair (last_update, event) of the next event of /tables/stream
+# for a client that received the snapshot with operations_num last_update: a
+# new snapshot if an operation happened, a heartbeat otherwise.
+def get_stream_event(last_update):
     if chief.history_manager.operations_num == last_update:
-        return jsonify(ok=True, changed=False)
+        return last_update, ': heartbeat\n\n'
+    snapshot = chief.get_snapshot()
+    return snapshot.operations_num, 'id: {0}\nevent: tables\ndata: {1}\n\n'.format(
+        snapshot.operations_num, snapshot.get_event_data())
+
+# Returns the response containing the given snapshot (see
+# get_snapshot_response).
+def make_snapshot_response(snapshot, public=False):
+    status, headers, body = get_snapshot_response(snapshot, request.accept_encodings,
+                                                  request.if_none_match,
+                                                  request.if_modified_since, public)
+    return Response(body, status=status, headers=headers)
+
+# Returns the snapshot of the tables to anybody, without authentication, if
+# PUBLIC_SNAPSHOT is True, with the headers needed by a reverse proxy to
+# cache it (see deployment/apache_public_snapshot.conf).
+@app.route('/public/tables', methods=['GET'])
+def get_public_tables():
+    if not app.config['PUBLIC_SNAPSHOT']: abort(404)
+    return make_snapshot_response(chief.get_snapshot(), public=True)
+
+# Stream of server-sent events. Whenever a new operation happens, an event
+# 'tables' is sent with data {'last_update': operations_num, 'tables': [...]}
+# and id operations_num. If nothing happens, a comment is sent every
+# STREAM_HEARTBEAT_INTERVAL seconds to keep the connection alive.
+# A client reconnecting with the header Last-Event-ID (or with the argument
+# last_update) receives a new snapshot only if something changed in the
+# meantime.
+# It exists only if TABLES_STREAM is True.
+@app.route('/tables/stream', methods=['GET'])
+@auth.login_required
+def stream_tables():
+    if not app.config['TABLES_STREAM']: abort(404)
+    last_update = parse_stream_last_update(request.headers.get('Last-Event-ID'),
+                                           request.args)
+    heartbeat_interval = app.config['STREAM_HEARTBEAT_INTERVAL']
+
+    def generate_events(last_update):
+        yield get_stream_retry_event()
+        while True:
+            last_update, event = get_stream_event(last_update)
+            yield event
+            chief.history_manager.wait_for_operation(last_update,
+                                                     heartbeat_interval)
+
+    return Response(stream_with_context(generate_events(last_update)),
+                    mimetype='text/event-stream', headers=STREAM_HEADERS)
+
+# Returns the simulation of the rest of the day (see
+# ChiefCoordinator.get_simulation): the percentiles of the end of the day, of
+# the end of each table and of the start and end of the coordinations of each
+# team. With the argument team, only the coordinations of that team are
+# returned.
+@app.route('/tables/simulation', methods=['GET'])
+@auth.login_required
+def get_simulation():
+    if 'team' in request.args and request.args['team'] not in chief.teams_set:
+        return jsonify(ok=False, message=TEAM_NOT_EXIST.format(request.args['team']))
+    try:
+        simulation = chief.get_simulation()
+    except ImportError as error:
+        return jsonify(ok=False, message=str(error))
+    if 'team' in request.args:
+        team = request.args['team']
+        simulation = dict(simulation, teams={team: simulation['teams'].get(team, [])})
+    return jsonify(ok=True, **simulation)
 
-    all_tables_data = json.dumps([chief.tables[table].to_dict() for table in chief.tables])
-    return jsonify(ok=True, changed=True,
-                   last_update=chief.history_manager.operations_num,
-                   tables=all_tables_data)
-    
 # APIs relative to the history
 
 @app.route('/history/add', methods=['POST'])
 @auth.login_required
+@chief_operation
 def history_add():
     req_data = json.loads(request.data)
     if 'team' not in req_data:
@@ -331,6 +733,7 @@ def history_add():
 
 @app.route('/history/delete', methods=['POST'])
 @auth.login_required
+@chief_operation
 def history_delete():
     req_data = json.loads(request.data)
     if 'correction_id' not in req_data:
@@ -23,6 +23,129 @@ MINIMUM_DURATION = 10*60
 # Maximum duration of a coordination.
 MAXIMUM_DURATION = 30*60;
 
+# How the state of the tables is persisted. With 'snapshot' every operation
+# rewrites the json file of the table, with 'journal' every operation is
+# appended to JOURNAL_FILE_PATH and the json files are rewritten only when the
+# journal is compacted (every JOURNAL_COMPACTION_THRESHOLD operations and on
+# shutdown), with 'deferred' the json files are rewritten by a background
+# thread at most once every PERSISTENCE_FLUSH_INTERVAL seconds (and on
+# shutdown). The operations requested with the argument durable are written
+# immediately in any case. 'deferred' requires STATE_BACKEND = 'local'.
+PERSISTENCE_MODE = 'snapshot'
+PERSISTENCE_FLUSH_INTERVAL = 0.2
+
+# Number of backups kept of each table file and of the history file, as copies
+# named <path>.backup.<timestamp>, and minimum number of seconds between two
+# backups of the same file. A table file that can not be read at startup is
+# recovered from its newest valid backup.
+BACKUP_COUNT = 10
+BACKUP_INTERVAL = 60
+
+# If not None, the state of the tables and of the history is also saved to
+# this binary file (on compaction and on shutdown), which makes the startup
+# faster as long as the json and csv files are not changed by hand (see
+# cohmo/state_snapshot.py). It is usually set in instance/config.py.
+STATE_SNAPSHOT_FILE_PATH = None
+
+# When the journal is fsynced: 'always', 'periodic' (at most once every
+# JOURNAL_FSYNC_INTERVAL seconds) or 'never'. The operations requested with
+# the argument durable fsync the journal in any case.
+JOURNAL_FSYNC = 'always'
+JOURNAL_FSYNC_INTERVAL = 1
+
+# Number of journaled operations after which the journal is compacted.
+JOURNAL_COMPACTION_THRESHOLD = 500
+
+# Whether the stream /tables/stream is enabled. Every open page holds a
+# connection to the stream (and, with a WSGI server, a worker or a thread)
+# for as long as it is open, hence it should be enabled only with a server
+# handling many concurrent connections: a gunicorn worker of class gthread or
+# gevent, or the ASGI application (see deployment/asgi_run.py). When it is
+# disabled, the pages poll /tables/get_all.
+TABLES_STREAM = False
+
+# Seconds between two heartbeats of the stream /tables/stream when nothing
+# happens. It is also the delay before a client tries to reconnect.
+STREAM_HEARTBEAT_INTERVAL = 15
+
+# Maximum number of seconds a request to /tables/get_all with the argument
+# wait waits for an operation.
+LONG_POLL_MAX_WAIT = 30
+
+# Number of threads running the requests that the ASGI application (see
+# deployment/asgi_run.py) passes to the Flask application.
+ASGI_THREADS = 8
+
+# Whether the snapshot of the tables is sent gzipped to the clients accepting
+# it.
+SNAPSHOT_GZIP = True
+
+# Seconds after which the projected timeline of the coordinations (see
+# /country/<team>/timeline) is recomputed even if nothing happened, since
+# the projected times depend on the current time.
+TIMELINE_REFRESH_INTERVAL = 10
+
+# Whether the snapshot of the tables is published, without authentication,
+# at /public/tables with caching headers (Cache-Control: public with max-age
+# PUBLIC_SNAPSHOT_MAX_AGE seconds, ETag and Last-Modified), so that a reverse
+# proxy can cache it.
+PUBLIC_SNAPSHOT = False
+PUBLIC_SNAPSHOT_MAX_AGE = 5
+
+# If not None, the snapshot of the tables is also written to this file after
+# every operation, so that a web server can serve it directly as a static
+# file (see deployment/apache_public_snapshot.conf).
+PUBLIC_SNAPSHOT_FILE_PATH = None
+
+# If not None, the pages of the queues poll the public snapshot at this url
+# (e.g. /public/tables or the url of PUBLIC_SNAPSHOT_FILE_PATH) instead of
+# /tables/get_all and /tables/stream.
+PUBLIC_SNAPSHOT_URL = None
+
+# Number of recent operations remembered to send to the clients only the
+# tables that changed. A client that missed more operations than this receives
+# all the tables.
+RECENT_OPERATIONS_SIZE = 1000
+
+# Where the tables and the history are stored. With 'files' they are stored
+# in TABLE_FILE_PATHS and HISTORY_FILE_PATH, with 'sqlite' in the database
+# SQLITE_FILE_PATH (see the commands flask importsqlite and exportsqlite).
+STORAGE_BACKEND = 'files'
+
+# How the state is shared between processes, if STORAGE_BACKEND is 'files'
+# (the sqlite storage is always shared). With 'local' the state is owned
+# by a single process, with 'file' many processes (e.g. gunicorn -w 4) share
+# it through a lock file at STATE_FILE_PATH.
+STATE_BACKEND = 'local'
+
+# Seconds between two checks of whether another process changed the state, so
+# that the streams of this process are notified. 0 disables the checks.
+STATE_POLL_INTERVAL = 0.5
+
+# Seconds for which the outcome of the verification of some credentials is
+# remembered, and maximum number of credentials remembered, so that the
+# (expensive) hash of the password is not computed at every request.
+AUTHENTICATION_CACHE_TTL = 300
+AUTHENTICATION_CACHE_SIZE = 1000
+
+# Seconds for which the tokens issued by /login and the public read-only
+# tokens issued by /login/public_token are valid. The tokens are signed with
+# SECRET_KEY (see instance/config.py).
+TOKEN_MAX_AGE = 12*3600
+PUBLIC_TOKEN_MAX_AGE = 7*24*3600
+
+# Seconds spent searching for better queues when a schedule is proposed (see
+# /schedule/propose).
+SCHEDULER_TIME_BUDGET = 2
+
+# Maximum number of seconds of the argument time_budget of /schedule/propose,
+# since the search keeps a worker (and the CPU) busy for that long.
+SCHEDULER_MAX_TIME_BUDGET = 10
+
+# Number of possible remainders of the day simulated to estimate when the
+# teams coordinate (see /tables/simulation). The simulation requires numpy.
+SIMULATION_RUNS = 2000
+
 
 def generate_timestamp_from_time(time_str):
     coordination_day = '2020-04-19'
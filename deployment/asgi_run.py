@@ -0,0 +1,8 @@
+# Entry point for an ASGI server, e.g.
+#   uvicorn deployment.asgi_run:application
+# serving the stream /tables/stream and /tables/get_all from an event loop
+# (see cohmo/asgi.py), instead of a thread for each connection.
+# Importing cohmo already initializes the chief and the authentication manager.
+from cohmo import app
+from cohmo.asgi import AsgiApplication
+application = AsgiApplication(app)
@@ -19,4 +19,13 @@ TABLE_FILE_PATHS = {'1A': 'test_data/T1A.json',
                     '6A': 'test_data/T6A.json',
                     '6B': 'test_data/T6B.json'}
 HISTORY_FILE_PATH = 'test_data/history.csv'
+JOURNAL_FILE_PATH = 'test_data/journal.log'
+STATE_FILE_PATH = 'test_data/state.lock'
+SQLITE_FILE_PATH = 'test_data/cohmo.sqlite'
 AUTHENTICATION_FILE_PATH = 'test_data/auth_list.json'
+
+# Key signing the authentication tokens, it must be secret (and shared by all
+# the processes serving the app), e.g. the output of
+#   python -c 'import secrets; print(secrets.token_hex(32))'
+# The tokens are disabled while it is None (or 'change this secret key').
+SECRET_KEY = None
@@ -6,5 +6,10 @@ setup(
     include_package_data=True,
     install_requires=[
         'flask',
+        'flask-httpauth>=4.0',
+        'werkzeug>=2.3',
     ],
+    extras_require={
+        'simulation': ['numpy'],
+    },
 )
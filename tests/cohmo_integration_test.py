@@ -5,21 +5,43 @@ import unittest
 import tempfile
 from unittest.mock import *
 import time
+import gzip
+import random
+import hashlib
+from operator import attrgetter
+import threading
 from base64 import b64encode
 from flask import json, jsonify
+from werkzeug.http import http_date
 
 from cohmo.table import Table, TableStatus
-from cohmo.history import HistoryManager
-from cohmo.authentication_manager import AuthenticationManager
+from cohmo.history import HistoryManager, Correction, SortedIndex
+from cohmo.journal import Journal
+from cohmo.persister import Backups
+from cohmo.state_snapshot import read_state_snapshot, write_state_snapshot
+from cohmo.sqlite_storage import SQLiteStorage
+from cohmo.tokens import TokenManager
+from cohmo.schedule_plan import read_plan
+from cohmo.scheduler import Scheduler
+from cohmo import simulation
+from cohmo.authentication_manager import AuthenticationManager, hash_password, check_password, is_hashed, hash_authentication_file
 from cohmo.views import init_chief, init_authentication_manager
+from cohmo.asgi import AsgiApplication
+import asyncio
 
 def generate_tempfile(content):
     with tempfile.NamedTemporaryFile(delete=False) as t_file:
         t_file.write(content.encode())
         return t_file.name
 
+def remove_if_exists(path):
+    if os.path.exists(path): os.unlink(path)
+
 class CohmoTestCase(unittest.TestCase):
     def setUp(self):
+        # The files are removed after the chiefs of the test are closed (the
+        # cleanups run in reverse order).
+        self.addCleanup(self.remove_files)
         cohmo.app.config['TEAMS_FILE_PATH'] = generate_tempfile('FRA,ITA,ENG,USA,CHN,IND,KOR,GER')
         cohmo.app.config['HISTORY_FILE_PATH'] = generate_tempfile('USA,T2,5,10,ID1\n' + 'ENG,T5,8,12,ID2\n' + 'CHN,T5,13,17,ID3\n' + 'NLD,T3,16,29,ID4')
         cohmo.app.config['TABLE_FILE_PATHS'] = {
@@ -73,12 +95,44 @@ class CohmoTestCase(unittest.TestCase):
         cohmo.app.testing = True
         credentials = b64encode(b'admin:pass').decode('utf-8')
         self.headers = {'Authorization': 'Basic ' + credentials}
+        cohmo.app.config['SECRET_KEY'] = 'test secret key'
 
-    def tearDown(self):
+    def remove_files(self):
         os.unlink(cohmo.app.config['TEAMS_FILE_PATH'])
         os.unlink(cohmo.app.config['HISTORY_FILE_PATH'])
+        os.unlink(cohmo.app.config['AUTHENTICATION_FILE_PATH'])
         for table in cohmo.app.config['TABLE_FILE_PATHS']:
             os.unlink(cohmo.app.config['TABLE_FILE_PATHS'][table])
+        for path in [cohmo.app.config['HISTORY_FILE_PATH']] + \
+                list(cohmo.app.config['TABLE_FILE_PATHS'].values()):
+            for backup_path in Backups.list(path):
+                os.unlink(backup_path)
+
+    # Sets the given configuration values until the end of the test.
+    def set_config(self, **config):
+        for name, value in config.items():
+            self.addCleanup(cohmo.app.config.__setitem__, name, cohmo.app.config.get(name))
+            cohmo.app.config[name] = value
+
+    # Returns the path of a new temporary file, removed at the end of the test.
+    def generate_tempfile(self, content=''):
+        path = generate_tempfile(content)
+        self.addCleanup(remove_if_exists, path)
+        return path
+
+    # Returns a new chief, closed at the end of the test (if the test does not
+    # close it before).
+    def get_chief(self):
+        chief = cohmo.get_chief()
+        self.addCleanup(chief.close)
+        return chief
+
+    # Releases the files of the chief without writing its state, as a crash
+    # would do.
+    def crash_chief(self, chief):
+        if chief.journal is not None: chief.journal.close()
+        chief.state_backend.close()
+        chief.closed = True
 
     def test_chief_initialization(self):
         chief = cohmo.get_chief()
@@ -106,8 +160,8 @@ class CohmoTestCase(unittest.TestCase):
         # Constructing HistoryManager from the file written by dump_to_file.
         history = HistoryManager(cohmo.app.config['HISTORY_FILE_PATH'])
         self.assertEqual(len(history.corrections), 6)
-        self.assertEqual(history.corrections[3].table, 'T2')
-        self.assertEqual(history.corrections[3].team, 'ITA')
+        self.assertEqual(list(history.corrections.values())[3].table, 'T2')
+        self.assertEqual(list(history.corrections.values())[3].team, 'ITA')
         self.assertTrue(history.add('ITA', 'T5', 20, 30))
 
         # Testing various calls to get_corrections.
@@ -122,6 +176,57 @@ class CohmoTestCase(unittest.TestCase):
         self.assertEqual(history.get_corrections({'table':'T5', 'team':'ROK'}), [])
         self.assertEqual(len(history.get_corrections({'start_time':(-100,100)})), 7)
         self.assertEqual(len(history.get_corrections({'end_time':(15,25)})), 2)
+        self.assertEqual(len(history.get_corrections({'end_time':(25,15)})), 0)
+        self.assertEqual([c.team for c in history.get_corrections({'table':'T5', 'start_time':(0,20)})],
+                         ['CHN', 'KOR', 'ITA'])
+        self.assertEqual([c.id for c in history.get_corrections({'team':'USA', 'end_time':(0,10)})],
+                         ['ID1'])
+        self.assertEqual(len(history.get_corrections({'identifier':'ID3', 'table':'T5'})), 1)
+        self.assertEqual(history.get_corrections({'identifier':'ID3', 'table':'T2'}), [])
+        self.assertEqual(len(history.get_corrections({})), 7)
+
+        # Testing the duration statistics.
+        self.assertEqual(history.get_duration_statistics('T5'), (3, 4 + 15 + 10))
+        self.assertEqual(history.get_duration_statistics('NOWAY'), (0, 0))
+        self.assertTrue(history.delete(history.get_corrections({'table':'T5', 'team':'KOR'})[0].id))
+        self.assertEqual(history.get_duration_statistics('T5'), (2, 4 + 10))
+        self.assertTrue(history.add('FRA', 'T5', 30, 37))
+        self.assertEqual(history.get_duration_statistics('T5'), (3, 4 + 10 + 7))
+        self.assertEqual(history.duration_statistics['T5'][2], 16 + 100 + 49)
+        self.assertEqual(sorted(history.get_durations('T5')), [4, 7, 10])
+        self.assertEqual(list(history.get_durations('NOWAY')), [])
+
+        # The corrections have no __dict__ and share the names of the teams.
+        corrections = history.get_corrections({'team':'FRA'})
+        self.assertFalse(hasattr(corrections[0], '__dict__'))
+        self.assertIs(corrections[0].team, corrections[1].team)
+
+    # The sorted indexes, split in many blocks, agree with a sorted list.
+    @patch('cohmo.history.SortedIndex.BLOCK_SIZE', 4)
+    def test_sorted_index(self):
+        random_generator = random.Random(42)
+        corrections = [Correction('ITA', 'T2', random_generator.randint(0, 20), 30, 'ID{0}'.format(i))
+                       for i in range(100)]
+        index = SortedIndex(attrgetter('start_time'), corrections[:50])
+        present = corrections[:50]
+        for correction in corrections[50:]:
+            index.add(correction)
+            present.append(correction)
+            removed = random_generator.choice(present)
+            index.remove(removed)
+            present.remove(removed)
+        self.assertTrue(all(len(block) <= 8 for block in index.blocks))
+        for begin, end in [(0, 20), (5, 5), (3, 12), (-5, -1), (21, 30), (12, 3)]:
+            expected = [c for c in present if begin <= c.start_time <= end]
+            self.assertEqual(index.count(begin, end), len(expected))
+            self.assertEqual(sorted(c.id for c in index.range(begin, end)),
+                             sorted(c.id for c in expected))
+            self.assertEqual([c.start_time for c in index.range(begin, end)],
+                             sorted(c.start_time for c in expected))
+        for correction in list(present):
+            index.remove(correction)
+        self.assertEqual(index.count(0, 20), 0)
+        self.assertEqual(index.blocks, [])
 
     def test_table(self):
         history = HistoryManager(cohmo.app.config['HISTORY_FILE_PATH'])
@@ -172,6 +277,679 @@ class CohmoTestCase(unittest.TestCase):
         self.assertTrue(table.swap_teams_in_queue('KOR', 'IND'))
         self.assertEqual(table.queue, ['IND', 'CHN', 'KOR', 'ENG'])
 
+    def test_journal(self):
+        self.set_config(PERSISTENCE_MODE='journal', JOURNAL_FILE_PATH=self.generate_tempfile(),
+                        JOURNAL_COMPACTION_THRESHOLD=5)
+        table_path = cohmo.app.config['TABLE_FILE_PATHS']['T2']
+        with open(table_path) as table_file:
+            table_content = table_file.read()
+
+        chief = self.get_chief()
+        table = chief.tables['T2']
+        self.assertTrue(table.add_to_queue('CHN', 1))
+        self.assertTrue(table.swap_teams_in_queue('ITA', 'IND'))
+        self.assertTrue(table.start_coordination('ENG'))
+        self.assertTrue(table.remove_from_queue('ENG'))
+        self.assertEqual(table.queue, ['IND', 'CHN', 'ITA'])
+        # The table file is untouched, the operations are in the journal.
+        with open(table_path) as table_file:
+            self.assertEqual(table_file.read(), table_content)
+        self.assertEqual(len(Journal.read_records(cohmo.app.config['JOURNAL_FILE_PATH'])), 4)
+
+        # Simulating a crash: the new chief replays the journal.
+        self.crash_chief(chief)
+        chief = self.get_chief()
+        table = chief.tables['T2']
+        self.assertEqual(table.queue, ['IND', 'CHN', 'ITA'])
+        self.assertEqual(table.status, TableStatus.CORRECTING)
+        self.assertEqual(table.current_coordination_team, 'ENG')
+        self.assertEqual(Journal.read_records(cohmo.app.config['JOURNAL_FILE_PATH']), [])
+
+        # Reaching the compaction threshold rewrites the table file.
+        for team in ['FRA', 'USA', 'KOR', 'GER']:
+            self.assertTrue(table.add_to_queue(team))
+        self.assertTrue(table.swap_teams_in_queue('FRA', 'IND'))
+        self.assertEqual(Journal.read_records(cohmo.app.config['JOURNAL_FILE_PATH']), [])
+        table = Table(table_path, chief.history_manager, app.config)
+        self.assertEqual(table.queue, ['FRA', 'CHN', 'ITA', 'IND', 'USA', 'KOR', 'GER'])
+        self.assertEqual(table.status, TableStatus.CORRECTING)
+
+        # A truncated last record is ignored.
+        self.assertTrue(chief.tables['T2'].remove_from_queue('GER'))
+        with open(cohmo.app.config['JOURNAL_FILE_PATH'], 'a') as journal_file:
+            journal_file.write('{"table":"T2","op":"remove_f')
+        self.crash_chief(chief)
+        chief = self.get_chief()
+        self.assertEqual(chief.tables['T2'].queue, ['FRA', 'CHN', 'ITA', 'IND', 'USA', 'KOR'])
+
+    def test_journal_compaction_crash(self):
+        self.set_config(PERSISTENCE_MODE='journal', JOURNAL_FILE_PATH=self.generate_tempfile(),
+                        JOURNAL_COMPACTION_THRESHOLD=3, JOURNAL_FSYNC='never')
+        chief = self.get_chief()
+        table = chief.tables['T2']
+        self.assertTrue(table.add_to_queue('CHN'))
+        self.assertTrue(table.remove_from_queue('ENG'))
+        # Crashing after the table files are rewritten, before the journal is
+        # emptied.
+        with patch.object(Journal, 'truncate', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                table.add_to_queue('FRA', 0)
+        self.assertEqual(len(Journal.read_records(cohmo.app.config['JOURNAL_FILE_PATH'])), 3)
+        self.crash_chief(chief)
+
+        # The records already in the files are not applied again.
+        chief = self.get_chief()
+        self.assertEqual(chief.tables['T2'].queue, ['FRA', 'ITA', 'IND', 'CHN'])
+        self.assertTrue(chief.tables['T2'].remove_from_queue('FRA'))
+
+        # The durable operations are fsynced whatever the policy.
+        with patch.object(chief.journal, 'sync', wraps=chief.journal.sync) as sync:
+            chief.begin_operation()
+            chief.end_operation()
+            sync.assert_not_called()
+            chief.begin_operation()
+            chief.end_operation(durable=True)
+            sync.assert_called_once()
+        chief.close()
+        chief = self.get_chief()
+        self.assertEqual(chief.tables['T2'].queue, ['ITA', 'IND', 'CHN'])
+
+    def test_journal_batch(self):
+        self.set_config(PERSISTENCE_MODE='journal', JOURNAL_FILE_PATH=self.generate_tempfile(),
+                        JOURNAL_COMPACTION_THRESHOLD=3)
+        chief = self.get_chief()
+        # Ending the batch of T2 reaches the compaction threshold while the
+        # removal from T3 is not in the journal yet.
+        results = chief.apply_batch([
+            {'table': 'T2', 'op': 'add_to_queue', 'team': 'FRA', 'pos': 0},
+            {'table': 'T3', 'op': 'remove_from_queue', 'team': 'GER'},
+            {'table': 'T2', 'op': 'swap_teams_in_queue', 'teams': ['FRA', 'IND']},
+            {'table': 'T2', 'op': 'add_to_queue', 'team': 'CHN'}])
+        self.assertTrue(all(ok for ok, _ in results))
+        queues = {name: list(chief.tables[name].queue) for name in ['T2', 'T3']}
+        self.assertNotIn('GER', queues['T3'])
+
+        # Restarting after a crash, the operations are applied exactly once.
+        self.crash_chief(chief)
+        chief = self.get_chief()
+        self.assertEqual({name: chief.tables[name].queue for name in ['T2', 'T3']}, queues)
+
+    def test_deferred_persistence(self):
+        self.set_config(PERSISTENCE_MODE='deferred', PERSISTENCE_FLUSH_INTERVAL=0.05)
+        table_path = cohmo.app.config['TABLE_FILE_PATHS']['T2']
+        history_path = cohmo.app.config['HISTORY_FILE_PATH']
+        def read_queue():
+            with open(table_path) as table_file:
+                return json.load(table_file)['queue']
+        chief = self.get_chief()
+        chief.begin_operation()
+        ok, _ = chief.call_team('T2', 'ENG')
+        self.assertTrue(ok)
+        chief.end_operation()
+        for _ in range(100):
+            if read_queue() == ['ENG', 'ITA', 'IND']: break
+            time.sleep(0.05)
+        self.assertEqual(read_queue(), ['ENG', 'ITA', 'IND'])
+        self.assertEqual(chief.persister.dirty, {})
+
+        # The operations are coalesced until the next write.
+        chief.persister.interval = 1000
+        with patch.object(Table, 'dump_to_file', autospec=True,
+                          side_effect=Table.dump_to_file) as dump_to_file:
+            chief.begin_operation()
+            self.assertTrue(chief.tables['T2'].add_to_queue('CHN'))
+            self.assertTrue(chief.tables['T2'].add_to_queue('FRA'))
+            self.assertTrue(chief.tables['T2'].swap_teams_in_queue('CHN', 'FRA'))
+            chief.end_operation()
+            self.assertEqual(read_queue(), ['ENG', 'ITA', 'IND'])
+            chief.begin_operation()
+            self.assertTrue(chief.tables['T2'].remove_from_queue('IND'))
+            chief.end_operation(durable=True)
+            self.assertEqual(read_queue(), ['ENG', 'ITA', 'FRA', 'CHN'])
+            self.assertEqual(dump_to_file.call_count, 1)
+
+        # The deleted corrections are persisted too, and the dirty files
+        # are written on close.
+        self.assertTrue(chief.history_manager.delete('ID2'))
+        self.assertTrue(chief.tables['T2'].remove_from_queue('ITA'))
+        with open(history_path) as history_file:
+            self.assertIn('ID2', history_file.read())
+        chief.close()
+        self.assertEqual(read_queue(), ['ENG', 'FRA', 'CHN'])
+        self.assertEqual(HistoryManager(history_path).get_corrections({'identifier': 'ID2'}), [])
+        self.assertEqual(len(HistoryManager(history_path).corrections), 3)
+
+        self.set_config(STATE_BACKEND='file')
+        with self.assertRaises(ValueError):
+            cohmo.get_chief()
+
+    def test_backups(self):
+        self.set_config(BACKUP_COUNT=3, BACKUP_INTERVAL=0)
+        table_path = cohmo.app.config['TABLE_FILE_PATHS']['T2']
+        chief = self.get_chief()
+        for team in ['CHN', 'FRA', 'USA', 'KOR']:
+            self.assertTrue(chief.tables['T2'].add_to_queue(team))
+        backup_paths = Backups.list(table_path)
+        self.assertEqual(len(backup_paths), 3)
+        for backup_path, queue_length in zip(backup_paths, [7, 6, 5]):
+            with open(backup_path) as backup_file:
+                self.assertEqual(len(json.load(backup_file)['queue']), queue_length)
+        self.assertFalse([name for name in os.listdir(os.path.dirname(table_path))
+                          if name.startswith(os.path.basename(table_path))
+                          and name.endswith('.tmp')])
+        self.assertTrue(chief.history_manager.delete('ID1'))
+        self.assertEqual(len(Backups.list(cohmo.app.config['HISTORY_FILE_PATH'])), 1)
+
+        # A truncated table file is recovered from the newest valid backup.
+        with open(backup_paths[0], 'w') as backup_file:
+            backup_file.write('{"name": "T2", "pro')
+        with open(table_path, 'w') as table_file:
+            table_file.write('{"name": "T2", "problem": "3", "coordi')
+        chief = self.get_chief()
+        self.assertEqual(chief.tables['T2'].queue, ['ITA', 'ENG', 'IND', 'CHN', 'FRA', 'USA'])
+        self.assertEqual(chief.tables['T2'].path, table_path)
+        self.assertEqual(Table(table_path, chief.history_manager, app.config).queue,
+                         ['ITA', 'ENG', 'IND', 'CHN', 'FRA', 'USA'])
+
+        # Without a valid backup the error is raised.
+        for backup_path in Backups.list(table_path):
+            os.unlink(backup_path)
+        with open(table_path, 'w') as table_file:
+            table_file.write('{"name": "T2", "problem": "3", "coordi')
+        with self.assertRaises(ValueError):
+            cohmo.get_chief()
+
+    def test_state_snapshot(self):
+        self.set_config(STATE_SNAPSHOT_FILE_PATH=self.generate_tempfile())
+        table_path = cohmo.app.config['TABLE_FILE_PATHS']['T2']
+        history_path = cohmo.app.config['HISTORY_FILE_PATH']
+        def get_corrections(history_manager):
+            return sorted((c.team, c.table, c.start_time, c.end_time, str(c.id))
+                          for c in history_manager.corrections.values())
+        # An empty (or malformed) snapshot is ignored.
+        chief = self.get_chief()
+        self.assertTrue(chief.tables['T2'].add_to_queue('CHN'))
+        self.assertTrue(chief.history_manager.add('FRA', 'T3', 30, 40))
+        chief.close()
+
+        # The files did not change: they are not parsed.
+        with patch('cohmo.table.json.load', side_effect=RuntimeError), \
+                patch('cohmo.history.csv.reader', side_effect=RuntimeError):
+            chief = self.get_chief()
+        self.assertEqual(chief.tables['T2'].queue, ['ITA', 'ENG', 'IND', 'CHN'])
+        self.assertEqual(chief.tables['T8'].current_coordination_team, 'USA')
+        self.assertEqual(get_corrections(chief.history_manager),
+                         get_corrections(HistoryManager(history_path)))
+        self.assertEqual(len(chief.history_manager.corrections), 5)
+        chief.close()
+
+        # The corrections appended to the history are read.
+        with open(history_path, 'a', newline='') as history_file:
+            history_file.write('GER,T2,50,60,ID9\r\n')
+        with patch('cohmo.table.json.load', side_effect=RuntimeError):
+            chief = self.get_chief()
+        self.assertEqual(chief.history_manager.get_corrections({'identifier': 'ID9'})[0].team, 'GER')
+        self.assertEqual(len(chief.history_manager.corrections), 6)
+
+        # A file changed by hand makes the snapshot stale.
+        self.assertTrue(chief.history_manager.delete('ID9'))
+        with open(table_path) as table_file:
+            table_as_dict = json.load(table_file)
+        table_as_dict['queue'] = ['KOR']
+        with open(table_path, 'w') as table_file:
+            json.dump(table_as_dict, table_file)
+        chief = self.get_chief()
+        self.assertEqual(chief.tables['T2'].queue, ['KOR'])
+        self.assertEqual(len(chief.history_manager.corrections), 5)
+        chief.close()
+
+        # The files whose size and modification time did not change are
+        # not even read, the others are hashed.
+        snapshot_path = cohmo.app.config['STATE_SNAPSHOT_FILE_PATH']
+        table_paths = cohmo.app.config['TABLE_FILE_PATHS']
+        for path in [history_path] + list(table_paths.values()):
+            os.utime(path, ns=(10**18, 10**18))
+        write_state_snapshot(snapshot_path, {'T2': {}}, [], [history_path, table_path])
+        with patch('cohmo.state_snapshot.hashlib.sha256', side_effect=RuntimeError):
+            self.assertIsNotNone(read_state_snapshot(snapshot_path, {'T2': table_path}, history_path))
+        os.utime(table_path)
+        with patch('cohmo.state_snapshot.hashlib.sha256', wraps=hashlib.sha256) as sha256:
+            self.assertIsNotNone(read_state_snapshot(snapshot_path, {'T2': table_path}, history_path))
+            self.assertEqual(sha256.call_count, 1)
+        with open(table_path, 'r+') as table_file:
+            content = table_file.read()
+            table_file.seek(0)
+            table_file.write(content.replace('KOR', 'ITA'))
+        self.assertIsNone(read_state_snapshot(snapshot_path, {'T2': table_path}, history_path))
+
+    def test_schedule_import(self):
+        teams = ['FRA', 'ITA', 'ENG', 'USA', 'CHN', 'IND', 'KOR', 'GER']
+        plan = {'T2': teams, 'T3': teams[::-1], 'T5': teams[6:] + teams[:6],
+                'T8': teams[1:] + teams[:1]}
+        json_path = generate_tempfile(json.dumps(plan)) + '.json'
+        csv_path = json_path[:-len('.json')] + '.csv'
+        os.rename(json_path[:-len('.json')], json_path)
+        with open(csv_path, 'w') as csv_file:
+            for table in plan:
+                for team in plan[table]:
+                    csv_file.write('{0}, {1}\n'.format(team, table))
+        self.assertEqual(read_plan(json_path), plan)
+        self.assertEqual(read_plan(csv_path), plan)
+
+        chief = self.get_chief()
+        for wrong_plan, message in [
+                (dict(plan, T1=[]), 'Table T1 does not exist.'),
+                (dict(plan, T2=teams + ['VAT']), 'Team VAT does not exist.'),
+                (dict(plan, T2=teams + ['FRA']), 'Team FRA appears 2 times in the queues of problem 3.'),
+                (dict(plan, T5=teams[1:]), 'Team FRA appears 0 times in the queues of problem 6.')]:
+            with self.assertRaises(ValueError) as context:
+                chief.import_schedule(wrong_plan)
+            self.assertEqual(str(context.exception), message)
+        self.assertEqual(chief.tables['T2'].queue, ['ITA', 'ENG', 'IND'])
+
+        # The team being called by T5 stays first in its queue.
+        self.assertFalse(chief.tables['T5'].set_queue(teams))
+        self.assertEqual(chief.import_schedule(dict(plan, T5=teams)), (True, None))
+        self.assertEqual(chief.tables['T5'].queue, ['KOR'] + [team for team in teams if team != 'KOR'])
+        self.assertEqual(chief.tables['T5'].status, TableStatus.CALLING)
+        chief.tables['T3'].problem = '6'
+        self.assertEqual(chief.import_schedule({'T2': teams, 'T3': teams[4:], 'T5': teams[:4],
+                                                'T8': teams}),
+                         (False, 'Table T5 is calling team KOR, that the plan moves to another table.'))
+        self.assertEqual(chief.tables['T2'].queue, teams)
+        chief.tables['T3'].problem = '4'
+
+        self.assertEqual(chief.import_schedule(read_plan(csv_path)), (True, None))
+        for table in plan:
+            self.assertEqual(chief.tables[table].queue, plan[table])
+        chief = self.get_chief()
+        for table in plan:
+            self.assertEqual(chief.tables[table].queue, plan[table])
+
+        # The command line interface.
+        plan['T2'] = teams[::-1]
+        with open(json_path, 'w') as json_file:
+            json.dump(plan, json_file)
+        cohmo.views.init_chief()
+        result = cohmo.app.test_cli_runner().invoke(args=['importschedule', json_path])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(cohmo.views.chief.tables['T2'].queue, teams[::-1])
+        result = cohmo.app.test_cli_runner().invoke(args=['importschedule', csv_path + '.txt'])
+        self.assertNotEqual(result.exit_code, 0)
+        os.unlink(json_path)
+        os.unlink(csv_path)
+
+    def test_views_schedule_import(self):
+        cohmo.views.init_chief()
+        cohmo.views.init_authentication_manager()
+        client = cohmo.app.test_client()
+        headers = self.headers
+        teams = ['FRA', 'ITA', 'ENG', 'USA', 'CHN', 'IND', 'KOR', 'GER']
+
+        resp = json.loads(client.post('/schedule/import', headers=headers,
+                                      data=json.dumps({'plan': {'T2': teams}})).data)
+        self.assertEqual(resp, {'ok': False, 'message': 'Team FRA appears 0 times in the queues of problem 1.'})
+        plan = {'T2': teams, 'T3': teams, 'T5': teams, 'T8': teams[::-1]}
+        resp = json.loads(client.post('/schedule/import', headers=headers,
+                                      data=json.dumps({'plan': plan})).data)
+        self.assertEqual(resp, {'ok': True})
+        self.assertEqual(cohmo.views.chief.tables['T8'].queue, teams[::-1])
+        plan_csv = ''.join('{0},{1}\n'.format(team, table) for table in plan for team in teams)
+        resp = json.loads(client.post('/schedule/import', headers=headers,
+                                      data=json.dumps({'plan': plan_csv})).data)
+        self.assertEqual(resp, {'ok': True})
+        self.assertEqual(cohmo.views.chief.tables['T8'].queue, teams)
+        marco_headers = {'Authorization': 'Basic ' + b64encode(b'marco:xxx').decode('utf-8')}
+        resp = client.post('/schedule/import', headers=marco_headers,
+                           data=json.dumps({'plan': plan}))
+        self.assertEqual(resp.status_code, 401)
+
+    def test_scheduler(self):
+        tables = [
+            {'name': 'A1', 'problem': '1', 'duration': 10, 'queue': ['X', 'Y', 'Z'],
+             'available_time': 0, 'pinned': False},
+            {'name': 'A2', 'problem': '1', 'duration': 10, 'queue': [],
+             'available_time': 0, 'pinned': False},
+            {'name': 'B1', 'problem': '2', 'duration': 20, 'queue': ['X', 'Y', 'Z'],
+             'available_time': 5, 'pinned': True},
+        ]
+        scheduler = Scheduler(tables, [[40, 50]], 0)
+        # X: A1 0-10, B1 10-30. Y: A1 10-20, B1 50-70. Z: A1 20-30, B1 70-90.
+        self.assertEqual(scheduler.evaluate(scheduler.get_initial_queues()),
+                         (90, 1, {'A1': 30, 'A2': 0, 'B1': 90}))
+        self.assertEqual(scheduler.postpone_for_breaks(35, 10), 50)
+        self.assertEqual(scheduler.postpone_for_breaks(30, 10), 30)
+        proposal = scheduler.schedule(1, max_iterations=200)
+        self.assertEqual(proposal['initial_makespan'], 90)
+        self.assertEqual(proposal['queues']['B1'][0], 'X')
+        self.assertEqual(sorted(proposal['queues']['A1'] + proposal['queues']['A2']),
+                         ['X', 'Y', 'Z'])
+        self.assertEqual(sorted(proposal['queues']['B1']), ['X', 'Y', 'Z'])
+        self.assertLessEqual(proposal['makespan'], 90)
+        self.assertEqual(scheduler.evaluate(proposal['queues'])[:2],
+                         (proposal['makespan'], proposal['conflicts']))
+        # Without moving teams between tables, only the order can change.
+        scheduler = Scheduler(tables, [], 0, {'Y': 100}, allow_table_changes=False)
+        proposal = scheduler.schedule(1, max_iterations=200)
+        self.assertEqual(proposal['queues']['A2'], [])
+        # Y is busy until 100 and needs 30 more seconds.
+        self.assertEqual(proposal['makespan'], 130)
+
+        chief = self.get_chief()
+        proposal = chief.propose_schedule(0.1)
+        self.assertEqual(proposal['base_queues']['T2'], ['ITA', 'ENG', 'IND'])
+        self.assertEqual(proposal['queues']['T5'][0], 'KOR')
+        for table in chief.tables:
+            self.assertEqual(sorted(proposal['queues'][table]),
+                             sorted(proposal['base_queues'][table]))
+        queues = dict(proposal['queues'], T2=['IND', 'ENG', 'ITA'])
+        with self.assertRaises(ValueError):
+            chief.apply_proposed_schedule(dict(queues, T2=['FRA']), proposal['base_queues'])
+        self.assertEqual(chief.apply_proposed_schedule(queues, proposal['base_queues']),
+                         (True, None))
+        self.assertEqual(chief.tables['T2'].queue, ['IND', 'ENG', 'ITA'])
+        self.assertEqual(chief.apply_proposed_schedule(queues, proposal['base_queues']),
+                         (False, 'The queue of table T2 changed, the proposal is outdated.'))
+        base_queues = {table: list(chief.tables[table].queue) for table in chief.tables}
+        self.assertEqual(chief.apply_proposed_schedule(dict(base_queues, T5=['IND', 'KOR', 'ENG', 'USA']),
+                                                       base_queues),
+                         (False, 'Table T5 is calling a team that the proposal moves.'))
+
+    def test_views_schedule_propose(self):
+        cohmo.views.init_chief()
+        cohmo.views.init_authentication_manager()
+        client = cohmo.app.test_client()
+        resp = json.loads(client.get('/schedule/propose?time_budget=0.1&allow_table_changes=0',
+                                     headers=self.headers).data)
+        self.assertTrue(resp['ok'])
+        self.assertEqual(resp['queues']['T5'][0], 'KOR')
+        self.assertLessEqual(resp['makespan'], resp['initial_makespan'])
+        resp = json.loads(client.get('/schedule/propose?time_budget=x', headers=self.headers).data)
+        self.assertEqual(resp, {'ok': False, 'message': 'The time_budget variable must represent a number.'})
+        resp = json.loads(client.get('/schedule/propose?time_budget=nan', headers=self.headers).data)
+        self.assertEqual(resp, {'ok': False, 'message': 'The time_budget variable must represent a number.'})
+        # The time budget is clamped to SCHEDULER_MAX_TIME_BUDGET.
+        self.set_config(SCHEDULER_MAX_TIME_BUDGET=0.1)
+        with patch.object(cohmo.views.chief, 'propose_schedule',
+                          wraps=cohmo.views.chief.propose_schedule) as propose:
+            resp = json.loads(client.get('/schedule/propose?time_budget=inf',
+                                         headers=self.headers).data)
+            self.assertTrue(resp['ok'])
+            propose.assert_called_once_with(0.1, True)
+        queues = {'T2': ['IND', 'ITA', 'ENG'], 'T3': ['FRA', 'GER']}
+        base_queues = {'T2': ['ITA', 'ENG', 'IND'], 'T3': ['GER', 'FRA']}
+        resp = json.loads(client.post('/schedule/apply_proposal', headers=self.headers,
+                                      data=json.dumps({'queues': queues})).data)
+        self.assertFalse(resp['ok'])
+        resp = json.loads(client.post('/schedule/apply_proposal', headers=self.headers,
+                                      data=json.dumps({'queues': queues,
+                                                       'base_queues': base_queues})).data)
+        self.assertEqual(resp, {'ok': False, 'message': 'The queue of table T5 changed, the proposal is outdated.'})
+        base_queues = {table: cohmo.views.chief.tables[table].queue
+                       for table in cohmo.views.chief.tables}
+        resp = json.loads(client.post('/schedule/apply_proposal', headers=self.headers,
+                                      data=json.dumps({'queues': dict(base_queues, **queues),
+                                                       'base_queues': base_queues})).data)
+        self.assertEqual(resp, {'ok': True})
+        self.assertEqual(cohmo.views.chief.tables['T2'].queue, ['IND', 'ITA', 'ENG'])
+        marco_headers = {'Authorization': 'Basic ' + b64encode(b'marco:xxx').decode('utf-8')}
+        resp = client.get('/schedule/propose', headers=marco_headers)
+        self.assertEqual(resp.status_code, 401)
+
+    def test_views_timeline(self):
+        now = 10**6
+        break_end = now + 3600
+        # The break starts within 5 minutes.
+        self.set_config(START_TIME=0, MAXIMUM_TIME=2 * 10**6, BREAK_TIMES=[[now + 300, break_end]])
+        with patch('time.time', return_value=now):
+            cohmo.views.init_chief()
+            cohmo.views.init_authentication_manager()
+            client = cohmo.app.test_client()
+            chief = cohmo.views.chief
+            durations = {name: chief.tables[name].get_expected_duration() for name in chief.tables}
+            resp = json.loads(client.get('/country/eng/timeline', headers=self.headers).data)
+            self.assertEqual(resp['last_update'], chief.history_manager.operations_num)
+            self.assertEqual(resp['now'], now)
+            # All the tables start after the break.
+            expected = [('T2', '3', 'queued', break_end + durations['T2']),
+                        ('T5', '6', 'queued', break_end + 2 * durations['T5']),
+                        ('T8', '1', 'queued', break_end + durations['T8'])]
+            self.assertEqual(sorted((c['table'], c['problem'], c['status'], c['start_time'])
+                                    for c in resp['coordinations']),
+                             [(t, p, s, int(start)) for t, p, s, start in expected])
+            self.assertEqual(resp['coordinations'],
+                             sorted(resp['coordinations'], key=lambda c: c['start_time']))
+            resp = json.loads(client.get('/country/USA/timeline', headers=self.headers).data)
+            self.assertEqual(resp['coordinations'][0],
+                             {'table': 'T8', 'problem': '1', 'status': 'correcting',
+                              'start_time': 10, 'end_time': now + 300})
+            resp = json.loads(client.get('/country/KOR/timeline', headers=self.headers).data)
+            self.assertIn({'table': 'T5', 'problem': '6', 'status': 'calling',
+                           'start_time': break_end, 'end_time': int(break_end + durations['T5'])},
+                          resp['coordinations'])
+            resp = json.loads(client.get('/problem/6/timeline', headers=self.headers).data)
+            self.assertEqual([table['name'] for table in resp['tables']], ['T5'])
+            self.assertEqual([team['team'] for team in resp['tables'][0]['queue']],
+                             ['KOR', 'IND', 'ENG', 'USA'])
+            resp = json.loads(client.get('/problem/9/timeline', headers=self.headers).data)
+            self.assertEqual(resp, {'ok': False, 'message': 'Problem 9 does not exist.'})
+            resp = json.loads(client.get('/country/VAT/timeline', headers=self.headers).data)
+            self.assertEqual(resp, {'ok': False, 'message': 'Team VAT does not exist.'})
+
+            # The timeline is rebuilt only after an operation.
+            timeline = chief.get_timeline()
+            self.assertIs(chief.get_timeline(), timeline)
+            resp = json.loads(client.post('/table/T2/swap_teams_in_queue', headers=self.headers,
+                                          data=json.dumps({'teams': ['ITA', 'ENG']})).data)
+            self.assertTrue(resp['ok'])
+            self.assertIsNot(chief.get_timeline(), timeline)
+            resp = json.loads(client.get('/country/ENG/timeline', headers=self.headers).data)
+            self.assertIn(('T2', break_end), [(c['table'], c['start_time'])
+                                              for c in resp['coordinations']])
+
+    @unittest.skipIf(simulation.numpy is None, 'numpy is not installed')
+    def test_simulation(self):
+        tables = [
+            {'name': 'A', 'problem': '1', 'duration': 10, 'queue': ['X', 'Y'],
+             'available_time': 0, 'pinned': False, 'current_team': None,
+             'current_start_time': None},
+            {'name': 'B', 'problem': '2', 'duration': 20, 'queue': ['Y'],
+             'available_time': 20, 'pinned': False, 'current_team': 'Z',
+             'current_start_time': 0},
+        ]
+        def percentiles(value):
+            return {'p10': value, 'p50': value, 'p90': value}
+        # Y can not start at B before 20 because of Z, then there is a break.
+        result = simulation.simulate_day(tables, {'Z': 20}, {'A': [10], 'B': [20]},
+                                         [[25, 30]], 0, 50)
+        self.assertEqual(result['runs'], 50)
+        self.assertEqual(result['finish_time'], percentiles(50))
+        self.assertEqual(result['tables'], {'A': {'finish_time': percentiles(20)},
+                                            'B': {'finish_time': percentiles(50)}})
+        self.assertEqual(result['teams'], {
+            'X': [{'table': 'A', 'start_time': percentiles(0), 'end_time': percentiles(10)}],
+            'Y': [{'table': 'A', 'start_time': percentiles(10), 'end_time': percentiles(20)},
+                  {'table': 'B', 'start_time': percentiles(30), 'end_time': percentiles(50)}]})
+        result = simulation.simulate_day(tables, {'Z': 20}, {'A': [5, 15], 'B': [20]},
+                                         [], 0, 1000, seed=1)
+        start_time = result['teams']['Y'][0]['start_time']
+        self.assertEqual((start_time['p10'], start_time['p90']), (5, 15))
+        # Y finishes at A at 30 with probability 1/4, otherwise by 20.
+        start_time = result['teams']['Y'][1]['start_time']
+        self.assertEqual((start_time['p10'], start_time['p90']), (20, 30))
+        self.assertLessEqual(result['finish_time']['p50'], result['finish_time']['p90'])
+
+        cohmo.views.init_chief()
+        cohmo.views.init_authentication_manager()
+        client = cohmo.app.test_client()
+        resp = json.loads(client.get('/tables/simulation?team=ENG', headers=self.headers).data)
+        self.assertTrue(resp['ok'])
+        self.assertEqual(list(resp['teams']), ['ENG'])
+        self.assertEqual(sorted(c['table'] for c in resp['teams']['ENG']), ['T2', 'T5', 'T8'])
+        self.assertIs(cohmo.views.chief.get_simulation(), cohmo.views.chief.get_simulation())
+        resp = json.loads(client.get('/tables/simulation?team=VAT', headers=self.headers).data)
+        self.assertEqual(resp, {'ok': False, 'message': 'Team VAT does not exist.'})
+
+    def test_unavailable_teams(self):
+        chief = self.get_chief()
+        self.assertEqual(chief.unavailable_teams,
+                         {'KOR': {'T5': TableStatus.CALLING},
+                          'USA': {'T8': TableStatus.CORRECTING}})
+        self.assertFalse(chief.is_available('KOR'))
+        self.assertTrue(chief.is_available('ITA'))
+        self.assertEqual(chief.call_team('T2', 'KOR'),
+                         (False, 'Team KOR is already in a coordination session.'))
+        self.assertTrue(chief.tables['T5'].remove_from_queue('KOR'))
+        self.assertEqual(chief.unavailable_teams['IND'], {'T5': TableStatus.CALLING})
+        self.assertTrue(chief.is_available('KOR'))
+        self.assertTrue(chief.tables['T8'].finish_coordination())
+        self.assertEqual(chief.call_team('T2', 'USA'), (True, None))
+        self.assertEqual(chief.unavailable_teams,
+                         {'IND': {'T5': TableStatus.CALLING},
+                          'USA': {'T2': TableStatus.CALLING}})
+        self.assertEqual(chief.start_coordination('T2', 'USA'), (True, None))
+        self.assertEqual(chief.unavailable_teams['USA'], {'T2': TableStatus.CORRECTING})
+        self.assertEqual(chief.tables['T2'].queue_set, {'ITA', 'ENG', 'IND'})
+
+        # A team can be unavailable because of many tables.
+        self.assertTrue(chief.tables['T3'].add_to_queue('IND', 0))
+        self.assertTrue(chief.tables['T3'].switch_to_calling())
+        self.assertEqual(chief.unavailable_teams['IND'],
+                         {'T5': TableStatus.CALLING, 'T3': TableStatus.CALLING})
+        self.assertTrue(chief.tables['T5'].switch_to_vacant())
+        self.assertEqual(chief.unavailable_teams['IND'], {'T3': TableStatus.CALLING})
+        self.assertEqual(sorted(chief.get_unavailable_teams()), ['IND', 'USA'])
+
+        # Only the table calling a team can start its coordination.
+        self.assertEqual(chief.start_coordination('T5', 'IND'),
+                         (False, 'Team IND is already in a coordination session.'))
+        self.assertEqual(chief.tables['T5'].status, TableStatus.VACANT)
+
+        # A batch can not make a calling table call an unavailable team.
+        queue = list(chief.tables['T3'].queue)
+        self.assertEqual(chief.apply_batch([{'table': 'T3', 'op': 'add_to_queue', 'team': 'USA', 'pos': 0}]),
+                         [(False, 'Team USA is already in a coordination session.')])
+        self.assertEqual(chief.tables['T3'].queue, queue)
+        self.assertEqual(chief.apply_batch([
+            {'table': 'T3', 'op': 'remove_from_queue', 'team': 'IND'},
+            {'table': 'T3', 'op': 'add_to_queue', 'team': 'KOR', 'pos': 0}]),
+            [(True, None), (True, None)])
+        self.assertEqual(chief.unavailable_teams['KOR'], {'T3': TableStatus.CALLING})
+        self.assertNotIn('IND', chief.unavailable_teams)
+        self.assertEqual(chief.start_coordination('T3', 'KOR'), (True, None))
+
+    def test_concurrent_operations(self):
+        chief = self.get_chief()
+
+        # Run function(arg) for each arg in args, all at the same time, each
+        # in its own thread and enclosed in an operation (as a request does).
+        def run_concurrently(function, args):
+            barrier = threading.Barrier(len(args))
+            results = {}
+            def run(arg):
+                barrier.wait()
+                chief.begin_operation()
+                try:
+                    results[arg] = function(arg)
+                finally:
+                    chief.end_operation()
+            threads = [threading.Thread(target=run, args=(arg,)) for arg in args]
+            for thread in threads: thread.start()
+            for thread in threads: thread.join()
+            return results
+
+        # A team can be called by a single table.
+        results = run_concurrently(lambda name: chief.call_team(name, 'FRA'),
+                                   ['T2', 'T3', 'T5'])
+        called_by = [name for name in results if results[name][0]]
+        self.assertEqual(len(called_by), 1)
+        for name in results:
+            if name not in called_by:
+                self.assertEqual(results[name], (False, 'Team FRA is already in a coordination session.'))
+        self.assertEqual(chief.tables[called_by[0]].queue[0], 'FRA')
+        self.assertEqual(chief.tables[called_by[0]].status, TableStatus.CALLING)
+        self.assertEqual(chief.get_unavailable_teams().count('FRA'), 1)
+
+        # No operation on the same table is lost.
+        teams = ['ITA', 'ENG', 'USA', 'CHN', 'IND', 'KOR']
+        operations_num = chief.history_manager.operations_num
+        results = run_concurrently(lambda team: chief.tables['T8'].add_to_queue(team),
+                                   teams)
+        self.assertEqual(results, {team: team not in ['KOR', 'ENG'] for team in teams})
+        # The failed operations are not counted.
+        self.assertEqual(chief.history_manager.operations_num, operations_num + 4)
+        self.assertEqual(sorted(chief.tables['T8'].queue),
+                         ['CHN', 'ENG', 'FRA', 'IND', 'ITA', 'KOR', 'USA'])
+        queue = chief.tables['T8'].queue
+        chief.close()
+        chief = self.get_chief()
+        self.assertEqual(chief.tables['T8'].queue, queue)
+        chief.close()
+
+    def test_shared_state(self):
+        self.set_config(STATE_BACKEND='file', STATE_FILE_PATH=self.generate_tempfile(),
+                        STATE_POLL_INTERVAL=0)
+        # Two chiefs sharing the state, as two workers would do.
+        chief1 = self.get_chief()
+        chief2 = self.get_chief()
+        self.assertEqual(chief1.history_manager.operations_num,
+                         chief2.history_manager.operations_num)
+
+        chief1.begin_operation()
+        self.assertTrue(chief1.tables['T2'].add_to_queue('CHN'))
+        self.assertTrue(chief1.history_manager.add('ITA', 'T2', 100, 200))
+        chief1.end_operation()
+        self.assertEqual(chief2.tables['T2'].queue, ['ITA', 'ENG', 'IND'])
+        snapshot = chief2.get_snapshot()
+        chief2.synchronize()
+        self.assertEqual(chief2.tables['T2'].queue, ['ITA', 'ENG', 'IND', 'CHN'])
+        self.assertEqual(len(chief2.history_manager.get_corrections({'table': 'T2'})), 2)
+        self.assertEqual(chief2.history_manager.operations_num,
+                         chief1.history_manager.operations_num)
+        self.assertIsNot(chief2.get_snapshot(), snapshot)
+        # The workers report the same Last-Modified for the same state.
+        self.assertEqual(chief2.get_snapshot().last_modified,
+                         chief1.get_snapshot().last_modified)
+        self.assertEqual(chief2.history_manager.last_operation_time_ns,
+                         chief1.history_manager.last_operation_time_ns)
+
+        # An operation always starts from the up-to-date state.
+        chief2.begin_operation()
+        self.assertTrue(chief2.tables['T2'].remove_from_queue('ITA'))
+        chief2.end_operation()
+        chief1.begin_operation()
+        self.assertEqual(chief1.tables['T2'].queue, ['ENG', 'IND', 'CHN'])
+        self.assertTrue(chief1.tables['T2'].switch_to_calling())
+        chief1.end_operation()
+
+        # A failed operation does not change the shared version.
+        version = chief1.state_backend.get_version()
+        chief1.begin_operation()
+        self.assertFalse(chief1.tables['T2'].add_to_queue('CHN'))
+        chief1.end_operation()
+        self.assertEqual(chief1.state_backend.get_version(), version)
+        self.assertEqual(chief1.history_manager.operations_num, version)
+
+        # The other process is notified by the watcher.
+        chief1.close()
+        self.set_config(STATE_POLL_INTERVAL=0.01)
+        chief1 = self.get_chief()
+        last_update = chief1.history_manager.operations_num
+        chief2.begin_operation()
+        self.assertTrue(chief2.tables['T2'].switch_to_vacant())
+        chief2.end_operation()
+        self.assertEqual(chief1.history_manager.wait_for_operation(last_update, 5),
+                         last_update + 1)
+        self.assertEqual(chief1.tables['T2'].status, TableStatus.VACANT)
+
+        # The changes of the history alone are shared too.
+        chief2.begin_operation()
+        self.assertTrue(chief2.history_manager.delete('ID1'))
+        chief2.end_operation()
+        chief1.synchronize()
+        self.assertEqual(chief1.history_manager.get_corrections({'identifier': 'ID1'}), [])
+        self.assertEqual(chief1.history_manager.get_duration_statistics('T2'), (1, 100))
+
     # Testing operations_num.
     def test_operations_num(self):
         history = HistoryManager(cohmo.app.config['HISTORY_FILE_PATH'])
@@ -183,6 +961,12 @@ class CohmoTestCase(unittest.TestCase):
         self.assertAlmostEqual(history.operations_num, ops+2)
         self.assertTrue(table.add_to_queue('CHN'))
         self.assertAlmostEqual(history.operations_num, ops+3)
+        self.assertTrue(history.add('ITA', 'T2', 10, 20))
+        self.assertAlmostEqual(history.operations_num, ops+4)
+        self.assertEqual(history.get_changed_tables(ops+3), {'T2'})
+        self.assertTrue(history.delete('ID2'))
+        self.assertAlmostEqual(history.operations_num, ops+5)
+        self.assertEqual(history.get_changed_tables(ops+4), {'T5'})
         
     # Testing get_expected_duration.
     mock_time = Mock()
@@ -203,7 +987,7 @@ class CohmoTestCase(unittest.TestCase):
         table = Table(cohmo.app.config['TABLE_FILE_PATHS']['T2'], history, app.config)
 
         # Testing the basic behaviour.
-        self.assertEqual(history.corrections[0].duration(), 5)
+        self.assertEqual(list(history.corrections.values())[0].duration(), 5)
         self.assertEqual(len(history.get_corrections({'table':'T2'})), 1)
         self.assertAlmostEqual(table.get_expected_duration(), 4) # 10
         self.assertTrue(table.start_coordination('ITA')) # 3, 10
@@ -258,6 +1042,181 @@ class CohmoTestCase(unittest.TestCase):
 
         cohmo.app.config['MAXIMUM_TIME'] = tmp_maximum_time
 
+    def test_hashed_passwords(self):
+        pbkdf2_hash = hash_password('xxx')
+        scrypt_hash = hash_password('xxx', 'scrypt')
+        self.assertTrue(pbkdf2_hash.startswith('pbkdf2_sha256$'))
+        self.assertNotEqual(pbkdf2_hash, hash_password('xxx'))
+        for stored in [pbkdf2_hash, scrypt_hash, 'xxx']:
+            self.assertTrue(check_password(stored, 'xxx'))
+            self.assertFalse(check_password(stored, 'xx'))
+        self.assertFalse(is_hashed('xxx'))
+        self.assertFalse(check_password('pbkdf2_sha256$1$!$!', 'xxx'))
+        with self.assertRaises(ValueError):
+            hash_password('xxx', 'md5')
+
+        # The command line interface converts the file.
+        auth_path = cohmo.app.config['AUTHENTICATION_FILE_PATH']
+        result = cohmo.app.test_cli_runner().invoke(args=['hashpasswords', '--method', 'scrypt'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Hashed 2 passwords.', result.output)
+        with open(auth_path) as auth_file:
+            users = json.load(auth_file)
+        self.assertTrue(users['marco']['password'].startswith('scrypt$'))
+        self.assertEqual(users['marco']['authorizations'], ['T2', 'T5'])
+        self.assertEqual(hash_authentication_file(auth_path), 0)
+
+        authentication_manager = AuthenticationManager(auth_path, 300, 2)
+        self.assertTrue(authentication_manager.verify_password('marco', 'xxx'))
+        self.assertFalse(authentication_manager.verify_password('marco', 'pass'))
+        self.assertTrue(authentication_manager.verify_password('admin', 'pass'))
+        self.assertEqual(len(authentication_manager.cache), 2)
+        # The cached outcomes do not compute the hash again.
+        with patch('cohmo.authentication_manager.check_password') as check:
+            self.assertTrue(authentication_manager.verify_password('admin', 'pass'))
+            self.assertFalse(authentication_manager.verify_password('marco', 'pass'))
+            self.assertFalse(check.called)
+        with patch('cohmo.authentication_manager.check_password', return_value=True) as check:
+            self.assertTrue(authentication_manager.verify_password('marco', 'xxx'))
+            self.assertTrue(check.called)
+        # The cached outcomes expire.
+        authentication_manager = AuthenticationManager(auth_path, 0, 10)
+        self.assertTrue(authentication_manager.verify_password('marco', 'xxx'))
+        with patch('cohmo.authentication_manager.check_password', return_value=False) as check:
+            self.assertFalse(authentication_manager.verify_password('marco', 'xxx'))
+
+        init_authentication_manager()
+        client = cohmo.app.test_client()
+        self.assertEqual(client.get('/tables/get_all', headers=self.headers).status_code, 200)
+
+    def test_public_snapshot(self):
+        snapshot_path = self.generate_tempfile()
+        self.set_config(PUBLIC_SNAPSHOT=False, PUBLIC_SNAPSHOT_FILE_PATH=None)
+        cohmo.views.init_chief()
+        cohmo.views.init_authentication_manager()
+        client = cohmo.app.test_client()
+        self.assertEqual(client.get('/public/tables', headers={}).status_code, 404)
+        resp = client.get('/', headers=self.headers)
+        self.assertIn(b'const PUBLIC_SNAPSHOT_URL = null;', resp.data)
+
+        self.set_config(PUBLIC_SNAPSHOT=True, PUBLIC_SNAPSHOT_FILE_PATH=snapshot_path,
+                        PUBLIC_SNAPSHOT_URL='/public/tables')
+        cohmo.views.init_chief()
+        chief = cohmo.views.chief
+        with open(snapshot_path, 'rb') as snapshot_file:
+            self.assertEqual(snapshot_file.read(), chief.get_snapshot().get_response_body())
+        resp = client.get('/public/tables', headers={})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.data)['last_update'],
+                         chief.history_manager.operations_num)
+        self.assertTrue(resp.cache_control.public)
+        self.assertEqual(resp.cache_control.max_age, app.config['PUBLIC_SNAPSHOT_MAX_AGE'])
+        self.assertEqual(resp.headers['ETag'], '"{0}"'.format(chief.history_manager.operations_num))
+        snapshot_time = chief.get_snapshot().last_modified
+        with patch('cohmo.snapshot.time.time', Mock(return_value=snapshot_time + 1)):
+            resp = client.get('/public/tables', headers={})
+            self.assertEqual(resp.last_modified.timestamp(), snapshot_time)
+            last_modified = resp.headers['Last-Modified']
+            resp = client.get('/public/tables', headers={'If-None-Match': resp.headers['ETag']})
+            self.assertEqual(resp.status_code, 304)
+            resp = client.get('/public/tables', headers={'If-Modified-Since': last_modified})
+            self.assertEqual(resp.status_code, 304)
+        resp = client.get('/', headers=self.headers)
+        self.assertIn(b'const PUBLIC_SNAPSHOT_URL = "/public/tables";', resp.data)
+
+        # The file is rewritten after every operation.
+        resp = json.loads(client.post('/table/T2/add_to_queue', headers=self.headers,
+                                      data=json.dumps({'team': 'FRA'})).data)
+        self.assertTrue(resp['ok'])
+        with open(snapshot_path) as snapshot_file:
+            published = json.load(snapshot_file)
+        self.assertEqual(published['last_update'], chief.history_manager.operations_num)
+        self.assertIn('FRA', [table for table in json.loads(published['tables'])
+                              if table['name'] == 'T2'][0]['queue'])
+
+        # Last-Modified is the time of the last operation, and it is not
+        # sent (nor If-Modified-Since honored) until its second has
+        # passed, since another operation could happen in the same second.
+        chief.begin_operation()
+        self.assertTrue(chief.tables['T2'].remove_from_queue('FRA'))
+        chief.end_operation()
+        snapshot_time = chief.get_snapshot().last_modified
+        self.assertEqual(snapshot_time, chief.history_manager.last_operation_time_ns // 10**9)
+        self.assertLessEqual(snapshot_time, time.time())
+        with patch('cohmo.snapshot.time.time', Mock(return_value=snapshot_time + 0.5)):
+            resp = client.get('/public/tables', headers={'If-Modified-Since': last_modified})
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotIn('Last-Modified', resp.headers)
+            resp = client.get('/public/tables', headers={'If-Modified-Since': http_date(snapshot_time)})
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotIn('FRA', [table for table in json.loads(json.loads(resp.data)['tables'])
+                                     if table['name'] == 'T2'][0]['queue'])
+        with patch('cohmo.snapshot.time.time', Mock(return_value=snapshot_time + 1)):
+            resp = client.get('/public/tables', headers={})
+            self.assertEqual(resp.last_modified.timestamp(), snapshot_time)
+            resp = client.get('/public/tables',
+                              headers={'If-Modified-Since': resp.headers['Last-Modified']})
+            self.assertEqual(resp.status_code, 304)
+
+    def test_tokens(self):
+        token_manager = TokenManager('secret', 60, 3600)
+        user = {'user': 'marco', 'authorizations': ['T2'], 'admin': False, 'read_only': False}
+        self.assertEqual(token_manager.verify_token(token_manager.issue_token(user)), user)
+        self.assertTrue(token_manager.verify_token(token_manager.issue_public_token())['read_only'])
+        self.assertIsNone(token_manager.verify_token('x' + token_manager.issue_token(user)))
+        self.assertIsNone(TokenManager('other', 60, 3600).verify_token(token_manager.issue_token(user)))
+        self.assertIsNone(TokenManager('secret', -1, 3600).verify_token(token_manager.issue_token(user)))
+
+        cohmo.views.init_chief()
+        init_authentication_manager()
+        client = cohmo.app.test_client()
+        marco_headers = {'Authorization': 'Basic ' + b64encode(b'marco:xxx').decode('utf-8')}
+        resp = json.loads(client.post('/login', headers=marco_headers).data)
+        self.assertTrue(resp['ok'])
+        self.assertEqual(resp['expires_in'], app.config['TOKEN_MAX_AGE'])
+        token_headers = {'Authorization': 'Bearer ' + resp['token']}
+        self.assertEqual(client.get('/tables/get_all', headers=token_headers).status_code, 200)
+        self.assertEqual(client.get('/tables/get_all?token=' + resp['token']).status_code, 200)
+        resp = json.loads(client.post('/table/T2/add_to_queue', headers=token_headers,
+                                      data=json.dumps({'team': 'FRA'})).data)
+        self.assertEqual(resp, {'ok': True})
+        resp = client.post('/table/T8/add_to_queue', headers=token_headers,
+                           data=json.dumps({'team': 'ITA'}))
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(client.post('/login/public_token', headers=token_headers).status_code, 401)
+        resp = client.get('/tables/get_all', headers={'Authorization': 'Bearer xxx'})
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(client.get('/tables/get_all', headers={}).status_code, 401)
+
+        # The public token can only read.
+        resp = json.loads(client.post('/login/public_token', headers=self.headers).data)
+        self.assertEqual(resp['expires_in'], app.config['PUBLIC_TOKEN_MAX_AGE'])
+        public_token = resp['token']
+        self.assertEqual(client.get('/?token=' + public_token).status_code, 200)
+        self.assertEqual(client.get('/tables/get_all?token=' + public_token).status_code, 200)
+        resp = client.post('/table/T2/remove_from_queue?token=' + public_token,
+                           data=json.dumps({'team': 'FRA'}))
+        self.assertEqual(resp.status_code, 401)
+        resp = client.get('/table/T2/get_queue?token=' + public_token)
+        self.assertEqual(resp.status_code, 200)
+        resp = client.get('/schedule/propose?token=' + public_token)
+        self.assertEqual(resp.status_code, 401)
+
+        # The tokens are accepted in the arguments only by the GET requests.
+        token = json.loads(client.post('/login', headers=self.headers).data)['token']
+        resp = client.post('/table/T2/remove_from_queue?token=' + token,
+                           headers={}, data=json.dumps({'team': 'FRA'}))
+        self.assertEqual(resp.status_code, 401)
+
+        # Without a real SECRET_KEY the tokens are disabled.
+        for secret_key in [None, 'change this secret key']:
+            self.set_config(SECRET_KEY=secret_key)
+            init_authentication_manager()
+            resp = json.loads(client.post('/login', headers=self.headers).data)
+            self.assertEqual(resp, {'ok': False, 'message': 'The tokens are disabled, since SECRET_KEY is not set.'})
+            resp = client.get('/tables/get_all', headers={'Authorization': 'Bearer ' + token})
+            self.assertEqual(resp.status_code, 401)
+
     def test_authentication_manager(self):
         authentication_manager = \
             AuthenticationManager(cohmo.app.config['AUTHENTICATION_FILE_PATH'])
@@ -621,12 +1580,353 @@ class CohmoTestCase(unittest.TestCase):
         self.assertEqual(len(json.loads(resp['tables'])), 4)
         self.assertEqual(resp['changed'], True)
 
+    def test_views_tables_snapshot(self):
+        cohmo.views.init_chief()
+        cohmo.views.init_authentication_manager()
+        client = cohmo.app.test_client()
+        headers = self.headers
+        chief = cohmo.views.chief
+
+        snapshot = chief.get_snapshot()
+        self.assertIs(chief.get_snapshot(), snapshot)
+        resp = client.get('/tables/get_all', headers=headers)
+        self.assertIs(chief.get_snapshot(), snapshot)
+        self.assertEqual(resp.get_etag(), (str(snapshot.operations_num), False))
+        self.assertEqual(len(json.loads(json.loads(resp.data)['tables'])), 4)
+
+        # The snapshot is not sent again if the client already has it.
+        etag_headers = dict(headers, **{'If-None-Match': resp.headers['ETag']})
+        resp = client.get('/tables/get_all', headers=etag_headers)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b'')
+
+        # The gzipped snapshot.
+        gzip_headers = dict(headers, **{'Accept-Encoding': 'gzip'})
+        resp = client.get('/tables/get_all', headers=gzip_headers)
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(resp.data), snapshot.get_response_body())
+
+        # An operation invalidates the snapshot.
+        chief.begin_operation()
+        self.assertTrue(chief.tables['T2'].add_to_queue('CHN'))
+        chief.end_operation()
+        resp = client.get('/tables/get_all', headers=etag_headers)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIsNot(chief.get_snapshot(), snapshot)
+        tables = json.loads(json.loads(resp.data)['tables'])
+        self.assertEqual(tables[0]['queue'], ['ITA', 'ENG', 'IND', 'CHN'])
+
+    def test_views_tables_batch(self):
+        cohmo.views.init_chief()
+        cohmo.views.init_authentication_manager()
+        client = cohmo.app.test_client()
+        headers = self.headers
+        chief = cohmo.views.chief
+
+        resp = json.loads(client.post('/tables/batch', headers=headers,
+                                      data=json.dumps({'pippo': []})).data)
+        self.assertEqual(resp, {'ok': False, 'message': 'You have to specify the operations.'})
+        for operations, message in [
+                ('pippo', 'The operations must be a list.'),
+                ([{'table': 'T1', 'op': 'remove_from_queue', 'team': 'ITA'}],
+                 'Table T1 does not exist.'),
+                ([{'table': 'T2', 'op': 'pippo'}], 'Unknown operation \'pippo\'.'),
+                ([{'table': 'T2', 'op': 'add_to_queue', 'team': 'VAT'}],
+                 'Team VAT does not exist.'),
+                ([{'table': 'T2', 'op': 'swap_teams_in_queue', 'teams': ['ITA']}],
+                 'The operation 0 does not specify exactly two teams.'),
+                ([{'table': 'T2', 'op': 'add_to_queue', 'team': 'FRA', 'pos': '1'}],
+                 'The position of the operation 0 must be an integer.')]:
+            resp = json.loads(client.post('/tables/batch', headers=headers,
+                                          data=json.dumps({'operations': operations})).data)
+            self.assertEqual(resp, {'ok': False, 'message': message})
+
+        # Every affected table is persisted once.
+        operations = [
+            {'table': 'T2', 'op': 'add_to_queue', 'team': 'FRA', 'pos': 0},
+            {'table': 'T3', 'op': 'remove_from_queue', 'team': 'GER'},
+            {'table': 'T2', 'op': 'swap_teams_in_queue', 'teams': ['FRA', 'IND']},
+            {'table': 'T2', 'op': 'add_to_queue', 'team': 'GER'},
+            {'table': 'T2', 'op': 'remove_from_queue', 'team': 'ENG'},
+        ]
+        with patch.object(Table, 'persist', autospec=True,
+                          side_effect=Table.persist) as persist:
+            resp = json.loads(client.post('/tables/batch', headers=headers,
+                                          data=json.dumps({'operations': operations})).data)
+        self.assertEqual(resp, {'ok': True, 'results': [{'ok': True}] * 5})
+        self.assertEqual(sorted((call[0][0].name, len(call[0][1]))
+                                for call in persist.call_args_list),
+                         [('T2', 4), ('T3', 1)])
+        self.assertEqual(chief.tables['T2'].queue, ['IND', 'ITA', 'FRA', 'GER'])
+        self.assertEqual(chief.tables['T3'].queue, ['FRA'])
+        self.assertIsNotNone(chief.tables['T2'].expected_duration)
+        chief2 = self.get_chief()
+        self.assertEqual(chief2.tables['T2'].queue, ['IND', 'ITA', 'FRA', 'GER'])
+
+        # If an operation fails nothing is applied.
+        operations = [
+            {'table': 'T3', 'op': 'add_to_queue', 'team': 'GER'},
+            {'table': 'T2', 'op': 'remove_from_queue', 'team': 'ITA'},
+            {'table': 'T2', 'op': 'remove_from_queue', 'team': 'ITA'},
+            {'table': 'T2', 'op': 'add_to_queue', 'team': 'KOR'},
+        ]
+        with patch.object(Table, 'persist', autospec=True,
+                          side_effect=Table.persist) as persist:
+            resp = json.loads(client.post('/tables/batch', headers=headers,
+                                          data=json.dumps({'operations': operations})).data)
+        self.assertEqual(resp, {
+            'ok': False,
+            'results': [{'ok': True}, {'ok': True},
+                        {'ok': False, 'message': 'Team ITA is not in queue at table T2.'}],
+            'message': 'The operation 2 failed, no operation has been applied: Team ITA is not in queue at table T2.'})
+        self.assertEqual(persist.call_count, 0)
+        self.assertEqual(chief.tables['T2'].queue, ['IND', 'ITA', 'FRA', 'GER'])
+        self.assertEqual(chief.tables['T2'].queue_set, {'IND', 'ITA', 'FRA', 'GER'})
+        self.assertEqual(chief.tables['T3'].queue, ['FRA'])
+
+    def test_views_tables_changes(self):
+        self.set_config(RECENT_OPERATIONS_SIZE=3)
+        cohmo.views.init_chief()
+        cohmo.views.init_authentication_manager()
+        client = cohmo.app.test_client()
+        headers = self.headers
+        chief = cohmo.views.chief
+
+        last_update = chief.history_manager.operations_num
+        resp = json.loads(client.get('/tables/get_all', headers=headers,
+                                     query_string={'since': last_update}).data)
+        self.assertFalse(resp['changed'])
+        chief.begin_operation()
+        self.assertTrue(chief.tables['T2'].add_to_queue('CHN'))
+        self.assertTrue(chief.tables['T5'].switch_to_vacant())
+        self.assertTrue(chief.tables['T2'].remove_from_queue('CHN'))
+        chief.end_operation()
+        resp = json.loads(client.get('/tables/get_all', headers=headers,
+                                     query_string={'since': last_update + 1}).data)
+        self.assertTrue(resp['changed'] and resp['partial'])
+        self.assertEqual(resp['last_update'], last_update + 3)
+        tables = json.loads(resp['tables'])
+        self.assertEqual(sorted(table['name'] for table in tables), ['T2', 'T5'])
+        resp = json.loads(client.get('/tables/get_all', headers=headers,
+                                     query_string={'since': last_update + 2}).data)
+        self.assertEqual([table['name'] for table in json.loads(resp['tables'])], ['T2'])
+
+        # Too old or unknown operations give all the tables.
+        chief.begin_operation()
+        self.assertTrue(chief.tables['T3'].switch_to_busy())
+        chief.end_operation()
+        for since in [last_update, last_update + 10, -1]:
+            resp = json.loads(client.get('/tables/get_all', headers=headers,
+                                         query_string={'since': since}).data)
+            self.assertTrue(resp['changed'])
+            self.assertFalse('partial' in resp)
+            self.assertEqual(len(json.loads(resp['tables'])), 4)
+
+    def test_views_tables_long_poll(self):
+        cohmo.views.init_chief()
+        cohmo.views.init_authentication_manager()
+        client = cohmo.app.test_client()
+        headers = self.headers
+        chief = cohmo.views.chief
+
+        last_update = chief.history_manager.operations_num
+        resp = json.loads(client.get('/tables/get_all', headers=headers,
+                                     query_string={'last_update': last_update, 'wait': 'x'}).data)
+        self.assertEqual(resp['message'], 'The wait variable must represent a number.')
+        start = time.monotonic()
+        resp = json.loads(client.get('/tables/get_all', headers=headers,
+                                     query_string={'last_update': last_update, 'wait': 0.2}).data)
+        self.assertFalse(resp['changed'])
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+        def add_chn_to_t2():
+            time.sleep(0.2)
+            chief.begin_operation()
+            self.assertTrue(chief.tables['T2'].add_to_queue('CHN'))
+            chief.end_operation()
+        threading.Thread(target=add_chn_to_t2).start()
+        start = time.monotonic()
+        resp = json.loads(client.get('/tables/get_all', headers=headers,
+                                     query_string={'since': last_update, 'wait': 10}).data)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertTrue(resp['changed'] and resp['partial'])
+        self.assertEqual(resp['last_update'], last_update + 1)
+        self.assertEqual(json.loads(resp['tables'])[0]['queue'], ['ITA', 'ENG', 'IND', 'CHN'])
+
+        # If something already happened, the request does not wait.
+        start = time.monotonic()
+        resp = json.loads(client.get('/tables/get_all', headers=headers,
+                                     query_string={'last_update': last_update, 'wait': 10}).data)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertTrue(resp['changed'])
+
+    def test_views_tables_stream(self):
+        self.set_config(STREAM_HEARTBEAT_INTERVAL=0.1)
+        cohmo.views.init_chief()
+        cohmo.views.init_authentication_manager()
+        client = cohmo.app.test_client()
+        headers = self.headers
+
+        # The stream is disabled by default, and the pages poll.
+        self.assertEqual(client.get('/tables/stream', headers=headers).status_code, 404)
+        self.assertIn(b'const TABLES_STREAM = false;', client.get('/', headers=headers).data)
+        self.set_config(TABLES_STREAM=True)
+        self.assertIn(b'const TABLES_STREAM = true;', client.get('/', headers=headers).data)
+
+        resp = client.get('/tables/stream', headers=headers, buffered=False)
+        self.assertEqual(resp.mimetype, 'text/event-stream')
+        events = (chunk.decode() for chunk in resp.response)
+        self.assertEqual(next(events), 'retry: 100\n\n')
+        event = next(events).split('\n')
+        last_update = cohmo.views.chief.history_manager.operations_num
+        self.assertEqual(event[0], 'id: {0}'.format(last_update))
+        self.assertEqual(event[1], 'event: tables')
+        data = json.loads(event[2][len('data: '):])
+        self.assertEqual(data['last_update'], last_update)
+        self.assertEqual(len(data['tables']), 4)
+        self.assertEqual(next(events), ': heartbeat\n\n')
+        cohmo.views.chief.begin_operation()
+        self.assertTrue(cohmo.views.chief.tables['T2'].add_to_queue('CHN'))
+        cohmo.views.chief.end_operation()
+        event = next(events).split('\n')
+        self.assertEqual(event[0], 'id: {0}'.format(last_update + 1))
+        data = json.loads(event[2][len('data: '):])
+        self.assertEqual(data['tables'][0]['queue'], ['ITA', 'ENG', 'IND', 'CHN'])
+        resp.close()
+
+        # Resuming from the last event id does not resend the snapshot.
+        headers = dict(headers, **{'Last-Event-ID': str(last_update + 1)})
+        resp = client.get('/tables/stream', headers=headers, buffered=False)
+        events = (chunk.decode() for chunk in resp.response)
+        next(events)
+        self.assertEqual(next(events), ': heartbeat\n\n')
+        resp.close()
+
+    def test_asgi(self):
+        self.set_config(STREAM_HEARTBEAT_INTERVAL=10, TABLES_STREAM=True)
+        cohmo.views.init_chief()
+        cohmo.views.init_authentication_manager()
+        application = AsgiApplication(cohmo.app)
+        chief = cohmo.views.chief
+        credentials = [(b'authorization', self.headers['Authorization'].encode())]
+
+        def make_scope(method, path, query_string, headers):
+            return {'type': 'http', 'method': method, 'path': path,
+                    'query_string': query_string, 'headers': headers}
+
+        # Returns the triple (status, headers, body) of the response.
+        async def request(method, path, query_string=b'', headers=credentials, body=b''):
+            messages = [{'type': 'http.request', 'body': body}]
+            async def receive():
+                if messages: return messages.pop()
+                await asyncio.Event().wait() # The client does not disconnect.
+            sent = []
+            async def send(message):
+                sent.append(message)
+            await application(make_scope(method, path, query_string, headers), receive, send)
+            return (sent[0]['status'],
+                    {name.decode().lower(): value.decode() for name, value in sent[0]['headers']},
+                    b''.join(message.get('body', b'') for message in sent[1:]))
+
+        def add_chn_to_t2():
+            chief.begin_operation()
+            self.assertTrue(chief.tables['T2'].add_to_queue('CHN'))
+            chief.end_operation()
+
+        def add_chn_to_t3():
+            chief.begin_operation()
+            self.assertTrue(chief.tables['T3'].add_to_queue('CHN'))
+            chief.end_operation()
+
+        async def run():
+            status, _, _ = await request('GET', '/tables/get_all', headers=[])
+            self.assertEqual(status, 401)
+            status, headers, body = await request('GET', '/tables/get_all')
+            self.assertEqual(status, 200)
+            resp = json.loads(body)
+            last_update = resp['last_update']
+            self.assertEqual(last_update, chief.history_manager.operations_num)
+            self.assertEqual(len(json.loads(resp['tables'])), 4)
+            status, _, _ = await request('GET', '/tables/get_all', headers=credentials +
+                                         [(b'if-none-match', headers['etag'].encode())])
+            self.assertEqual(status, 304)
+            status, _, body = await request('GET', '/tables/get_all',
+                                            'last_update={0}'.format(last_update).encode())
+            self.assertFalse(json.loads(body)['changed'])
+
+            # The other requests, as the operations, go to the Flask application.
+            status, _, body = await request('POST', '/login')
+            token = json.loads(body)['token']
+            status, _, body = await request('POST', '/table/T2/add_to_queue',
+                                            headers=[(b'authorization', b'Bearer ' + token.encode())],
+                                            body=json.dumps({'team': 'IND'}).encode())
+            self.assertEqual(status, 200)
+            self.assertFalse(json.loads(body)['ok'])
+            status, _, body = await request('GET', '/table/T2/get_queue', headers=[])
+            self.assertEqual(status, 401)
+            status, _, body = await request('GET', '/tables/get_all',
+                                            'since={0}&token={1}'.format(last_update, token).encode(),
+                                            headers=[])
+            self.assertFalse(json.loads(body)['changed'])
+
+            # The stream is woken up by the operations of the other threads.
+            received = asyncio.Queue()
+            sent = asyncio.Queue()
+            stream = asyncio.ensure_future(application(
+                make_scope('GET', '/tables/stream', 'token={0}'.format(token).encode(), []),
+                received.get, sent.put))
+            self.assertEqual((await sent.get())['status'], 200)
+            self.assertEqual((await sent.get())['body'], b'retry: 10000\n\n')
+            event = (await sent.get())['body'].decode().split('\n')
+            self.assertEqual(event[0], 'id: {0}'.format(last_update))
+            start = time.monotonic()
+            threading.Thread(target=add_chn_to_t2).start()
+            event = (await asyncio.wait_for(sent.get(), 5))['body'].decode().split('\n')
+            self.assertLess(time.monotonic() - start, 5)
+            self.assertEqual(event[0], 'id: {0}'.format(last_update + 1))
+            data = json.loads(event[2][len('data: '):])
+            self.assertEqual(data['tables'][0]['queue'], ['ITA', 'ENG', 'IND', 'CHN'])
+            await received.put({'type': 'http.disconnect'})
+            await asyncio.wait_for(stream, 5)
+
+            # The long polls wait on the event loop too.
+            status, _, body = await request('GET', '/tables/get_all',
+                                            'last_update={0}&wait=0.1'.format(last_update + 1).encode())
+            self.assertFalse(json.loads(body)['changed'])
+            threading.Timer(0.1, add_chn_to_t3).start()
+            status, _, body = await asyncio.wait_for(request(
+                'GET', '/tables/get_all', 'since={0}&wait=10'.format(last_update + 1).encode()), 5)
+            resp = json.loads(body)
+            self.assertEqual(resp['last_update'], last_update + 2)
+            self.assertEqual([table['name'] for table in json.loads(resp['tables'])], ['T3'])
+
+            status, _, body = await request('GET', '/tables/get_all',
+                                            'since={0}'.format(last_update).encode())
+            resp = json.loads(body)
+            self.assertTrue(resp['partial'])
+            self.assertEqual(sorted(table['name'] for table in json.loads(resp['tables'])),
+                             ['T2', 'T3'])
+
+        asyncio.run(run())
+
     def test_views_history(self):
         cohmo.views.init_chief()
         cohmo.views.init_authentication_manager()
         client = cohmo.app.test_client()
         headers = self.headers
 
+        # Only the authenticated operations take the lock of the state.
+        with patch.object(cohmo.views.chief, 'begin_operation',
+                          side_effect=cohmo.views.chief.begin_operation) as begin_operation:
+            self.assertEqual(client.post('/history/delete', headers={},
+                                         data=json.dumps({'correction_id': 'ID1'})).status_code, 401)
+            self.assertEqual(client.post('/login', headers=headers).status_code, 200)
+            begin_operation.assert_not_called()
+            resp = json.loads(client.post('/history/delete', headers=headers,
+                                          data=json.dumps({'correction_id': 'NOWAY'})).data)
+            self.assertFalse(resp['ok'])
+            begin_operation.assert_called_once()
+
         # Testing history_add.
         resp = json.loads(client.post('/history/add', headers=headers,
                                       data=json.dumps({'pippo': 'ITA'})).data)
@@ -678,5 +1978,86 @@ class CohmoTestCase(unittest.TestCase):
                                       'id': 'ID1'})
         
 
+# The same tests, with the tables and the history stored in a SQLite database.
+class CohmoSQLiteTestCase(CohmoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.set_config(STORAGE_BACKEND='sqlite', SQLITE_FILE_PATH=generate_tempfile(''))
+        self.addCleanup(self.remove_database)
+        storage = SQLiteStorage(cohmo.app.config['SQLITE_FILE_PATH'])
+        storage.import_from_files(cohmo.app.config['TABLE_FILE_PATHS'],
+                                  cohmo.app.config['HISTORY_FILE_PATH'])
+        storage.close()
+
+    def remove_database(self):
+        for suffix in ['', '-wal', '-shm']:
+            remove_if_exists(cohmo.app.config['SQLITE_FILE_PATH'] + suffix)
+
+    def test_journal(self):
+        self.skipTest('The journal can not be used with the sqlite storage.')
+
+    def test_journal_compaction_crash(self):
+        self.skipTest('The journal can not be used with the sqlite storage.')
+
+    def test_journal_batch(self):
+        self.skipTest('The journal can not be used with the sqlite storage.')
+
+    def test_deferred_persistence(self):
+        self.skipTest('The deferred persistence can not be used with the sqlite storage.')
+
+    def test_backups(self):
+        self.skipTest('The backups are kept only for the files.')
+
+    def test_state_snapshot(self):
+        self.skipTest('The state snapshot is used only with the files.')
+
+    # It uses the files directly, and mock_time can not be reused.
+    def test_get_expected_duration(self):
+        self.skipTest('It does not depend on the storage.')
+
+    def test_sqlite_storage(self):
+        chief = self.get_chief()
+        self.assertEqual(chief.tables['T8'].current_coordination_team, 'USA')
+        chief.begin_operation()
+        self.assertTrue(chief.tables['T2'].add_to_queue('CHN'))
+        self.assertTrue(chief.tables['T8'].finish_coordination())
+        self.assertTrue(chief.history_manager.delete('ID2'))
+        chief.end_operation()
+        chief.close()
+
+        # The state is read back from the database.
+        chief = self.get_chief()
+        self.assertEqual(chief.tables['T2'].queue, ['ITA', 'ENG', 'IND', 'CHN'])
+        self.assertEqual(chief.tables['T8'].status, TableStatus.VACANT)
+        self.assertEqual(len(chief.history_manager.corrections), 4)
+        self.assertEqual(chief.history_manager.get_corrections({'identifier': 'ID2'}), [])
+        self.assertEqual(len(chief.history_manager.get_corrections({'table': 'T8'})), 1)
+        chief.close()
+
+        # Exporting to files and importing them back.
+        table_paths = {name: self.generate_tempfile() for name in cohmo.app.config['TABLE_FILE_PATHS']}
+        history_path = self.generate_tempfile()
+        storage = SQLiteStorage(cohmo.app.config['SQLITE_FILE_PATH'])
+        # A failed write leaves the previous files untouched.
+        with patch('cohmo.persister.os.replace', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                storage.export_to_files(table_paths, history_path)
+        for path in list(table_paths.values()) + [history_path]:
+            with open(path) as exported_file:
+                self.assertEqual(exported_file.read(), '')
+            temporary_path = '{0}.{1}.tmp'.format(path, os.getpid())
+            if os.path.exists(temporary_path): os.unlink(temporary_path)
+        storage.export_to_files(table_paths, history_path)
+        history = HistoryManager(history_path)
+        self.assertEqual(len(history.corrections), 4)
+        self.assertEqual(list(history.corrections.values())[0].id, 'ID1')
+        table = Table(table_paths['T2'], history, app.config)
+        self.assertEqual(table.queue, ['ITA', 'ENG', 'IND', 'CHN'])
+        storage.import_from_files(table_paths, history_path)
+        self.assertEqual(storage.load_table('T2')['queue'], ['ITA', 'ENG', 'IND', 'CHN'])
+        self.assertEqual(len(storage.load_corrections()), 4)
+        storage.close()
+
+
 if __name__ == '__main__':
     unittest.main()